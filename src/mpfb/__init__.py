@@ -32,7 +32,7 @@ _LOG = None
 # importing here is to just make sure everything is up and running
 # pylint: disable=W0611
 
-import bpy, os, sys, traceback
+import bpy, os, sys, time, traceback
 from bpy.utils import register_class
 
 _OLD_EXCEPTHOOK = None
@@ -68,10 +68,32 @@ def get_preference(name):
 
 ClassManager = None
 
+def _discover_mh_user_data():
+    """Ask MakeHuman, via the socket, where its user data is."""
+    from mpfb.services.locationservice import LocationService
+    from mpfb.services.socketservice import SocketService
+    try:
+        mh_user_dir = SocketService.get_user_dir()
+        _LOG.info("Socket service says makeHuman user dir is at", mh_user_dir)
+        if mh_user_dir and os.path.exists(mh_user_dir):
+            mh_user_data = os.path.join(mh_user_dir, "data")
+            LocationService.update_mh_user_data_if_relevant(mh_user_data)
+    except OSError as err:
+        _LOG.error("Could not read mh_user_dir. Maybe socket server is down? Error was:", err)
+
+def _resolve_mh_user_data():
+    """Timer callback which runs the deferred MakeHuman user data discovery, if it has not already run."""
+    from mpfb.services.locationservice import LocationService
+    LocationService.get_mh_user_data()
+    return None
+
 def register():
     """At this point blender is ready enough for it to make sense to
     start initializing python singletons"""
 
+    from ._startupreport import start_import_timing, stop_import_timing, add_step, format_startup_report
+    start_import_timing()
+
     # Preferences will be needed before starting the rest of the addon
     from ._preferences import MpfbPreferences
     try:
@@ -118,25 +140,21 @@ def register():
     # We can now assume all relevant classes have been added to the
     # class manager singleton.
 
+    stop_import_timing()
+
     _LOG.debug("About to request class registration")
+    started = time.perf_counter()
     ClassManager.register_classes()
+    add_step("register classes", time.perf_counter() - started)
 
-    _LOG.debug("About to check if MakeHuman is online")
-
-    # Try to find out where the makehuman user data is at
+    # Try to find out where the makehuman user data is at. Asking MakeHuman over the socket may block
+    # for a while, so this is done the first time the user data is needed, or soon after startup if
+    # there is a UI.
     from mpfb.services.locationservice import LocationService
-    from mpfb.services.socketservice import SocketService
     if LocationService.is_mh_auto_user_data_enabled():
-        mh_user_dir = None
-        try:
-            mh_user_dir = SocketService.get_user_dir()
-            _LOG.info("Socket service says makeHuman user dir is at", mh_user_dir)
-            if mh_user_dir and os.path.exists(mh_user_dir):
-                mh_user_data = os.path.join(mh_user_dir, "data")
-                LocationService.update_mh_user_data_if_relevant(mh_user_data)
-        except ConnectionRefusedError as err:
-            _LOG.error("Could not read mh_user_dir. Maybe socket server is down? Error was:", err)
-            mh_user_dir = None
+        LocationService.defer_mh_user_data_discovery(_discover_mh_user_data)
+        if not bpy.app.background:
+            bpy.app.timers.register(_resolve_mh_user_data, first_interval=1.0)
 
     #===========================================================================
     # mh_sys_dir = None
@@ -149,6 +167,9 @@ def register():
     #===========================================================================
 
     _LOG.time("Number of milliseconds to run entire register() method:")
+    _LOG.info("Startup report", "\n" + format_startup_report())
+    if os.environ.get("MPFB_STARTUP_REPORT"):
+        print(format_startup_report())
     _LOG.info("MPFB initialization has finished.")
 
 
@@ -157,9 +178,19 @@ def unregister():
 
     global _LOG # pylint: disable=W0603
 
+    # One-shot startup timers which have not fired yet would otherwise run after the addon is gone
+    if bpy.app.timers.is_registered(_resolve_mh_user_data):
+        bpy.app.timers.unregister(_resolve_mh_user_data)
+    from mpfb.ui.model import cancel_pending_extra_sections_load
+    cancel_pending_extra_sections_load()
+
     _LOG.debug("About to unregister classes")
     global ClassManager
     ClassManager.unregister_classes()
 
+    # Do not leave open files and a flush thread behind if the addon is disabled or reloaded
+    from mpfb.services.logservice import LogService
+    LogService.close()
+
 
 __all__ = ["VERSION"]
@@ -14,6 +14,7 @@ class ClassManager:
 
     __stack = None  # use a class attribute as classes stack
     __isinitialized = False
+    __isregistered = False
 
     def __init__(self):
         if not type(self).__isinitialized:  # Ensure ClassManager is only registered once
@@ -40,6 +41,29 @@ class ClassManager:
             LOG.debug("Adding class", str(appendClass))
             cls.__stack.append(appendClass)
 
+    @classmethod
+    def add_and_register_classes_in_order(cls, orderedClasses):
+        """Add the classes which are not already managed, and if the other managed
+        classes have already been registered, register the classes so that they end
+        up in the given order. Blender lists panels in the order they were
+        registered, so classes in the list which are already registered get
+        unregistered and registered again. This is for classes which are created
+        after the addon has been registered."""
+        LOG.enter()
+        if cls.__stack is None:
+            raise RuntimeError("ClassManager is not initialized!")
+        if cls.__isregistered:
+            for managedClass in reversed(orderedClasses):
+                if managedClass in cls.__stack:
+                    LOG.debug("Unregistering class for reordering", str(managedClass))
+                    unregister_class(managedClass)
+        for orderedClass in orderedClasses:
+            if orderedClass not in cls.__stack:
+                cls.add_class(orderedClass)
+            if cls.__isregistered:
+                LOG.debug("Registering class", str(orderedClass))
+                register_class(orderedClass)
+
     @classmethod
     def register_classes(cls):
         """Iterate over all managed classes and ask blender to register
@@ -51,6 +75,7 @@ class ClassManager:
             for regClass in cls.__stack:
                 LOG.debug("Registering class", str(regClass))
                 register_class(regClass)
+            cls.__isregistered = True
 
     @classmethod
     def unregister_classes(cls):
@@ -63,3 +88,4 @@ class ClassManager:
             for uregClass in cls.__stack:
                 LOG.debug("Unregistering class", str(uregClass))
                 unregister_class(uregClass)
+            cls.__isregistered = False
@@ -0,0 +1,86 @@
+"""This module measures how long the import of each MPFB module takes during register(), so that slow
+module level initialization can be found. Times are exclusive, ie the time spent importing other MPFB
+modules is not included in the time of the module which imported them."""
+
+import sys, time
+from importlib.abc import MetaPathFinder
+from importlib.machinery import PathFinder
+
+_REPORT = []
+_STEPS = []
+
+# Time spent in nested MPFB imports while executing the current module
+_nested_time = 0.0
+
+
+class _TimingLoader:
+
+    def __init__(self, loader):
+        self._loader = loader
+
+    def __getattr__(self, name):
+        return getattr(self._loader, name)
+
+    def create_module(self, spec):
+        return self._loader.create_module(spec)
+
+    def exec_module(self, module):
+        global _nested_time # pylint: disable=W0603
+        outer_nested = _nested_time
+        _nested_time = 0.0
+        started = time.perf_counter()
+        try:
+            self._loader.exec_module(module)
+        finally:
+            elapsed = time.perf_counter() - started
+            _REPORT.append((module.__name__, elapsed - _nested_time))
+            _nested_time = outer_nested + elapsed
+
+
+class _TimingFinder(MetaPathFinder):
+
+    def find_spec(self, fullname, path, target=None):
+        if fullname != "mpfb" and not fullname.startswith("mpfb."):
+            return None
+        spec = PathFinder.find_spec(fullname, path, target)
+        if spec is not None and spec.loader is not None and hasattr(spec.loader, "exec_module"):
+            spec.loader = _TimingLoader(spec.loader)
+        return spec
+
+
+_FINDER = _TimingFinder()
+
+
+def start_import_timing():
+    """Start recording the time taken by imports of not yet loaded MPFB modules."""
+    if _FINDER not in sys.meta_path:
+        sys.meta_path.insert(0, _FINDER)
+
+
+def stop_import_timing():
+    if _FINDER in sys.meta_path:
+        sys.meta_path.remove(_FINDER)
+
+
+def add_step(name, seconds):
+    """Record the time taken by a named step of the registration which is not a module import."""
+    _STEPS.append((name, seconds))
+
+
+def get_startup_report():
+    """Return a dict with "modules", a list of (module name, seconds) tuples sorted with the slowest module first,
+    "steps", a list of (step name, seconds) tuples in the order they were run, and "total" in seconds."""
+    modules = sorted(_REPORT, key=lambda item: item[1], reverse=True)
+    total = sum(seconds for (_, seconds) in _REPORT) + sum(seconds for (_, seconds) in _STEPS)
+    return {"modules": modules, "steps": list(_STEPS), "total": total}
+
+
+def format_startup_report(max_modules=20):
+    """Return the startup report as a human readable table."""
+    report = get_startup_report()
+    lines = ["MPFB startup took {:.1f} ms".format(report["total"] * 1000.0)]
+    for (name, seconds) in report["steps"]:
+        lines.append("  step   " + name.ljust(60) + "{:8.1f} ms".format(seconds * 1000.0))
+    for (name, seconds) in report["modules"][:max_modules]:
+        lines.append("  module " + name.ljust(60) + "{:8.1f} ms".format(seconds * 1000.0))
+    return "\n".join(lines)
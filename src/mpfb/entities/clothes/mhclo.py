@@ -1,6 +1,7 @@
 """This module provides and information holder for MHCLO files."""
 
-import bpy, os, sys, json
+import bpy, os, sys, json, numpy, hashlib
+from collections import OrderedDict
 from mathutils import Vector
 from mpfb.services.objectservice import ObjectService
 from mpfb.services.logservice import LogService
@@ -10,8 +11,26 @@ _LOG = LogService.get_logger("entities.mhclo")
 
 _CONFIG_FILE = None
 
+# Bump this if the layout of the compiled files change, so that old compiled files are ignored
+_COMPILED_MHCLO_VERSION = 1
+_COMPILED_MHCLO_DIR = LocationService.get_user_cache("mhclo")
+_COMPILED_VERTS_DTYPE = numpy.dtype([("verts", "<i4", (3,)), ("weights", "<f4", (3,)), ("offsets", "<f4", (3,))])
+
+# Fully parsed MHCLO files, most recently used last. Values are Mhclo objects which are never
+# handed out directly, their fields are copied to the Mhclo being loaded.
+_LOADED_MHCLOS = OrderedDict()
+_LOADED_MHCLOS_MAX_SIZE = 64
+
+# Fields which are copied between parsed, compiled and loaded Mhclo objects
+_METADATA_FIELDS = ["obj_file", "x_scale", "y_scale", "z_scale", "author", "license", "name", "description",
+                    "basename", "weights_file", "material", "tags", "zdepth", "first", "delete", "delete_group", "uuid"]
+_ARRAY_FIELDS = ["vert_indices", "vert_weights", "vert_offsets", "delverts"]
+
 class Mhclo:
-    """A representation of the values of a MHCLO file."""
+    """A representation of the values of a MHCLO file. The vertex binding is kept as (N,3) arrays rather than
+    per vertex, where row i holds the three base mesh vertices, weights and offsets of clothes vertex i."""
+
+    __slots__ = _METADATA_FIELDS + _ARRAY_FIELDS + ["clothes"]
 
     def __init__(self):
         """Create an empty MHCLO object with default values."""
@@ -29,15 +48,35 @@ class Mhclo:
         self.tags = ""
         self.zdepth = 50
         self.first = 0
-        self.verts = {}
-        self.delverts = []
+        self.vert_indices = numpy.zeros((0, 3), dtype=numpy.int32)
+        self.vert_weights = numpy.zeros((0, 3), dtype=numpy.float32)
+        self.vert_offsets = numpy.zeros((0, 3), dtype=numpy.float32)
+        self.delverts = numpy.zeros(0, dtype=numpy.int32)
         self.delete = False
         self.delete_group = "Delete"
         self.uuid = None
+        self.clothes = None
+
+    @property
+    def verts(self):
+        """The vertex binding as a dict of dicts, keyed on clothes vertex number. This is built on each
+        access, so code which cares about speed should use the arrays instead."""
+        verts = dict()
+        for vertex_number in range(len(self.vert_indices)):
+            verts[vertex_number] = {
+                'verts': tuple(int(index) for index in self.vert_indices[vertex_number]),
+                'weights': tuple(float(weight) for weight in self.vert_weights[vertex_number]),
+                'offsets': Vector(tuple(float(offset) for offset in self.vert_offsets[vertex_number]))
+                }
+        return verts
 
     def load(self, mhclo_filename, *, only_metadata=False):
         """Populate settings from contents of a MHCLO file. This will not automatically load the
-        mesh or the materials."""
+        mesh or the materials.
+
+        Recently loaded files are served from memory, and otherwise from the compiled cache if there
+        is a compiled file for the current version of the MHCLO file. Only if neither is available
+        the text file is parsed, after which it is compiled for the next time."""
 
         if not mhclo_filename:
             raise ValueError('Cannot load empty file name')
@@ -45,10 +84,40 @@ class Mhclo:
         if not os.path.exists(mhclo_filename):
             raise IOError(mhclo_filename + " does not exist")
 
-        _LOG.debug("Will try to parse file", mhclo_filename)
-
         #realpath = os.path.realpath(os.path.expanduser(mhclo_filename))
         realpath = os.path.realpath(mhclo_filename)
+        stat = os.stat(realpath)
+        key = (realpath, stat.st_mtime_ns, stat.st_size)
+
+        if key in _LOADED_MHCLOS:
+            _LOADED_MHCLOS.move_to_end(key)
+            self._copy_fields_from(_LOADED_MHCLOS[key])
+            return
+
+        compiled_path = Mhclo.compiled_mhclo_path(realpath)
+        if os.path.exists(compiled_path + ".json"):
+            try:
+                self._load_compiled(compiled_path)
+                Mhclo._remember(key, self)
+                return
+            except (IOError, OSError, ValueError, KeyError) as err:
+                _LOG.warn("Failed to read compiled mhclo, will parse the source instead", (compiled_path, err))
+
+        if self._parse(realpath, mhclo_filename, only_metadata=only_metadata) is None:
+            return None
+
+        if not only_metadata:
+            try:
+                self._save_compiled(compiled_path)
+            except (IOError, OSError) as err:
+                _LOG.warn("Failed to write compiled mhclo", (compiled_path, err))
+            Mhclo._remember(key, self)
+
+    def _parse(self, realpath, mhclo_filename, *, only_metadata=False):
+        """Populate settings by parsing the text contents of a MHCLO file."""
+
+        _LOG.debug("Will try to parse file", mhclo_filename)
+
         folder = os.path.dirname(realpath)
 
         self.basename = os.path.splitext(realpath)[0]
@@ -61,10 +130,16 @@ class Mhclo:
 
         vn = 0
         status = ""
+        vert_rows = []
+        delverts = []
+
+        # There can be tens of thousands of lines, so don't even call the logger unless needed
+        log_lines = _LOG.debug_enabled()
 
         for line in fp:
             words= line.split()
-            _LOG.debug("Line", words)
+            if log_lines:
+                _LOG.debug("Line", words)
 
             l = len(words)
 
@@ -108,7 +183,7 @@ class Mhclo:
                     continue
                 if l == 1:
                     v = int(words[0])
-                    self.verts[vn] = {'verts': (v,v,v), 'weights': (1,0,0), 'offsets': Vector((0,0,0))}
+                    vert_rows.append((v, v, v, 1.0, 0.0, 0.0, 0.0, 0.0, 0.0))
                 else:
                     v0 = int(words[0])
                     v1 = int(words[1])
@@ -119,7 +194,7 @@ class Mhclo:
                     d0 = float(words[6])
                     d1 = float(words[7])
                     d2 = float(words[8])
-                    self.verts[vn] = {'verts': (v0,v1,v2), 'weights': (w0,w1,w2), 'offsets': Vector((d0,-d2,d1))}
+                    vert_rows.append((v0, v1, v2, w0, w1, w2, d0, -d2, d1))
                 vn += 1
                 continue
             elif status == 'd':
@@ -134,10 +209,10 @@ class Mhclo:
                         v1 = int(v)
                         if sequence:
                             for vn in range(v0,v1+1):
-                                self.delverts.append(vn)
+                                delverts.append(vn)
                             sequence = False
                         else:
-                            self.delverts.append(v1)
+                            delverts.append(v1)
                         v0 = v1
                 continue
 
@@ -175,6 +250,107 @@ class Mhclo:
 
         fp.close()
 
+        if vert_rows:
+            rows = numpy.array(vert_rows, dtype=numpy.float64)
+            self.vert_indices = rows[:, 0:3].astype(numpy.int32)
+            self.vert_weights = rows[:, 3:6].astype(numpy.float32)
+            self.vert_offsets = rows[:, 6:9].astype(numpy.float32)
+        self.delverts = numpy.array(delverts, dtype=numpy.int32)
+        return self
+
+    def _copy_fields_from(self, other):
+        for field in _METADATA_FIELDS + _ARRAY_FIELDS:
+            setattr(self, field, getattr(other, field))
+
+    @staticmethod
+    def _remember(key, mhclo):
+        """Put a copy of the given Mhclo in the in-process cache, evicting the least recently used if full."""
+        remembered = Mhclo()
+        remembered._copy_fields_from(mhclo)
+        # Arrays are shared between everyone loading the same file, so make sure nobody modifies them
+        for field in _ARRAY_FIELDS:
+            getattr(remembered, field).flags.writeable = False
+        _LOADED_MHCLOS[key] = remembered
+        while len(_LOADED_MHCLOS) > _LOADED_MHCLOS_MAX_SIZE:
+            _LOADED_MHCLOS.popitem(last=False)
+
+    @staticmethod
+    def compiled_mhclo_path(mhclo_filename):
+        """Return the path, minus extension, of the compiled files for the current version of the given MHCLO file.
+        The path depends on the location, modification time and size of the file, so an edited file will get a new
+        compiled version."""
+        realpath = os.path.realpath(mhclo_filename)
+        stat = os.stat(realpath)
+        key = "|".join([realpath, str(stat.st_mtime_ns), str(stat.st_size), str(_COMPILED_MHCLO_VERSION)])
+        return os.path.join(_COMPILED_MHCLO_DIR, hashlib.sha1(key.encode("utf-8")).hexdigest())
+
+    def _save_compiled(self, compiled_path):
+        """Write the compiled version of this Mhclo, as a JSON file with metadata and an npy file with the vertex binding."""
+        if not os.path.exists(_COMPILED_MHCLO_DIR):
+            os.makedirs(_COMPILED_MHCLO_DIR, exist_ok=True)
+
+        compiled = numpy.zeros(len(self.vert_indices), dtype=_COMPILED_VERTS_DTYPE)
+        compiled["verts"] = self.vert_indices
+        compiled["weights"] = self.vert_weights
+        compiled["offsets"] = self.vert_offsets
+
+        metadata = dict()
+        for field in _METADATA_FIELDS:
+            metadata[field] = getattr(self, field)
+        metadata["delverts"] = self.delverts.tolist()
+
+        # Write to temporary files and rename, so that a concurrent reader never sees half a file. The
+        # JSON file is written last, since its existence is what marks the compiled version as present.
+        temp_npy = compiled_path + "." + str(os.getpid()) + ".tmp.npy"
+        with open(temp_npy, "wb") as npy_file:
+            numpy.save(npy_file, compiled)
+        os.replace(temp_npy, compiled_path + ".npy")
+
+        temp_json = compiled_path + "." + str(os.getpid()) + ".tmp.json"
+        with open(temp_json, "w", encoding="utf-8") as json_file:
+            json.dump(metadata, json_file)
+        os.replace(temp_json, compiled_path + ".json")
+
+    def _load_compiled(self, compiled_path):
+        """Populate settings from compiled files. The vertex binding arrays are read fully and made read-only,
+        so that no file handle is kept open on the cache."""
+        with open(compiled_path + ".json", "r", encoding="utf-8") as json_file:
+            metadata = json.load(json_file)
+        compiled = numpy.load(compiled_path + ".npy")
+        if compiled.dtype != _COMPILED_VERTS_DTYPE:
+            raise ValueError("Unexpected dtype in compiled mhclo")
+        for field in _METADATA_FIELDS:
+            value = metadata[field]
+            # JSON does not know about tuples
+            if isinstance(value, list):
+                value = tuple(value)
+            setattr(self, field, value)
+        self.vert_indices = numpy.ascontiguousarray(compiled["verts"])
+        self.vert_weights = numpy.ascontiguousarray(compiled["weights"])
+        self.vert_offsets = numpy.ascontiguousarray(compiled["offsets"])
+        self.delverts = numpy.array(metadata["delverts"], dtype=numpy.int32)
+        for field in _ARRAY_FIELDS:
+            getattr(self, field).flags.writeable = False
+
+    @staticmethod
+    def clear_compiled_mhclos():
+        """Forget all loaded MHCLO files and remove all compiled files from the cache."""
+        _LOADED_MHCLOS.clear()
+        if not os.path.exists(_COMPILED_MHCLO_DIR):
+            return
+        for filename in os.listdir(_COMPILED_MHCLO_DIR):
+            if filename.endswith(".json") or filename.endswith(".npy"):
+                try:
+                    os.remove(os.path.join(_COMPILED_MHCLO_DIR, filename))
+                except OSError as err:
+                    # Most likely the file is being written by another process (on windows)
+                    _LOG.warn("Could not remove compiled mhclo", (filename, err))
+
+    def get_binding_arrays(self):
+        """Return the vertex binding as a tuple of three (N,3) arrays in clothes vertex order: the int32
+        indices of the base mesh vertices, the float32 weights of these and the float32 offsets."""
+        return (self.vert_indices, self.vert_weights, self.vert_offsets)
+
     def load_mesh(self, context):
 
         if self.obj_file == "" or not self.obj_file:
@@ -1,48 +1,274 @@
-import time
+"""Simple instrumentation for timing code sections. Get a profiler for a subsystem with PrimitiveProfiler(name) and
+mark sections either with enter(location)/leave(location) pairs, with "with profiler.section(location):" or by
+decorating a function with @profiler.profile(). Sections can be nested, also recursively.
+
+Nothing is recorded unless profiling has been enabled with start_profiling() (or by setting the MPFB_PROFILE
+environment variable), so the instrumentation can be left in place. While enabled, all profilers share a single
+event log, which can be exported with export_chrome_trace() (for chrome://tracing or https://ui.perfetto.dev) or
+with export_speedscope() (for https://www.speedscope.app)."""
+
+import os, json, time, threading, functools
 
 _registered_profilers = dict()
 
+_enabled = bool(os.environ.get("MPFB_PROFILE"))
+
+# The event log: tuples of ("B" or "E", profiler name, location, perf_counter_ns, thread ident). The log
+# is capped so that a forgotten profiling session does not eat all memory.
+_events = []
+_MAX_EVENTS = 2000000
+_dropped_events = 0
+
+# Per thread stack of open sections, as lists of (profiler, location, start time)
+_stacks = threading.local()
+
+
+def _get_stack():
+    stack = getattr(_stacks, "stack", None)
+    if stack is None:
+        stack = []
+        _stacks.stack = stack
+    return stack
+
+
+def _log_event(phase, profiler_name, location, timestamp):
+    global _dropped_events # pylint: disable=W0603
+    if len(_events) < _MAX_EVENTS:
+        _events.append((phase, profiler_name, location, timestamp, threading.get_ident()))
+    else:
+        _dropped_events = _dropped_events + 1
+
+
+def _close_sections(stack, index, timestamp):
+    """Close all sections from index and up in the stack."""
+    while len(stack) > index:
+        (profiler, location, started) = stack.pop()
+        _log_event("E", profiler.name, location, timestamp)
+        if location not in profiler.completed:
+            profiler.completed[location] = []
+        profiler.completed[location].append((timestamp - started) / 1e9)
+
+
+class _Section:
+    """Context manager for a section, see _PrimitiveProfiler.section()"""
+
+    __slots__ = ["profiler", "location"]
+
+    def __init__(self, profiler, location):
+        self.profiler = profiler
+        self.location = location
+
+    def __enter__(self):
+        self.profiler.enter(self.location)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.profiler.leave(self.location)
+        return False
+
+
+class _NullSection:
+    """Context manager which does nothing, used while profiling is disabled"""
+
+    __slots__ = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_NULL_SECTION = _NullSection()
+
+
 class _PrimitiveProfiler:
 
-    def __init__(self):
-        self.entered = dict()
+    def __init__(self, name=""):
+        self.name = name
         self.completed = dict()
 
     def enter(self, location):
-        if location in self.entered:
-            print(location + " fanns redan!")
-        self.entered[location] = time.time()
+        if not _enabled:
+            return
+        timestamp = time.perf_counter_ns()
+        _get_stack().append((self, location, timestamp))
+        _log_event("B", self.name, location, timestamp)
 
     def leave(self, location):
-        if not location in self.entered:
-            print(location + " fanns inte!")
+        if not _enabled:
             return
-        if not location in self.completed:
-            self.completed[location] = []
-        self.completed[location].append(time.time() - self.entered[location])
-        del self.entered[location]
+        timestamp = time.perf_counter_ns()
+        stack = _get_stack()
+
+        # Find the innermost open section with this location. Sections opened after it, which were never
+        # left (for example because of an exception or an early return), are closed at the same time.
+        for index in range(len(stack) - 1, -1, -1):
+            if stack[index][0] is self and stack[index][1] == location:
+                break
+        else:
+            # Most likely the section was entered before profiling was enabled
+            return
+
+        _close_sections(stack, index, timestamp)
+
+    def section(self, location):
+        """Return a context manager which times the code in the with block."""
+        if not _enabled:
+            return _NULL_SECTION
+        return _Section(self, location)
+
+    def profile(self, location=None):
+        """Return a decorator which times each call to the decorated function. The location defaults to the
+        name of the function."""
+        def decorator(function):
+            name = location or function.__name__
+
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                if not _enabled:
+                    return function(*args, **kwargs)
+                self.enter(name)
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    self.leave(name)
+            return wrapper
+        return decorator
+
+    def get_stats(self):
+        """Return a dict with count, total, min and max time in seconds per completed location. Note that
+        time spent in recursive calls is included in the total of each level."""
+        stats = dict()
+        for name, completed in self.completed.items():
+            stats[name] = {"count": len(completed), "total": sum(completed), "min": min(completed), "max": max(completed)}
+        return stats
+
+    def reset(self):
+        self.completed.clear()
 
     def dump(self):
-        for name in self.completed:
+        for name, stats in self.get_stats().items():
             out = "  " + name.ljust(60)
-            out = out + str("count=" + str(len(self.completed[name]))).ljust(20)
-            total = 0.0
-            max = 0.0
-            min = 40000.0
-            for completed in self.completed[name]:
-                total = total + completed
-                if completed < min:
-                    min = completed
-                if completed > max:
-                    max = completed
-            out = out + str("total=" + str(round(total,4))).ljust(15)
-            out = out + str("min=" + str(round(min,4))).ljust(15)
-            out = out + str("max=" + str(round(max,4))).ljust(15)
-            out = out + str("avg=" + str(round(total / len(self.completed[name]),4))).ljust(15)
+            out = out + str("count=" + str(stats["count"])).ljust(20)
+            out = out + str("total=" + str(round(stats["total"], 4))).ljust(15)
+            out = out + str("min=" + str(round(stats["min"], 4))).ljust(15)
+            out = out + str("max=" + str(round(stats["max"], 4))).ljust(15)
+            out = out + str("avg=" + str(round(stats["total"] / stats["count"], 4))).ljust(15)
             print(out)
 
+
 def PrimitiveProfiler(name):
     global _registered_profilers
     if not name in _registered_profilers:
-        _registered_profilers[name] = _PrimitiveProfiler()
+        _registered_profilers[name] = _PrimitiveProfiler(name)
     return _registered_profilers[name]
+
+
+def get_registered_profilers():
+    return dict(_registered_profilers)
+
+
+def is_profiling_enabled():
+    return _enabled
+
+
+def start_profiling(clear=True):
+    """Enable recording in all profilers. Unless clear is False, earlier results and events are discarded."""
+    global _enabled # pylint: disable=W0603
+    if clear:
+        clear_profiles()
+    _enabled = True
+
+
+def stop_profiling():
+    """Disable recording. Sections which are still open in the current thread are closed."""
+    global _enabled # pylint: disable=W0603
+    _close_sections(_get_stack(), 0, time.perf_counter_ns())
+    _enabled = False
+
+
+def clear_profiles():
+    """Discard all recorded events and stats."""
+    global _dropped_events # pylint: disable=W0603
+    for profiler in _registered_profilers.values():
+        profiler.reset()
+    _get_stack().clear()
+    _events.clear()
+    _dropped_events = 0
+
+
+def get_trace_events():
+    """Return a copy of the event log, see _events."""
+    return list(_events)
+
+
+def _balanced_events():
+    """Return the event log with end events added for sections which are still open, so that every "B" has a
+    matching "E". This can happen for sections open in other threads, or when exporting while profiling."""
+    events = list(_events)
+    if not events:
+        return events
+    last_timestamp = max(event[3] for event in events)
+    open_sections = dict()
+    for (phase, profiler_name, location, timestamp, thread) in events:
+        thread_stack = open_sections.setdefault(thread, [])
+        if phase == "B":
+            thread_stack.append((profiler_name, location))
+        elif thread_stack:
+            thread_stack.pop()
+    for thread, thread_stack in open_sections.items():
+        for (profiler_name, location) in reversed(thread_stack):
+            events.append(("E", profiler_name, location, last_timestamp, thread))
+    return events
+
+
+def export_chrome_trace(filename):
+    """Write the event log in the Chrome trace event format."""
+    pid = os.getpid()
+    trace_events = []
+    for (phase, profiler_name, location, timestamp, thread) in _balanced_events():
+        trace_events.append({
+            "name": location,
+            "cat": profiler_name,
+            "ph": phase,
+            "ts": timestamp / 1000.0,
+            "pid": pid,
+            "tid": thread
+            })
+    trace = {"traceEvents": trace_events, "displayTimeUnit": "ms", "otherData": {"dropped_events": _dropped_events}}
+    with open(filename, "w", encoding="utf-8") as json_file:
+        json.dump(trace, json_file)
+
+
+def export_speedscope(filename, name="MPFB"):
+    """Write the event log in the speedscope file format, with one evented profile per thread."""
+    frames = []
+    frame_indices = dict()
+    profiles = dict()
+    for (phase, profiler_name, location, timestamp, thread) in _balanced_events():
+        key = profiler_name + "." + location if profiler_name else location
+        if key not in frame_indices:
+            frame_indices[key] = len(frames)
+            frames.append({"name": key})
+        if thread not in profiles:
+            profiles[thread] = {
+                "type": "evented",
+                "name": name + " (thread " + str(thread) + ")",
+                "unit": "nanoseconds",
+                "startValue": timestamp,
+                "endValue": timestamp,
+                "events": []
+                }
+        profile = profiles[thread]
+        profile["events"].append({"type": "O" if phase == "B" else "C", "frame": frame_indices[key], "at": timestamp})
+        profile["endValue"] = timestamp
+    speedscope = {
+        "$schema": "https://www.speedscope.app/file-format-schema.json",
+        "name": name,
+        "exporter": "mpfb",
+        "shared": {"frames": frames},
+        "profiles": list(profiles.values())
+        }
+    with open(filename, "w", encoding="utf-8") as json_file:
+        json.dump(speedscope, json_file)
@@ -5,17 +5,36 @@ import bmesh
 from mpfb.services.logservice import LogService
 from mpfb.services.objectservice import ObjectService
 from mpfb.services.rigservice import RigService
+from mpfb.services.meshservice import MeshService
 from mpfb.entities.objectproperties import GeneralObjectProperties
 
-import bpy, math, json, random, typing, re
+import bpy, os, math, json, typing, re, numpy
 
 from bl_math import lerp
+from types import MappingProxyType
+from collections.abc import Mapping
 from itertools import accumulate
 from mathutils import Vector, Matrix, Euler, Quaternion
 from mathutils.kdtree import KDTree
 
 _LOG = LogService.get_logger("entities.rig")
 
+# Vertex KDTrees of recently used meshes, keyed on object pointer, with the coordinates they were built
+# from. Rig instances for the same unchanged mesh (such as the parent rig built for every subrig refit)
+# can then share the tree instead of building a new one.
+_VERTEX_TREES = dict()
+_MAX_VERTEX_TREES = 8
+
+# Vertex indices of the joint vertex groups of recently used meshes, keyed on mesh data pointer, vertex
+# count and vertex group names. Joint groups follow the basemesh topology, so they are shared by all refits
+# of a human rather than being extracted again from the vertices every time.
+_JOINT_VERTEX_GROUPS = dict()
+_MAX_JOINT_VERTEX_GROUPS = 8
+
+# Parsed and upgraded rig files, keyed on real path, with the (mtime, size) stamp they were read at.
+# The cached headers are frozen, so that every Rig loaded from the same file can share them.
+_RIG_DEFINITIONS = dict()
+
 _MAX_ALLOWED_DIST = 0.01
 _MAX_DIST_TO_CONSIDER_EXACT = 0.001
 _STRATEGY_REPLACE_THRESHOLD = 0.0001
@@ -53,31 +72,15 @@ class Rig:
         """Create an instance of Rig and populate it with information from the json file and from the base mesh."""
         rig = Rig(basemesh, parent=parent)
 
-        with open(filename, "r") as json_file:
-            json_data = json.load(json_file)
-
-            if "bones" in json_data:
-                if "version" not in json_data:
-                    raise ValueError("Invalid rig file format")
-
-                if "joints" in json_data:
-                    raise ValueError("MPFB is not compatible with mhskel files")
-
-                if json_data.get("is_subrig", False) and not parent:
-                    raise ValueError("Attempting to load a sub-rig without a parent")
+        rig_header = Rig.load_rig_definition(filename)
 
-                rig.rig_header = json_data
-                rig.rig_definition = json_data["bones"]
+        if rig_header.get("is_subrig", False) and not parent:
+            raise ValueError("Attempting to load a sub-rig without a parent")
 
-            else:
-                rig.rig_header["version"] = 100
-                rig.rig_definition.update(json_data)
-
-        if rig._upgrade_definition():
-            _LOG.debug("Upgraded the rig definition version")
-
-            # with open(filename + ".new", "w") as json_file:
-            #     json.dump(rig.rig_header, json_file, indent=4, sort_keys=True)
+        # Only the top level of the header is copied, the bone definitions stay shared and read-only
+        rig.rig_header = dict(rig_header)
+        rig.rig_header.setdefault("is_subrig", bool(parent))
+        rig.rig_definition = rig_header["bones"]
 
         if rig.rig_header.get("scale_factor"):
             scale_factor = GeneralObjectProperties.get_value(
@@ -88,15 +91,56 @@ class Rig:
         rig.build_basemesh_position_info()
         return rig
 
+    @staticmethod
+    def load_rig_definition(filename):
+        """Return the parsed and upgraded header of a rig json file as a read-only mapping. The result is
+        cached until the file changes on disk, so use dict() on the parts that need to be modified."""
+        path = os.path.realpath(filename)
+        stat = os.stat(path)
+        stamp = (stat.st_mtime_ns, stat.st_size)
+
+        cached = _RIG_DEFINITIONS.get(path)
+        if cached and cached[0] == stamp:
+            return cached[1]
+
+        with open(path, "r") as json_file:
+            json_data = json.load(json_file)
+
+        if "bones" in json_data:
+            if "version" not in json_data:
+                raise ValueError("Invalid rig file format")
+
+            if "joints" in json_data:
+                raise ValueError("MPFB is not compatible with mhskel files")
+
+            rig_header = json_data
+
+        else:
+            rig_header = {"bones": json_data, "version": 100}
+
+        if Rig._upgrade_header(rig_header):
+            _LOG.debug("Upgraded the rig definition version")
+
+            # with open(filename + ".new", "w") as json_file:
+            #     json.dump(rig_header, json_file, indent=4, sort_keys=True)
+
+        rig_header = _freeze(rig_header)
+        _RIG_DEFINITIONS[path] = (stamp, rig_header)
+        return rig_header
+
     def _upgrade_definition(self):
-        version = self.rig_header["version"]
+        return Rig._upgrade_header(self.rig_header)
+
+    @staticmethod
+    def _upgrade_header(rig_header):
+        version = rig_header["version"]
         if version == CUR_VERSION:
             return False
 
         if version > CUR_VERSION:
             raise ValueError(f"The rig file format version is too high: {version}")
 
-        self.rig_header["version"] = CUR_VERSION
+        rig_header["version"] = CUR_VERSION
         return True
 
     @staticmethod
@@ -253,6 +297,60 @@ class Rig:
             location = head_or_tail_info["default_position"]
         return location
 
+    @staticmethod
+    def find_bones_depending_on_vertices(rig_definition, basemesh, changed_vertices):
+        """Return the names of the bones in the rig definition whose head or tail position strategy uses
+        a basemesh vertex flagged in the changed_vertices boolean array. For CUBE strategies, this means
+        any vertex in the joint vertex group."""
+        vertex_count = len(changed_vertices)
+        joint_groups = None
+        cube_changed = dict()
+        bone_names = set()
+
+        for bone_name, bone_info in rig_definition.items():
+            for end in ["head", "tail"]:
+                info = bone_info[end]
+                strategy = info["strategy"]
+                if strategy == "CUBE":
+                    cube_name = info["cube_name"]
+                    if cube_name not in cube_changed:
+                        if joint_groups is None:
+                            joint_groups = Rig.get_joint_vertex_groups(basemesh)
+                        cube_changed[cube_name] = cube_name in joint_groups and \
+                            bool(changed_vertices[joint_groups[cube_name]].any())
+                    depends = cube_changed[cube_name]
+                elif strategy in ["VERTEX", "MEAN", "XYZ"]:
+                    indices = [info["vertex_index"]] if strategy == "VERTEX" else info["vertex_indices"]
+                    depends = any(index < vertex_count and changed_vertices[index] for index in indices)
+                else:
+                    depends = False
+                if depends:
+                    bone_names.add(bone_name)
+                    break
+
+        return bone_names
+
+    @staticmethod
+    def get_joint_vertex_groups(basemesh):
+        """Return a dict with the names of the joint vertex groups of the basemesh as keys and read-only arrays
+        of their vertex indices as values. The result is reused for as long as the mesh data, the vertex count
+        and the vertex group names stay the same."""
+        group_names = tuple(str(group.name) for group in basemesh.vertex_groups)
+        key = (basemesh.data.as_pointer(), len(basemesh.data.vertices), group_names)
+        if key in _JOINT_VERTEX_GROUPS:
+            return _JOINT_VERTEX_GROUPS[key]
+
+        joint_names = [name for name in group_names if "joint" in name]
+        joint_groups = dict()
+        for name, (vertex_indices, _weights) in MeshService.get_vertex_group_weights(basemesh, joint_names).items():
+            joint_groups[name] = vertex_indices
+
+        if len(_JOINT_VERTEX_GROUPS) >= _MAX_JOINT_VERTEX_GROUPS:
+            # Dicts keep insertion order, so this drops the oldest entry
+            del _JOINT_VERTEX_GROUPS[next(iter(_JOINT_VERTEX_GROUPS))]
+        _JOINT_VERTEX_GROUPS[key] = joint_groups
+        return joint_groups
+
     def _align_roll_by_strategy(self, bone, bone_info):
         self.apply_bone_roll_strategy(bone, bone_info.get("roll_strategy", None))
 
@@ -283,10 +381,13 @@ class Rig:
 
         bpy.ops.object.mode_set(mode='OBJECT', toggle=False)
 
-    def reposition_edit_bone(self, *, developer=False):
-        """Reposition bones to fit the current state of the basemesh."""
+    def reposition_edit_bone(self, *, developer=False, bone_names=None):
+        """Reposition bones to fit the current state of the basemesh. If bone_names is given, only
+        those bones are repositioned."""
         bpy.ops.object.mode_set(mode='EDIT', toggle=False)
         for bone_name in self.rig_definition.keys():
+            if bone_names is not None and bone_name not in bone_names:
+                continue
             bone_info = self.rig_definition[bone_name]
             bone = RigService.find_edit_bone_by_name(bone_name, self.armature_object)
             if bone:
@@ -418,11 +519,15 @@ class Rig:
         bpy.ops.object.mode_set(mode='OBJECT', toggle=False)
 
     def _apply_constraint_info(self, bone: bpy.types.PoseBone, info):
+        # The definition may be shared and read-only, while restoring parent refs updates the info
+        info = dict(info)
+
         con = bone.constraints.new(info["type"])
         con.name = info["name"]
 
         if isinstance(con, bpy.types.ArmatureConstraint):
             for tgt_info in info["targets"]:
+                tgt_info = dict(tgt_info)
                 tgt = con.targets.new()
 
                 if "target" in tgt_info:
@@ -452,7 +557,7 @@ class Rig:
 
             if target is True:
                 con.target = self.armature_object
-            elif isinstance(target, dict):
+            elif isinstance(target, Mapping):
                 con.target = self._restore_parent_ref(bone, target, info)
             else:
                 assert not target
@@ -471,7 +576,7 @@ class Rig:
 
     def _restore_parent_ref(self, bone: bpy.types.PoseBone, bone_ref: dict, info: dict):
         assert self.parent
-        assert isinstance(bone_ref, dict)
+        assert isinstance(bone_ref, Mapping)
 
         arm = self.parent.armature_object
         strategy = bone_ref["strategy"]
@@ -745,71 +850,41 @@ class Rig:
         self.position_info["cubes"] = dict()
         cubes = self.position_info["cubes"]
 
-        self.position_info["vertices"] = []
-        vertices = self.position_info["vertices"]
-
-        cube_groups = dict()
-        group_index_to_name = dict()
-
         basemesh: bpy.types.Object = self.basemesh
 
         assert isinstance(basemesh.data, bpy.types.Mesh)
 
+        if take_shape_keys_into_account and basemesh.mode == "EDIT" and basemesh.data.shape_keys \
+                and basemesh.data.shape_keys.key_blocks and len(basemesh.data.shape_keys.key_blocks) > 0:
+            if not basemesh.use_shape_key_edit_mode or basemesh.show_only_shape_key:
+                basemesh.use_shape_key_edit_mode = True
+                basemesh.show_only_shape_key = False
+                bpy.context.view_layer.update()
+
+            bm = bmesh.from_edit_mesh(basemesh.data)
+            coords = numpy.array([vertex.co for vertex in bm.verts], dtype=numpy.float32).reshape(-1, 3)
+        elif take_shape_keys_into_account:
+            coords = MeshService.get_mixed_vertex_coordinates(basemesh)
+        else:
+            coords = numpy.empty(len(basemesh.data.vertices) * 3, dtype=numpy.float32)
+            basemesh.data.vertices.foreach_get("co", coords)
+            coords = coords.reshape(-1, 3)
+
+        # The array is used for bulk operations, the list for looking up individual positions
+        self.position_info["vertex_coords"] = coords
+        self.position_info["vertices"] = coords.tolist()
+
         if self.parent:
             # Copy cube data from the parent rig if present
             cubes.update(self.parent.position_info["cubes"])
-        else:
-            # Start computing our own cube data
-            for group in basemesh.vertex_groups:
-                idx = int(group.index)
-                name = str(group.name)
-                if "joint" in name:
-                    cube_groups[name] = []
-                    group_index_to_name[idx] = name
-
-        coords = basemesh.data.vertices
-        shape_key = None
-        key_name = None
-
-        if take_shape_keys_into_account and basemesh.data.shape_keys and basemesh.data.shape_keys.key_blocks and len(basemesh.data.shape_keys.key_blocks) > 0:
-            if basemesh.mode == "EDIT":
-                if not basemesh.use_shape_key_edit_mode or basemesh.show_only_shape_key:
-                    basemesh.use_shape_key_edit_mode = True
-                    basemesh.show_only_shape_key = False
-                    bpy.context.view_layer.update()
-
-                bm = bmesh.from_edit_mesh(basemesh.data)
-                coords = bm.verts
-            else:
-                from mpfb.services.targetservice import TargetService
-                key_name = "temporary_fit_rig_key." + str(random.randrange(1000, 9999))
-                shape_key = TargetService.create_shape_key(basemesh, key_name, also_create_basis=True, create_from_mix=True)
-                coords = shape_key.data
-
-        for vertex in basemesh.data.vertices:
-            vertex_coords = list(coords[vertex.index].co) # Either actual vertex or the corresponding shape key point
-            vertices.append(vertex_coords)
-            for group in vertex.groups:
-                idx = int(group.group)
-                if idx in group_index_to_name:
-                    name = group_index_to_name[idx]
-                    cube_groups[name].append(vertex_coords)
-
-        if shape_key:
-            basemesh.shape_key_remove(shape_key)
-
-        _LOG.dump("cube_groups", cube_groups)
-
-        for name in group_index_to_name.values():
-            group = cube_groups[name]
-            sum_pos = [0.0, 0.0, 0.0]
-            for i in range(len(group)):
-                for n in range(3):
-                    sum_pos[n] = sum_pos[n] + group[i][n]
-            for n in range(3):
-                sum_pos[n] = sum_pos[n] / float(len(group))
-            cubes[name] = sum_pos
+            return
+
+        # Joint cubes are positioned at the mean of the vertices in their vertex groups
+        for name, vertex_indices in Rig.get_joint_vertex_groups(basemesh).items():
+            if len(vertex_indices) > 0:
+                cubes[name] = coords[vertex_indices].mean(axis=0, dtype=numpy.float64).tolist()
 
+        _LOG.dump("cubes", cubes)
 
     def add_data_bone_info(self):
         """Extract bone information from the bone data."""
@@ -1269,9 +1344,16 @@ class Rig:
             return self.position_info["vertices_tree"]
 
         vertices = self.position_info["vertices"]
+        coords = self.position_info.get("vertex_coords")
 
         assert len(vertices) > 0
 
+        key = self.basemesh.as_pointer() if self.basemesh else None
+        if coords is not None and key in _VERTEX_TREES and numpy.array_equal(_VERTEX_TREES[key][0], coords):
+            _LOG.debug("Reusing vertex tree")
+            vertex_tree = self.position_info["vertices_tree"] = _VERTEX_TREES[key][1]
+            return vertex_tree
+
         vertex_tree = self.position_info["vertices_tree"] = KDTree(len(vertices))
 
         for i, vert in enumerate(vertices):
@@ -1279,6 +1361,12 @@ class Rig:
 
         vertex_tree.balance()
 
+        if coords is not None and key is not None:
+            _VERTEX_TREES.pop(key, None)
+            if len(_VERTEX_TREES) >= _MAX_VERTEX_TREES:
+                del _VERTEX_TREES[next(iter(_VERTEX_TREES))]
+            _VERTEX_TREES[key] = (coords.copy(), vertex_tree)
+
         return vertex_tree
 
     def find_closest_vertex(self, pos, max_allowed_dist: float | None = _MAX_ALLOWED_DIST
@@ -1297,18 +1385,9 @@ class Rig:
         if "vertices_mean_scale" in self.position_info:
             return self.position_info["vertices_mean_scale"]
 
-        vertices = self.position_info["vertices"]
-
-        highest_z = -1000.0
-        lowest_z = 1000.0
+        heights = numpy.asarray(self.position_info["vertices"], dtype=numpy.float64)[:, 2]
 
-        for vertex in vertices:
-            if vertex[2] > highest_z:
-                highest_z = vertex[2]
-            if vertex[2] < lowest_z:
-                lowest_z = vertex[2]
-
-        total_height = abs(highest_z - lowest_z)
+        total_height = float(abs(heights.max() - heights.min()))
         _LOG.debug("total height", total_height)
 
         self.position_info["vertices_mean_scale"] = total_height
@@ -1379,3 +1458,12 @@ def matrix_from_axis_pair(y_axis, other_axis, axis_name):
         z_axis = x_axis.cross(y_axis)
 
     return Matrix((x_axis, y_axis, z_axis)).transposed()
+
+
+def _freeze(value):
+    """Recursively convert dicts to read-only mappings and lists to tuples."""
+    if isinstance(value, dict):
+        return MappingProxyType({key: _freeze(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return tuple(_freeze(item) for item in value)
+    return value
@@ -26,11 +26,12 @@ class SocketBodyObject(SocketMeshObject):
         SocketMeshObject.__init__(self, importer_presets=importer_presets, object_type="Basemesh")
         _LOG.debug("Constructing new socket body object")
 
-        self._object_info = SocketService.get_body_mesh_info()
+        mesh_data = SocketService.get_body_mesh_data()
+        self._object_info = mesh_data["mesh_info"]
         _LOG.dump("object_info", self._object_info)
-        self.arrange_vertices(SocketService.get_body_vertices())
-        self.arrange_faces(SocketService.get_body_faces())
-        self.arrange_uv_and_texco(SocketService.get_body_uv_mapping(), SocketService.get_body_texture_coords())
+        self.arrange_vertices(mesh_data["vertices"])
+        self.arrange_faces(mesh_data["faces"])
+        self.arrange_uv_and_texco(mesh_data["uv_mapping"], mesh_data["texture_coords"])
         self.arrange_face_group_arrays()
         if importer_presets["extra_vertex_groups"]:
             self.arrange_extra_vertex_groups()
@@ -45,11 +46,10 @@ class SocketBodyObject(SocketMeshObject):
             self.arrange_skeleton_info()
 
         if not self._skeleton_info is None and self._has_rig:
-            self._weight_info = SocketService.get_body_weight_info()
+            weight_data = SocketService.get_body_weight_data()
+            self._weight_info = weight_data["weight_info"]
             _LOG.dump("weight info", self._weight_info)
-            weights_vertices_data = SocketService.get_body_weight_vertices()
-            weights_data = SocketService.get_body_weights()
-            self.arrange_weights(weights_vertices_data, weights_data)
+            self.arrange_weights(weight_data["weight_vertices"], weight_data["weights"])
         else:
             _LOG.debug("No skeleton present, not importing weights")
 
@@ -148,12 +148,9 @@ class SocketBodyObject(SocketMeshObject):
                 # Only created detailed helper groups ("hair", "skirt"...) if requested
                 exclude = str(name).startswith("helper-") or str(name).startswith("joint-")
             if not exclude:
-                # Add all vertices to a new group, with a weight of 1.0
+                # Add all vertices to a new group, with their actual weights if we have imported any
                 vgroup = obj.vertex_groups.new(name=name)
-                vgroup.add(self._vertex_groups_by_name[name].tolist(), 1.0, 'ADD')
-
-                # Update weights with actual weight values
-                self.apply_vertex_weights_if_needed(mesh, vgroup)
+                self.populate_vertex_group(vgroup)
             else:
                 _LOG.debug("Not creating vertex group", name)
 
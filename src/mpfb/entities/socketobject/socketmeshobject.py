@@ -4,6 +4,7 @@ for more info."""
 
 import gc, numpy
 from mpfb.services.logservice import LogService
+from mpfb.services.meshservice import MeshService
 
 _LOG = LogService.get_logger("socketobject.socketmeshobject")
 
@@ -270,28 +271,20 @@ class SocketMeshObject:
         self._vertex_groups_by_name["Delete"] = verts_to_hide
 
 
-    def apply_vertex_weights_if_needed(self, mesh, vertex_group):
-        """Perform the actual weighting for a particular (blender) vertex group in the specified mesh."""
+    def populate_vertex_group(self, vertex_group):
+        """Add the vertices of the group with the same name as the (blender) vertex group, with their
+        imported weights if there are any, or else with a weight of 1.0."""
         _LOG.enter()
         name = vertex_group.name
-        if name not in self._vertex_groups_by_name:
-            _LOG.warn("Tried to apply vertex weights for a non-existing group:", name)
-            return
+        vertex_indices = self._vertex_groups_by_name[name]
         if name not in self._weights_by_name:
-            _LOG.debug("No weights for group:", name)
+            vertex_group.add(vertex_indices.tolist(), 1.0, 'ADD')
             return
-
-        # Here we expect that the vertex group already exist with the proper vertices
-        # already added, although with 1.0 as weight for all vertices. We will iterate
-        # over the two parallel arrays constructed in arrange_weights() and pick the
-        # vertex index from one and the weight from the other
-        # Having pre-added all vertices in one operation and then updating the weights
-        # is a lot faster than adding each vertex individually together with its weight.
-        for vertex_index, vertex_weight in zip(self._vertex_groups_by_name[name], self._weights_by_name[name]):
-            vertex = mesh.vertices[vertex_index]
-            for group in vertex.groups:
-                if group.group == vertex_group.index:
-                    group.weight = vertex_weight
+        weights = self._weights_by_name[name]
+        if len(weights) < len(vertex_indices):
+            vertex_group.add(vertex_indices.tolist(), 1.0, 'ADD')
+        length = min(len(vertex_indices), len(weights))
+        MeshService.add_weights_to_vertex_group(vertex_group, vertex_indices[:length], weights[:length], 'REPLACE')
 
     def create_uv_layer(self, mesh):
         """Create a new UV layer for the mesh, based on the uv and texco information
@@ -17,9 +17,11 @@ class SocketProxyObject(SocketMeshObject):
     to sort and transform things as far as possible in numpy before applying the
     data as a blender mesh object."""
 
-    def __init__(self, proxy_info, importer_presets=None, import_weights=False):
+    def __init__(self, proxy_info, importer_presets=None, import_weights=False, proxy_data=None):
         """Construct a SocketProxyObject and populate it with numpy data and other
-        info fetched from MH via socket."""
+        info fetched from MH via socket. If proxy_data is given, it should be the
+        data for this proxy as returned by SocketService.get_proxies_mesh_data(),
+        in which case nothing more is fetched."""
 
         SocketMeshObject.__init__(self, importer_presets=importer_presets, object_type=proxy_info["type"])
         _LOG.debug("Constructing new socket proxy object of type", proxy_info["type"])
@@ -51,20 +53,21 @@ class SocketProxyObject(SocketMeshObject):
 
         uuid = self._object_info["uuid"]
 
-        self.arrange_vertices(SocketService.get_proxy_vertices(uuid))
-        self.arrange_faces(SocketService.get_proxy_faces(uuid))
-        self.arrange_uv_and_texco(SocketService.get_proxy_uv_mapping(uuid), SocketService.get_proxy_texture_coords(uuid))
+        if proxy_data is None:
+            proxy_data = SocketService.get_proxies_mesh_data([uuid], include_weights=bool(import_weights))[uuid]
+
+        self.arrange_vertices(proxy_data["vertices"])
+        self.arrange_faces(proxy_data["faces"])
+        self.arrange_uv_and_texco(proxy_data["uv_mapping"], proxy_data["texture_coords"])
         self.arrange_face_group_arrays()
         self.arrange_face_mask_array()
         self.arrange_extra_vertex_groups()
 
         if import_weights:
             _LOG.debug("Will later attempt to weight proxy", self._object_info["name"])
-            self._weight_info = SocketService.get_proxy_weight_info(uuid)
+            self._weight_info = proxy_data["weight_info"]
             _LOG.dump("weight info", self._weight_info)
-            weights_vertices_data = SocketService.get_proxy_weight_vertices(uuid)
-            weights_data = SocketService.get_proxy_weights(uuid)
-            self.arrange_weights(weights_vertices_data, weights_data)
+            self.arrange_weights(proxy_data["weight_vertices"], proxy_data["weights"])
         else:
             _LOG.debug("Will not attempt to weight proxy", self._object_info["name"])
 
@@ -113,12 +116,9 @@ class SocketProxyObject(SocketMeshObject):
             polygon.use_smooth = True
 
         for name in self._vertex_groups_by_name:
-            # Add all vertices to a group, with a vertex weight of 1.0.
+            # Add all vertices to a group, with their actual weights if we have imported any
             vgroup = obj.vertex_groups.new(name=name)
-            vgroup.add(self._vertex_groups_by_name[name].tolist(), 1.0, 'ADD')
-
-            # Update vertex weights with actual weights
-            self.apply_vertex_weights_if_needed(mesh, vgroup)
+            self.populate_vertex_group(vgroup)
 
         self.create_uv_layer(obj.data)
 
@@ -1,19 +1,46 @@
 """This module contains utility functions scanning asset repositories."""
 
-import os, bpy, json
+import os, bpy, json, time, fnmatch, itertools
+from collections import OrderedDict
 from pathlib import Path
 from mpfb.services.objectservice import ObjectService
 from mpfb.services.logservice import LogService
 from mpfb.services.locationservice import LocationService
 from mpfb.services.uiservice import UiService
 from mpfb.services.systemservice import SystemService
+from mpfb.entities.clothes.mhclo import Mhclo
 
 _LOG = LogService.get_logger("services.assetservice")
 
 _ASSETS = dict()
-_ASSET_THUMBS = None
+_ASSET_LIST_GENERATIONS = dict()
 _PACKS = None
 
+# Thumbnails are loaded into the preview collection when they are first drawn, rather than when listing
+# assets. At most _MAX_LOADED_THUMBS are kept, the least recently drawn is released first.
+_ASSET_THUMBS = None
+_LOADED_THUMBS = OrderedDict()
+_MAX_LOADED_THUMBS = 1024
+
+# The file index maps each scanned root directory (such as <data root>/clothes or <data root>/targets) to
+# the directories below it, with their mtimes, files and subdirectories. It is persisted in the cache dir
+# and revalidated by comparing the mtimes of all directories in the tree, which is far cheaper than
+# walking the tree again. Only directories whose mtime has changed are listed again. The validation
+# itself is throttled, since a single MHM load can resolve dozens of assets in a row.
+_FILE_INDEX = None
+_FILE_INDEX_FILE = LocationService.get_user_cache("asset_file_index.json")
+_FILE_INDEX_RECHECK_SECONDS = 2.0
+_FILE_INDEX_GENERATION = itertools.count(1)
+_TARGET_EXTENSIONS = (".target", ".target.gz")
+
+# The mhclo catalog maps the full path of each mhclo/proxy file to its metadata (uuid, name, tags, fragment)
+# together with the mtime and size the metadata was read at. It is persisted in the cache dir, and an entry
+# is only re-read when its file has changed. The uuid index is built from the catalog per asset list.
+_MHCLO_CATALOG = None
+_MHCLO_CATALOG_FILE = LocationService.get_user_cache("mhclo_catalog.json")
+_MHCLO_CATALOG_RECHECK_SECONDS = 2.0
+_UUID_INDEX = dict()
+
 ASSET_LIBRARY_SECTIONS = [
         {
             "bl_label": "Topologies library",
@@ -103,10 +130,12 @@ class AssetService:
             _LOG.debug("Will examine asset root with pattern", (root, pattern))
             if root == "/":
                 raise IOError("Refusing to scan entire HD for assets")
+            if not os.path.exists(root):
+                continue
             count = 0
-            for path in Path(root).rglob(pattern):
-                if os.path.isfile(path):
-                    found_files.append(path)
+            for path in AssetService._get_file_index_entry(root)["files"]:
+                if fnmatch.fnmatch(os.path.basename(path), pattern):
+                    found_files.append(Path(path))
                     count = count + 1
             _LOG.debug("File matches in root", (count, root))
         _LOG.debug("Total matching files for all roots", len(found_files))
@@ -117,6 +146,299 @@ class AssetService:
                 _LOG.debug("Root exists", (root, os.path.exists(root)))
         return found_files
 
+    @staticmethod
+    def _get_file_index():
+        global _FILE_INDEX
+        if _FILE_INDEX is None:
+            _FILE_INDEX = dict()
+            if os.path.exists(_FILE_INDEX_FILE):
+                try:
+                    with open(_FILE_INDEX_FILE, "r") as json_file:
+                        _FILE_INDEX = json.load(json_file)
+                except (ValueError, OSError) as err:
+                    _LOG.warn("Could not read asset file index, will rebuild it", err)
+                    _FILE_INDEX = dict()
+            for entry in _FILE_INDEX.values():
+                entry["checked"] = 0.0
+                entry["generation"] = next(_FILE_INDEX_GENERATION)
+        return _FILE_INDEX
+
+    @staticmethod
+    def _save_file_index():
+        index = dict()
+        for root, entry in AssetService._get_file_index().items():
+            index[root] = { "dirs": entry["dirs"] }
+        try:
+            with open(_FILE_INDEX_FILE, "w") as json_file:
+                json.dump(index, json_file)
+        except OSError as err:
+            _LOG.warn("Could not write asset file index", err)
+
+    @staticmethod
+    def _scan_directory_tree(dirs, top):
+        for dirpath, subdirs, filenames in os.walk(top):
+            dirs[dirpath] = {
+                "mtime": os.stat(dirpath).st_mtime_ns,
+                "files": sorted(filenames),
+                "subdirs": sorted(subdirs)
+                }
+
+    @staticmethod
+    def _forget_directory_tree(dirs, top):
+        prefix = os.path.join(top, "")
+        for dirpath in list(dirs.keys()):
+            if dirpath == top or dirpath.startswith(prefix):
+                del dirs[dirpath]
+
+    @staticmethod
+    def _refresh_directories(dirs, root):
+        """List those directories again whose mtime has changed, picking up new and removed subdirectories.
+        If the root itself was missing when last scanned, it is scanned again should it exist now. Returns
+        True if anything changed."""
+        changed = False
+        if root not in dirs:
+            if os.path.isdir(root):
+                _LOG.debug("Asset root has appeared", root)
+                AssetService._scan_directory_tree(dirs, root)
+                changed = True
+            return changed
+        for dirpath in sorted(dirs.keys()):
+            info = dirs.get(dirpath)
+            if info is None:
+                # Removed as part of a removed parent
+                continue
+            try:
+                mtime = os.stat(dirpath).st_mtime_ns
+            except OSError:
+                AssetService._forget_directory_tree(dirs, dirpath)
+                changed = True
+                continue
+            if mtime == info["mtime"]:
+                continue
+            _LOG.debug("Directory has changed", dirpath)
+            changed = True
+            files = []
+            subdirs = []
+            for dir_entry in os.scandir(dirpath):
+                if dir_entry.is_dir():
+                    subdirs.append(dir_entry.name)
+                else:
+                    files.append(dir_entry.name)
+            dirs[dirpath] = { "mtime": mtime, "files": sorted(files), "subdirs": sorted(subdirs) }
+            for removed in set(info["subdirs"]) - set(subdirs):
+                AssetService._forget_directory_tree(dirs, os.path.join(dirpath, removed))
+            for added in set(subdirs) - set(info["subdirs"]):
+                AssetService._scan_directory_tree(dirs, os.path.join(dirpath, added))
+        return changed
+
+    @staticmethod
+    def _get_file_index_entry(root, recheck=False):
+        """Return the file index entry for the root, scanning or refreshing it as needed. The entry has the
+        persisted "dirs" and the derived "files" list of full paths, plus maps which are built on demand."""
+        index = AssetService._get_file_index()
+        root = os.path.abspath(root)
+        entry = index.get(root)
+        now = time.time()
+        if entry is None:
+            _LOG.debug("Scanning asset root", root)
+            entry = { "dirs": dict() }
+            AssetService._scan_directory_tree(entry["dirs"], root)
+            entry["generation"] = next(_FILE_INDEX_GENERATION)
+            entry["checked"] = now
+            index[root] = entry
+            AssetService._save_file_index()
+        elif recheck or now - entry["checked"] > _FILE_INDEX_RECHECK_SECONDS:
+            if AssetService._refresh_directories(entry["dirs"], root):
+                _LOG.debug("Asset file index was updated for root", root)
+                for derived in ["files", "by_name", "by_basename"]:
+                    entry.pop(derived, None)
+                entry["generation"] = next(_FILE_INDEX_GENERATION)
+                AssetService._save_file_index()
+            entry["checked"] = now
+        if not "files" in entry:
+            files = []
+            for dirpath in sorted(entry["dirs"].keys()):
+                for filename in entry["dirs"][dirpath]["files"]:
+                    files.append(os.path.join(dirpath, filename))
+            entry["files"] = files
+        return entry
+
+    @staticmethod
+    def _get_target_names(entry):
+        if not "by_name" in entry:
+            by_name = dict()
+            for path in entry["files"]:
+                name = os.path.basename(path).lower()
+                for extension in _TARGET_EXTENSIONS:
+                    if name.endswith(extension):
+                        name = name[:-len(extension)]
+                        if not name in by_name:
+                            by_name[name] = path
+            entry["by_name"] = by_name
+        return entry["by_name"]
+
+    @staticmethod
+    def _get_basenames(entry):
+        if not "by_basename" in entry:
+            by_basename = dict()
+            for path in entry["files"]:
+                basename = os.path.basename(path)
+                if not basename in by_basename:
+                    by_basename[basename] = []
+                by_basename[basename].append(path)
+            entry["by_basename"] = by_basename
+        return entry["by_basename"]
+
+    @staticmethod
+    def refresh_file_index():
+        """Forget all indexed files. The index will be rebuilt the next time it is used."""
+        _LOG.enter()
+        global _FILE_INDEX
+        _FILE_INDEX = dict()
+        AssetService._save_file_index()
+
+    @staticmethod
+    def refresh_target_index():
+        """Forget all indexed target files. The index will be rebuilt the next time it is used."""
+        AssetService.refresh_file_index()
+
+    @staticmethod
+    def find_target_files(asset_roots, extensions=_TARGET_EXTENSIONS):
+        """Return all target files below the asset roots, using the target index rather than a directory
+        scan. Extensions is a tuple with the file endings to include, for example (".target",)."""
+        _LOG.enter()
+        extensions = tuple(extensions)
+        found_files = []
+        for root in asset_roots:
+            if root == "/":
+                raise IOError("Refusing to scan entire HD for assets")
+            if not os.path.exists(root):
+                continue
+            for path in AssetService._get_file_index_entry(root)["files"]:
+                if path.lower().endswith(extensions):
+                    found_files.append(path)
+        _LOG.debug("Total matching target files for all roots", len(found_files))
+        return found_files
+
+    @staticmethod
+    def find_target_by_name(asset_roots, target_name, extensions=_TARGET_EXTENSIONS):
+        """Return the full path of the first target file below the asset roots whose name matches
+        target_name. An exact name match is preferred, otherwise the first file whose name starts with
+        target_name is returned. Returns None if there is no match."""
+        _LOG.enter()
+        extensions = tuple(extensions)
+        name = str(target_name).lower()
+        entries = []
+        for root in asset_roots:
+            if os.path.exists(root):
+                entries.append(AssetService._get_file_index_entry(root))
+        for entry in entries:
+            path = AssetService._get_target_names(entry).get(name)
+            if path and path.lower().endswith(extensions):
+                return path
+        for entry in entries:
+            for path in entry["files"]:
+                if os.path.basename(path).lower().startswith(name) and path.lower().endswith(extensions):
+                    return path
+        return None
+
+    @staticmethod
+    def _get_mhclo_catalog():
+        global _MHCLO_CATALOG
+        if _MHCLO_CATALOG is None:
+            _MHCLO_CATALOG = dict()
+            if os.path.exists(_MHCLO_CATALOG_FILE):
+                try:
+                    with open(_MHCLO_CATALOG_FILE, "r") as json_file:
+                        _MHCLO_CATALOG = json.load(json_file)
+                except (ValueError, OSError) as err:
+                    _LOG.warn("Could not read mhclo catalog, will rebuild it", err)
+                    _MHCLO_CATALOG = dict()
+        return _MHCLO_CATALOG
+
+    @staticmethod
+    def _save_mhclo_catalog():
+        try:
+            with open(_MHCLO_CATALOG_FILE, "w") as json_file:
+                json.dump(AssetService._get_mhclo_catalog(), json_file)
+        except OSError as err:
+            _LOG.warn("Could not write mhclo catalog", err)
+
+    @staticmethod
+    def _get_mhclo_catalog_entry(full_path):
+        """Return the catalog entry for the given file and whether it had to be (re)read."""
+        catalog = AssetService._get_mhclo_catalog()
+        stat = os.stat(full_path)
+        entry = catalog.get(full_path)
+        if entry is not None and entry["mtime"] == stat.st_mtime_ns and entry["size"] == stat.st_size:
+            return entry, False
+        _LOG.debug("Reading mhclo metadata for catalog", full_path)
+        mhclo = Mhclo()
+        try:
+            mhclo.load(full_path, only_metadata=True)
+        except Exception as err: # pylint: disable=W0703
+            _LOG.error("Failed to load asset ", (full_path, err))
+        entry = {
+            "mtime": stat.st_mtime_ns,
+            "size": stat.st_size,
+            "uuid": mhclo.uuid,
+            "name": mhclo.name,
+            "tags": mhclo.tags,
+            "fragment": AssetService.path_to_fragment(full_path)
+            }
+        catalog[full_path] = entry
+        return entry, True
+
+    @staticmethod
+    def get_mhclo_metadata(full_path):
+        """Return a dict with uuid, name, tags and fragment of a mhclo or proxy file. This is read from the
+        persistent mhclo catalog, so the file itself is only parsed if it is new or has changed."""
+        _LOG.enter()
+        entry, changed = AssetService._get_mhclo_catalog_entry(os.path.abspath(str(full_path)))
+        if changed:
+            AssetService._save_mhclo_catalog()
+        return entry
+
+    @staticmethod
+    def _get_uuid_index(asset_subdir="clothes", asset_type="mhclo"):
+        key = (asset_subdir, asset_type)
+        index = _UUID_INDEX.get(key)
+        now = time.time()
+        if index is not None and now - index["checked"] < _MHCLO_CATALOG_RECHECK_SECONDS:
+            return index
+
+        by_uuid = dict()
+        names = dict()
+        any_changed = False
+        assets = AssetService.get_asset_list(asset_subdir, asset_type)
+        for asset_name, asset in assets.items():
+            entry, changed = AssetService._get_mhclo_catalog_entry(os.path.abspath(asset["full_path"]))
+            any_changed = any_changed or changed
+            names[asset_name] = entry["name"]
+            if entry["uuid"]:
+                if not entry["uuid"] in by_uuid:
+                    by_uuid[entry["uuid"]] = []
+                by_uuid[entry["uuid"]].append(asset_name)
+        if any_changed:
+            AssetService._save_mhclo_catalog()
+
+        index = { "by_uuid": by_uuid, "names": names, "checked": now }
+        _UUID_INDEX[key] = index
+        return index
+
+    @staticmethod
+    def find_asset_names_by_uuid(uuid, asset_subdir="clothes", asset_type="mhclo"):
+        """Return the names (keys in the asset list) of all assets of the given type with the given uuid."""
+        _LOG.enter()
+        if not uuid:
+            return []
+        return list(AssetService._get_uuid_index(asset_subdir, asset_type)["by_uuid"].get(uuid, []))
+
+    @staticmethod
+    def get_mhclo_name(asset_name, asset_subdir="clothes", asset_type="mhclo"):
+        """Return the name given inside the mhclo/proxy file of an asset in the asset list."""
+        return AssetService._get_uuid_index(asset_subdir, asset_type)["names"].get(asset_name)
+
     @staticmethod
     def find_asset_absolute_path(asset_path_fragment, asset_subdir="clothes"):
         _LOG.enter()
@@ -127,12 +449,9 @@ class AssetService:
         matches = []
         _LOG.debug("Searching for asset with basename", filename)
         for root in roots:
-            for dirpath, subdirs, files in os.walk(root):
-                _LOG.trace("Looking in directory", dirpath)
-                if filename in files:
-                    full_path = os.path.join(root, dirpath, filename)
-                    _LOG.debug("Found match", full_path)
-                    matches.append(full_path)
+            for full_path in AssetService._get_basenames(AssetService._get_file_index_entry(root)).get(filename, []):
+                _LOG.debug("Found match", full_path)
+                matches.append(full_path)
 
         if len(matches) < 1:
             # We couldn't find the asset in question
@@ -241,14 +560,26 @@ class AssetService:
         return asset_roots
 
     @staticmethod
-    def update_asset_list(asset_subdir="clothes", asset_type="mhclo"):
+    def update_asset_list(asset_subdir="clothes", asset_type="mhclo", recheck=True):
+        """Rebuild the list of assets in the asset_subdir. This is skipped if no directory in the file index
+        has changed since the list was last built. With recheck=True the file index is revalidated first."""
         _LOG.enter()
 
-        global _ASSET_THUMBS
-
         roots = AssetService.get_asset_roots(asset_subdir)
+        generations = []
+        for root in roots:
+            generations.append((os.path.abspath(root), AssetService._get_file_index_entry(root, recheck=recheck)["generation"]))
+        if asset_subdir in _ASSETS and _ASSET_LIST_GENERATIONS.get((asset_subdir, asset_type)) == generations:
+            _LOG.debug("Asset list is unchanged", asset_subdir)
+            return
+
         assets = AssetService.find_asset_files_matching_pattern(roots, "*." + asset_type)
 
+        # Check for thumbs against the file index rather than asking the file system once per asset
+        known_files = set()
+        for root in roots:
+            known_files.update(AssetService._get_file_index_entry(root)["files"])
+
         asset_list = dict()
 
         for asset in assets:
@@ -259,22 +590,14 @@ class AssetService:
             item["dirname"] = os.path.dirname(asset)
             item["fragment"] = os.path.basename(item["dirname"]) + "/" + item["basename"]
             item["name_without_ext"] = str(item["basename"]).replace("." + asset_type, "")
-            item["thumb"] = None
             item["thumb_path"] = None
             label = str(item["name_without_ext"]).lower().replace("_", " ")
             label = label.capitalize()
             item["label"] = label
 
-            if _ASSET_THUMBS is None:
-                _ASSET_THUMBS = bpy.utils.previews.new()
-
             thumb = os.path.join(os.path.dirname(asset), item["name_without_ext"] + ".thumb")
-            if os.path.exists(thumb):
+            if thumb in known_files:
                 item["thumb_path"] = thumb
-                _LOG.debug("Will try to load icon", (label, thumb))
-                if not thumb in _ASSET_THUMBS:
-                    _ASSET_THUMBS.load(thumb, thumb, 'IMAGE')
-                item["thumb"] = _ASSET_THUMBS[thumb]
             else:
                 _LOG.warn("Missing thumb", thumb)
 
@@ -282,6 +605,38 @@ class AssetService:
             asset_list[label] = item
 
         _ASSETS[asset_subdir] = asset_list
+        _ASSET_LIST_GENERATIONS[(asset_subdir, asset_type)] = generations
+        _UUID_INDEX.pop((asset_subdir, asset_type), None)
+
+    @staticmethod
+    def is_asset_thumb_loaded(asset):
+        """Check if the thumbnail of an asset list item is already in the preview collection."""
+        return bool(asset["thumb_path"]) and asset["thumb_path"] in _LOADED_THUMBS
+
+    @staticmethod
+    def get_asset_thumb(asset):
+        """Return the preview for the thumbnail of an asset list item, loading it if it is not loaded already.
+        Returns None if the asset does not have a thumbnail."""
+        global _ASSET_THUMBS
+        thumb = asset["thumb_path"]
+        if not thumb:
+            return None
+
+        if _ASSET_THUMBS is None:
+            _ASSET_THUMBS = bpy.utils.previews.new()
+
+        if thumb in _LOADED_THUMBS:
+            _LOADED_THUMBS.move_to_end(thumb)
+            return _ASSET_THUMBS[thumb]
+
+        _LOG.debug("Will try to load icon", thumb)
+        if not thumb in _ASSET_THUMBS:
+            _ASSET_THUMBS.load(thumb, thumb, 'IMAGE')
+        _LOADED_THUMBS[thumb] = True
+        while len(_LOADED_THUMBS) > _MAX_LOADED_THUMBS:
+            (released, _) = _LOADED_THUMBS.popitem(last=False)
+            del _ASSET_THUMBS[released]
+        return _ASSET_THUMBS[thumb]
 
     @staticmethod
     def update_all_asset_lists():
@@ -293,7 +648,7 @@ class AssetService:
     @staticmethod
     def get_asset_list(asset_subdir="clothes", asset_type="mhclo"):
         if not asset_subdir in _ASSETS:
-            AssetService.update_asset_list(asset_subdir, asset_type)
+            AssetService.update_asset_list(asset_subdir, asset_type, recheck=False)
         return _ASSETS[asset_subdir]
 
     @staticmethod
@@ -120,6 +120,15 @@ class BlenderConfigSet(ConfigurationSet):
         _LOG.enter()
         return name in self._properties_by_full_name or name in self._properties_by_short_name or name in self._alias_to_prop
 
+    def get_definition(self, name):
+        """Return a copy of the definition (label, description, default...) of the property, or None if
+        there is no property with this name."""
+        _LOG.enter()
+        prop = self._find_property(name)
+        if prop is None:
+            return None
+        return dict(prop)
+
     def has_key_with_value(self, name, entity_reference=None):
         _LOG.enter()
         if not self.has_key(name):
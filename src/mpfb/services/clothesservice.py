@@ -1,12 +1,10 @@
 """This module contains utility functions for clothes."""
 
-import random, os, bpy
-
-import bmesh
-from mathutils import Vector
+import os, bpy, numpy
 
 from mpfb.entities.rig import Rig
 from mpfb.services.objectservice import ObjectService
+from mpfb.services.meshservice import MeshService
 from mpfb.services.logservice import LogService
 from mpfb.services.assetservice import AssetService
 from mpfb.entities.objectproperties import GeneralObjectProperties
@@ -23,8 +21,10 @@ class ClothesService:
         raise RuntimeError("You should not instance ClothesService. Use its static methods instead.")
 
     @staticmethod
-    def fit_clothes_to_human(clothes, basemesh, mhclo=None, set_parent=True):
-        """Move clothes vertices so they fit the current shape of the base mesh."""
+    def fit_clothes_to_human(clothes, basemesh, mhclo=None, set_parent=True, human_coords=None):
+        """Move clothes vertices so they fit the current shape of the base mesh. If human_coords is given, it
+        should be the result of MeshService.get_mixed_vertex_coordinates() for the base mesh, which saves
+        recalculating it when fitting several assets."""
 
         _LOG.dump("Given MHCLO object", mhclo)
 
@@ -38,36 +38,17 @@ class ClothesService:
             raise ValueError('The provided object is not a basemesh')
 
         if mhclo is None:
-            mhclo_fragment = GeneralObjectProperties.get_value("asset_source", entity_reference=clothes)
-            object_type = ObjectService.get_object_type(clothes)
-
-            if mhclo_fragment and object_type:
-                mhclo_path = AssetService.find_asset_absolute_path(mhclo_fragment, str(object_type).lower())
-                if not mhclo_path:
-                    raise IOError(mhclo_fragment + " does not exist")
-                if not os.path.exists(mhclo_path):
-                    raise IOError(mhclo_path + " does not exist")
-                mhclo = Mhclo()
-                mhclo.load(mhclo_path)
-            else:
-                raise ValueError('There is not enough info to refit this asset, at least asset source and object type is needed')
-            mhclo.clothes = clothes
+            mhclo = ClothesService.load_mhclo_for_clothes(clothes)
 
-        if not mhclo.verts or len(mhclo.verts.keys()) <1:
+        if len(mhclo.vert_indices) < 1:
             raise ValueError('There is no vertex info in the MHCLO!?')
 
         # We cannot rely on the vertex position data directly, since it represent positions
         # as they are *before* targets are applied. We want the shape of the mesh *after*
-        # targets are applied.
-        #
-        # We will therefore create a new shape key "from mix". This means it will have the
-        # combined state of all current shape keys. Then we will use that shape key for
-        # getting vertex positions.
-        key_name = "temporary_fitting_key." + str(random.randrange(1000, 9999))
-        basemesh.shape_key_add(name=key_name, from_mix=True)
-        shape_key = basemesh.data.shape_keys.key_blocks[key_name]
-        human_vertices = shape_key.data
-        human_vertices_count = len(human_vertices)
+        # targets are applied, ie with the combined state of all current shape keys.
+        if human_coords is None:
+            human_coords = MeshService.get_mixed_vertex_coordinates(basemesh)
+        human_vertices_count = len(human_coords)
 
         scale_factor = GeneralObjectProperties.get_value("scale_factor", entity_reference=basemesh)
         if not scale_factor:
@@ -83,9 +64,9 @@ class ClothesService:
                 _LOG.warn("Giving up refitting, not inside")
                 raise ValueError("Cannot refit as we are not inside")
 
-            x_size = abs(human_vertices[mhclo.x_scale[0]].co[0] - human_vertices[mhclo.x_scale[1]].co[0]) / mhclo.x_scale[2]
-            y_size = abs(human_vertices[mhclo.y_scale[0]].co[2] - human_vertices[mhclo.y_scale[1]].co[2]) / mhclo.y_scale[2]
-            z_size = abs(human_vertices[mhclo.z_scale[0]].co[1] - human_vertices[mhclo.z_scale[1]].co[1]) / mhclo.z_scale[2]
+            x_size = abs(human_coords[mhclo.x_scale[0]][0] - human_coords[mhclo.x_scale[1]][0]) / mhclo.x_scale[2]
+            y_size = abs(human_coords[mhclo.y_scale[0]][2] - human_coords[mhclo.y_scale[1]][2]) / mhclo.y_scale[2]
+            z_size = abs(human_coords[mhclo.z_scale[0]][1] - human_coords[mhclo.z_scale[1]][1]) / mhclo.z_scale[2]
 
         _LOG.debug("x_scale, y_scale, z_scale", (mhclo.x_scale, mhclo.y_scale, mhclo.z_scale))
         _LOG.debug("x_size, y_size, z_size", (x_size, y_size, z_size))
@@ -93,61 +74,50 @@ class ClothesService:
         mesh = mhclo.clothes.data
         assert isinstance(mesh, bpy.types.Mesh)
 
-        edit_bmesh = None
-        current_shape_settings = None
-        current_active_object = bpy.context.view_layer.objects.active
-
-        # If the mesh has shape keys, switch to edit mode to update.
-        if mesh.shape_keys and len(mesh.shape_keys.key_blocks) > 0:
-            bpy.context.view_layer.objects.active = mhclo.clothes
-
-            current_shape_settings = (mhclo.clothes.active_shape_key_index,
-                                      mhclo.clothes.use_shape_key_edit_mode,
-                                      mhclo.clothes.show_only_shape_key)
+        clothes_vertices_count = len(mesh.vertices)
+        _LOG.debug("About to try to match vertices: ", clothes_vertices_count)
 
-            mhclo.clothes.active_shape_key_index = 0
-            mhclo.clothes.use_shape_key_edit_mode = True
-            mhclo.clothes.show_only_shape_key = True
-
-            bpy.ops.object.mode_set(mode='EDIT', toggle=False)
-            assert mhclo.clothes.mode == 'EDIT'
-
-            edit_bmesh = bmesh.from_edit_mesh(mesh)
-            clothes_vertices = edit_bmesh.verts
+        indices, weights, offsets = mhclo.get_binding_arrays()
+        if len(indices) < clothes_vertices_count:
+            raise ValueError("The MHCLO has binding info for fewer vertices than the clothes mesh has")
+        indices = indices[:clothes_vertices_count]
+        weights = weights[:clothes_vertices_count]
+        offsets = offsets[:clothes_vertices_count]
 
+        # If the mesh has shape keys, the positions we want to change are those of the basis key
+        if mesh.shape_keys and len(mesh.shape_keys.key_blocks) > 0:
+            basis = mesh.shape_keys.key_blocks[0]
+            old_coords = numpy.empty(clothes_vertices_count * 3, dtype=numpy.float32)
+            basis.data.foreach_get("co", old_coords)
         else:
-            clothes_vertices = mesh.vertices
-
-        _LOG.debug("About to try to match vertices: ", len(clothes_vertices))
-        _LOG.dump("Verts", mhclo.verts)
-
-        for clothes_vertex_number, clothes_vertex in enumerate(clothes_vertices):
-            vertex_match_info = mhclo.verts[clothes_vertex_number]
-            _LOG.dump("Vertex match info", (clothes_vertex_number, vertex_match_info))
-            (human_vertex1, human_vertex2, human_vertex3) = vertex_match_info["verts"]
-
-            # test if we inside mesh, if not, no chance
-            #
-            if human_vertex1 >= human_vertices_count or human_vertex2 > human_vertices_count or human_vertex3 >= human_vertices_count:
-                continue
-
-            offset = [vertex_match_info["offsets"][0]*x_size, vertex_match_info["offsets"][1]*z_size, vertex_match_info["offsets"][2]*y_size]
-            clothes_vertex.co = \
-                vertex_match_info["weights"][0] * human_vertices[human_vertex1].co + \
-                vertex_match_info["weights"][1] * human_vertices[human_vertex2].co + \
-                vertex_match_info["weights"][2] * human_vertices[human_vertex3].co + \
-                Vector(offset)
-
-        if edit_bmesh:
-            bmesh.update_edit_mesh(mesh, destructive=False)
-
-            bpy.ops.object.mode_set(mode='OBJECT', toggle=False)
-
-            (mhclo.clothes.active_shape_key_index,
-             mhclo.clothes.use_shape_key_edit_mode,
-             mhclo.clothes.show_only_shape_key) = current_shape_settings
-
-            bpy.context.view_layer.objects.active = current_active_object
+            basis = None
+            old_coords = numpy.empty(clothes_vertices_count * 3, dtype=numpy.float32)
+            mesh.vertices.foreach_get("co", old_coords)
+        old_coords = old_coords.reshape(-1, 3)
+
+        # Vertices referencing outside the base mesh (such as for a proxy made for another base mesh) are
+        # left where they are
+        inside = (indices < human_vertices_count).all(axis=1)
+        safe_indices = numpy.where(inside[:, None], indices, 0)
+
+        new_coords = numpy.einsum("ij,ijk->ik", weights, human_coords[safe_indices])
+        new_coords += offsets * numpy.array((x_size, z_size, y_size), dtype=numpy.float32)
+        new_coords = numpy.where(inside[:, None], new_coords, old_coords).astype(numpy.float32)
+
+        mesh.vertices.foreach_set("co", new_coords.ravel())
+
+        if basis:
+            basis.data.foreach_set("co", new_coords.ravel())
+            # This is what blender does when leaving edit mode after having edited the basis: keys which
+            # are relative to the basis are moved along with it
+            delta = new_coords - old_coords
+            key_coords = numpy.empty(clothes_vertices_count * 3, dtype=numpy.float32)
+            for key_block in mesh.shape_keys.key_blocks[1:]:
+                if key_block.relative_key == basis:
+                    key_block.data.foreach_get("co", key_coords)
+                    key_block.data.foreach_set("co", key_coords + delta.ravel())
+
+        mesh.update()
 
         # We need to take into account that the base mesh might be rigged. If it is, we'll want the rig position
         # rather than the basemesh position
@@ -158,8 +128,37 @@ class ClothesService:
             else:
                 clothes.location = basemesh.location
 
-        # As we are finished with the combined shape key we can now remove it
-        basemesh.shape_key_remove(shape_key)
+    @staticmethod
+    def load_mhclo_for_clothes(clothes):
+        """Load the mhclo (or proxy) file the clothes object was created from, as told by its asset source."""
+        mhclo_fragment = GeneralObjectProperties.get_value("asset_source", entity_reference=clothes)
+        object_type = ObjectService.get_object_type(clothes)
+
+        if mhclo_fragment and object_type:
+            mhclo_path = AssetService.find_asset_absolute_path(mhclo_fragment, str(object_type).lower())
+            if not mhclo_path:
+                raise IOError(mhclo_fragment + " does not exist")
+            if not os.path.exists(mhclo_path):
+                raise IOError(mhclo_path + " does not exist")
+            mhclo = Mhclo()
+            mhclo.load(mhclo_path)
+        else:
+            raise ValueError('There is not enough info to refit this asset, at least asset source and object type is needed')
+        mhclo.clothes = clothes
+        return mhclo
+
+    @staticmethod
+    def mhclo_depends_on_vertices(mhclo, changed_vertices):
+        """Check if any clothes vertex of the mhclo is bound to, or scaled by, a base mesh vertex which is
+        flagged in the changed_vertices boolean array."""
+        referenced = [mhclo.vert_indices.ravel()]
+        for scale in [mhclo.x_scale, mhclo.y_scale, mhclo.z_scale]:
+            if scale:
+                referenced.append(numpy.array(scale[0:2], dtype=numpy.int64))
+        referenced = numpy.concatenate(referenced)
+        # Indices outside the base mesh are not fitted, so they cannot matter
+        referenced = referenced[referenced < len(changed_vertices)]
+        return bool(changed_vertices[referenced].any())
 
     @staticmethod
     def _conservative_mask(basemesh, vertices_list):
@@ -201,7 +200,7 @@ class ClothesService:
         """Create or update a "delete" group on the base mesh."""
 
         if skip_if_empty_delete_group:
-            if not mhclo.delete or not mhclo.delverts or len(mhclo.delverts) < 1:
+            if not mhclo.delete or len(mhclo.delverts) < 1:
                 # mhclo has empty delete group. There's no point continuing.
                 return
 
@@ -230,10 +229,7 @@ class ClothesService:
             # Find vertices to delete. For safety check so that the vertex index actually
             # exist in the base mesh. It might refer to a helper index that have been excluded
             # or deleted.
-            delete_vertices_list = []
-            for vertex_to_delete in  mhclo.delverts:
-                if vertex_to_delete < human_vertices_count:
-                    delete_vertices_list.append(int(vertex_to_delete))
+            delete_vertices_list = mhclo.delverts[mhclo.delverts < human_vertices_count].tolist()
 
             # Remove outliers
             ClothesService._conservative_mask(basemesh, delete_vertices_list)
@@ -279,22 +275,14 @@ class ClothesService:
         mhclo = Mhclo()
         mhclo.load(mhclo_full_path)
 
-        relevant_clothes_vert_idxs = []
-
-        for clothes_vert_idx in mhclo.verts:
-            mhclo_vert = mhclo.verts[clothes_vert_idx]
-            _LOG.dump("mhclo_vert", (clothes_vert_idx, mhclo_vert))
-            for match_vert in range(3):
-                basemesh_vert_idx = mhclo_vert["verts"][match_vert]
-                basemesh_vert_weight = mhclo_vert["weights"][match_vert]
-                if basemesh_vert_idx in relevant_basemesh_vert_idxs:
-                    if clothes_vert_idx not in relevant_clothes_vert_idxs:
-                        relevant_clothes_vert_idxs.append(clothes_vert_idx)
+        # A clothes vertex is relevant if any of the base mesh vertices it is bound to are in the group
+        is_relevant = numpy.isin(mhclo.vert_indices, relevant_basemesh_vert_idxs).any(axis=1)
+        relevant_clothes_vert_idxs = numpy.flatnonzero(is_relevant).tolist()
 
         _LOG.debug("Number of matching vertices", len(relevant_clothes_vert_idxs))
         _LOG.dump("Relevant clothes idxs", relevant_clothes_vert_idxs)
 
-        new_vert_group.add(relevant_clothes_vert_idxs, 1.0, 'ADD')
+        MeshService.add_weights_to_vertex_group(new_vert_group, relevant_clothes_vert_idxs, 1.0, 'ADD')
 
         return new_vert_group
 
@@ -324,78 +312,85 @@ class ClothesService:
                 group_name_to_index[str(group.name)] = group.index
                 group_index_to_name[int(group.index)] = str(group.name)
 
-        # We will now iterate over the vertices in the clothes. The idea is to then
-        # look up the vertices on the human that the clothes vertex is tied to. This
-        # information is provided in the mhclo object.
+        # The idea is to look up the vertices on the human that each clothes vertex is tied to.
+        # This information is provided in the mhclo object.
         #
         # For each mapping of clothes vertex to human vertex we also have a weight,
         # so that clothes vertex 1 might be 20% tied to human vertex 1 and 40% tied to
         # human vertex 2 and so on.
         #
         # By multiplying that weight with the vertex group weight of the human vertex, we
-        # get the interpolated vertex group weight for the clothes vertex.
-        for vert_number in range(len(mhclo.verts)):
-            clothes_vert = mhclo.verts[vert_number]
-            groups = dict()
-            for match_vert in range(3):
-                # Which human vert is the clothes vert tied to?
-                human_vert = basemesh.data.vertices[clothes_vert["verts"][match_vert]]
-
-                # .. and by how much?
-                assigned_weight = clothes_vert["weights"][match_vert]
-
-                # Iterate over all vertex groups the human vert belongs to
-                for group in human_vert.groups:
-                    idx = group.group
-                    if idx in group_index_to_name:
-                        if not idx in groups:
-                            groups[idx] = 0
-                        # Add the calculated weight to the list of found weights
-                        #
-                        # Human vertex group weight * Human vertex weight
-                        groups[idx] += group.weight * assigned_weight
-
-            # Iterate over all found vertex groups for the current clothes vertex
-            # and calculcate the average weight for each group
-            for idx in groups.keys():
-                average_weight = groups[idx] / sum(clothes_vert["weights"])
-                # If the caculated average weight is below 0.001 we will ignore it. This
-                # makes the interpolation much faster later on
-                if average_weight > 0.001:
-                    group_name = group_index_to_name[int(idx)]
-                    clothes_weights[group_name].append([vert_number, average_weight])
-
-        # We now have a finished map with all weights. We will iterate over this
-        # and convert each weight array to a vertex group on the clothes, and then
-        # set the vertex weights in it
-        for group_name in clothes_weights.keys():
-            # Weights is an array looking like [ [vert_index, weight], [vert_index, weight]...]
-            weights = clothes_weights[group_name]
-
-            # No need to create a vertex group if no weights were found for it. For example,
-            # it is unnecessary to have an "upperarm02" group for shoes.
-            if len(weights) > 0:
-                # We want the vertex indices as a list. By using zip we can rotate the array
-                # so that columns become rows
-                rotated = zip(*weights)
-
-                # We can now get the indices from the first column
-                indices = list(rotated)[0]
-
-                # Create a vertex group and add all vertices to it, with a weight of 1.0.
-                # It is much faster to to it like this and then update the weights than
-                # adding the vertices one by one with its weight
+        # get the interpolated vertex group weight for the clothes vertex. Seen as matrices,
+        # the clothes weights are the product of the (clothes verts x human verts) binding
+        # matrix and the (human verts x groups) weight matrix. Both are sparse, so they are
+        # kept as index/value arrays rather than as full matrices.
+
+        # Columns of the weight matrix, in the order the groups should be created on the clothes
+        group_names = [name for name in clothes_weights.keys() if name in group_name_to_index]
+        column_of_group_index = dict()
+        for column, group_name in enumerate(group_names):
+            column_of_group_index[group_name_to_index[group_name]] = column
+        number_of_columns = len(group_names)
+
+        vert_indices = numpy.asarray(mhclo.vert_indices, dtype=numpy.int64)
+        binding = numpy.asarray(mhclo.vert_weights, dtype=numpy.float64)
+        totals = binding.sum(axis=1)
+        totals[totals == 0.0] = 1.0
+        # Dividing by the sum of the binding weights gives the average weight
+        binding = binding / totals[:, None]
+
+        # Arrange the human weights in compressed sparse row form: the group columns and weights
+        # of human vertex v are found at positions row_starts[v] to row_starts[v+1].
+        group_weights = MeshService.get_vertex_group_weights(basemesh)
+        human_vertices = []
+        columns = []
+        values = []
+        for column, group_name in enumerate(group_names):
+            vertex_indices, vertex_weights = group_weights[group_name]
+            human_vertices.append(vertex_indices)
+            columns.append(numpy.full(len(vertex_indices), column, dtype=numpy.int64))
+            values.append(vertex_weights)
+        human_vertices = numpy.concatenate(human_vertices) if human_vertices else numpy.zeros(0, dtype=numpy.int64)
+        order = numpy.argsort(human_vertices, kind="stable")
+        columns = numpy.concatenate(columns)[order] if columns else numpy.zeros(0, dtype=numpy.int64)
+        values = numpy.concatenate(values)[order].astype(numpy.float64) if values else numpy.zeros(0, dtype=numpy.float64)
+        row_lengths = numpy.bincount(human_vertices, minlength=len(basemesh.data.vertices)).astype(numpy.int64)
+        row_starts = numpy.zeros(len(row_lengths), dtype=numpy.int64)
+        row_starts[1:] = numpy.cumsum(row_lengths)[:-1]
+
+        # Expand each (clothes vertex, human vertex, binding weight) entry into one entry per group
+        # the human vertex belongs to
+        bound_vertices = vert_indices.ravel()
+        entry_lengths = row_lengths[bound_vertices]
+        entry_rows = numpy.repeat(numpy.repeat(numpy.arange(len(vert_indices)), 3), entry_lengths)
+        entry_factors = numpy.repeat(binding.ravel(), entry_lengths)
+        within_row = numpy.arange(entry_lengths.sum()) - numpy.repeat(numpy.cumsum(entry_lengths) - entry_lengths, entry_lengths)
+        positions = numpy.repeat(row_starts[bound_vertices], entry_lengths) + within_row
+
+        # Sum the entries per (clothes vertex, group)
+        keys = entry_rows * number_of_columns + columns[positions]
+        unique_keys, inverse = numpy.unique(keys, return_inverse=True)
+        summed_weights = numpy.bincount(inverse, weights=entry_factors * values[positions])
+
+        # If the caculated average weight is below 0.001 we will ignore it. This
+        # makes the interpolation much faster later on
+        keep = summed_weights > 0.001
+        unique_keys = unique_keys[keep]
+        summed_weights = summed_weights[keep]
+        clothes_vertices = unique_keys // max(number_of_columns, 1)
+        clothes_columns = unique_keys % max(number_of_columns, 1)
+
+        # Write the weights per group. No need to create a vertex group if no weights were found
+        # for it. For example, it is unnecessary to have an "upperarm02" group for shoes.
+        order = numpy.argsort(clothes_columns, kind="stable")
+        clothes_vertices = clothes_vertices[order]
+        summed_weights = summed_weights[order]
+        boundaries = numpy.searchsorted(clothes_columns[order], numpy.arange(number_of_columns + 1))
+        for column, group_name in enumerate(group_names):
+            start, end = boundaries[column], boundaries[column + 1]
+            if end > start:
                 new_vert_group = clothes.vertex_groups.new(name=str(group_name))
-                new_vert_group.add(indices, 1.0, 'ADD')
-                group_index = new_vert_group.index
-
-                # Iterate over the weights and update the vertex weights in the group
-                for weight_info in weights:
-                    vertex_index = weight_info[0]
-                    weight = weight_info[1]
-                    for group in clothes.data.vertices[vertex_index].groups:
-                        if int(group.group) == group_index:
-                            group.weight = weight
+                MeshService.add_weights_to_vertex_group(new_vert_group, clothes_vertices[start:end], summed_weights[start:end])
 
     @staticmethod
     def set_up_rigging(basemesh, clothes, rig, mhclo, *,
@@ -1,6 +1,6 @@
 """High-level functionality for human objects"""
 
-import os, json, fnmatch, re, bpy, shutil
+import os, json, fnmatch, re, bpy, shutil, time, numpy
 from pathlib import Path
 from mpfb.entities.objectproperties import HumanObjectProperties
 from mpfb.services.objectservice import ObjectService
@@ -8,6 +8,7 @@ from mpfb.services.targetservice import TargetService
 from mpfb.services.assetservice import AssetService
 from mpfb.services.clothesservice import ClothesService
 from mpfb.services.rigservice import RigService
+from mpfb.services.meshservice import MeshService
 from mpfb.services.nodeservice import NodeService
 from mpfb.entities.clothes.mhclo import Mhclo
 from mpfb.entities.rig import Rig
@@ -24,6 +25,17 @@ _LOG = LogService.get_logger("services.humanservice")
 
 _EXISTING_PRESETS = None
 
+# State shared between the humans created by create_humans_in_batch(). This is None
+# when no batch is running.
+_BATCH = None
+
+# The shape of each basemesh as it was at its last refit, together with the names of the rig and mesh assets
+# which were fitted to it, keyed on object pointer and name. refit() compares against this to find which
+# vertices have moved since. Adding assets or rigs drops the snapshot. Snapshots of basemeshes which have been
+# deleted or renamed are dropped when a snapshot for another basemesh is added.
+_REFIT_COORDS = dict()
+_REFIT_TOLERANCE = 1e-6
+
 class HumanService:
     """High-level utility functions for various human tasks."""
 
@@ -311,21 +323,23 @@ class HumanService:
             bpy.ops.object.mode_set(mode='OBJECT')
             if "fix_leftright_weights_for_groups" in corrective[uuid]:
                 _LOG.debug("Will try to fix left/right groups")
-                group_names = {}
-                for group in proxymesh.vertex_groups:
-                    group_names[group.index] = str(group.name).lower()
-                for vertex in proxymesh.data.vertices:
-                    for group in vertex.groups:
-                        group_name = group_names[group.group]
-                        is_sided = False
-                        if (group_name.endswith(".r") or group_name.startswith("r-") or group_name.startswith("r_")) and vertex.co[0] > 0.0001:
-                            # Vertex is on right side, but has a group weight for a left side bone. So nuke this weight.
-                            group.weight = 0.0
-                            _LOG.debug("Nuked weight for vertex", (vertex.index, vertex.co, group_name))
-                        if (group_name.endswith(".l") or group_name.startswith("l-") or group_name.startswith("l_")) and vertex.co[0] < -0.0001:
-                            # Vertex is on left side, but has a group weight for a right side bone. So nuke this weight.
-                            group.weight = 0.0
-                            _LOG.debug("Nuked weight for vertex", (vertex.index, vertex.co, group_name))
+                coords = numpy.empty(len(proxymesh.data.vertices) * 3, dtype=numpy.float32)
+                proxymesh.data.vertices.foreach_get("co", coords)
+                x_coords = coords.reshape(-1, 3)[:, 0]
+                group_weights = MeshService.get_vertex_group_weights(proxymesh)
+                for vertex_group in proxymesh.vertex_groups:
+                    group_name = str(vertex_group.name).lower()
+                    vertex_indices = group_weights[str(vertex_group.name)][0]
+                    wrong_side = numpy.zeros(len(vertex_indices), dtype=bool)
+                    if group_name.endswith(".r") or group_name.startswith("r-") or group_name.startswith("r_"):
+                        # Vertex is on right side, but has a group weight for a left side bone. So nuke this weight.
+                        wrong_side |= x_coords[vertex_indices] > 0.0001
+                    if group_name.endswith(".l") or group_name.startswith("l-") or group_name.startswith("l_"):
+                        # Vertex is on left side, but has a group weight for a right side bone. So nuke this weight.
+                        wrong_side |= x_coords[vertex_indices] < -0.0001
+                    if wrong_side.any():
+                        _LOG.debug("Nuking weights for vertices", (group_name, vertex_indices[wrong_side]))
+                        MeshService.add_weights_to_vertex_group(vertex_group, vertex_indices[wrong_side], 0.0, 'REPLACE')
         else:
             _LOG.debug("There is no corrective information for", uuid)
 
@@ -333,6 +347,9 @@ class HumanService:
     def add_mhclo_asset(mhclo_file, basemesh, asset_type="Clothes", subdiv_levels=1, material_type="MAKESKIN",
                         alternative_materials=None, color_adjustments=None,
                         set_up_rigging=True, interpolate_weights=True, import_subrig=True, import_weights=True):
+        # The new asset has not been fitted to the shape of the last refit
+        HumanService.invalidate_refit_snapshot(basemesh)
+
         mhclo = Mhclo()
         mhclo.load(mhclo_file) # pylint: disable=E1101
         clothes = mhclo.load_mesh(bpy.context)
@@ -388,13 +405,24 @@ class HumanService:
                 else:
                     GeneralObjectProperties.set_value("alternative_material", alternative_materials[mhclo.uuid], entity_reference=clothes)
             _LOG.debug("Actual material", material)
-            makeskin_material.populate_from_mhmat(material)
-            blender_material = MaterialService.create_empty_material(name, clothes)
-            makeskin_material.apply_node_tree(blender_material)
-            blender_material.diffuse_color = color
 
-            if mhclo.uuid and color_adjustments and mhclo.uuid in color_adjustments:
-                MaterialService.apply_color_adjustment(clothes, color_adjustments[mhclo.uuid])
+            has_color_adjustment = mhclo.uuid and color_adjustments and mhclo.uuid in color_adjustments
+
+            # When running a batch, humans using the same mhmat without color adjustments can share material
+            shared_material_key = (str(material), atype)
+            if _BATCH is not None and not has_color_adjustment and shared_material_key in _BATCH["materials"]:
+                _LOG.debug("Reusing batch material", shared_material_key)
+                clothes.data.materials.append(_BATCH["materials"][shared_material_key])
+            else:
+                makeskin_material.populate_from_mhmat(material)
+                blender_material = MaterialService.create_empty_material(name, clothes)
+                makeskin_material.apply_node_tree(blender_material)
+                blender_material.diffuse_color = color
+
+                if has_color_adjustment:
+                    MaterialService.apply_color_adjustment(clothes, color_adjustments[mhclo.uuid])
+                elif _BATCH is not None:
+                    _BATCH["materials"][shared_material_key] = blender_material
 
         if material_type == "PROCEDURAL_EYES":
             MaterialService.delete_all_materials(clothes)
@@ -761,6 +789,8 @@ class HumanService:
         if "override_skin_model" in deserialization_settings and deserialization_settings["override_skin_model"] and deserialization_settings["override_skin_model"] != "PRESET":
             human_info["skin_material_type"] = deserialization_settings["override_skin_model"]
 
+        started = time.perf_counter()
+
         macro_detail_dict = human_info["phenotype"]
         basemesh = HumanService.create_human(mask_helpers, detailed_helpers, extra_vertex_groups, feet_on_ground, scale, macro_detail_dict)
         if "name" in human_info and human_info["name"]:
@@ -771,6 +801,8 @@ class HumanService:
             modifier.levels = 0
             modifier.render_levels = subdiv_levels
 
+        started = HumanService._record_batch_stage("create_human", started)
+
         HumanService._load_targets(human_info, basemesh)
         # Do an extra feet_on_ground here, since the one in create_human only
         # takes macro details into account
@@ -779,13 +811,20 @@ class HumanService:
             basemesh.location = (0.0, 0.0, abs(lowest_point))
             bpy.ops.object.transform_apply(location=True, rotation=True, scale=True)
 
+        started = HumanService._record_batch_stage("targets", started)
         HumanService._check_add_rig(human_info, basemesh)
+        started = HumanService._record_batch_stage("rig", started)
         HumanService._check_add_bodyparts(human_info, basemesh, subdiv_levels=subdiv_levels)
+        started = HumanService._record_batch_stage("bodyparts", started)
         HumanService._check_add_proxy(human_info, basemesh, subdiv_levels=subdiv_levels)
+        started = HumanService._record_batch_stage("proxy", started)
         if load_clothes:
             HumanService._check_add_clothes(human_info, basemesh, subdiv_levels=subdiv_levels)
+        started = HumanService._record_batch_stage("clothes", started)
         HumanService._set_skin(human_info, basemesh)
+        started = HumanService._record_batch_stage("skin", started)
         HumanService._set_eyes(human_info, basemesh)
+        HumanService._record_batch_stage("eyes", started)
 
         # Otherwise all targets will be set to 100% when entering edit mode
         basemesh.use_shape_key_edit_mode = True
@@ -893,44 +932,35 @@ class HumanService:
 
                 assets = AssetService.get_asset_list(root_name, asset_type)
                 _LOG.dump("Potential assets", assets)
-                # Find asset which match both filename and UUID
-                for asset_name in assets:
-                    asset = assets[asset_name]
-                    given_name = str(asset_name).lower()
-                    mhclo_name = str(name).lower()
-                    _LOG.debug("Checking ", (mhclo_name, given_name))
-                    if mhclo_name in given_name and uuid:
-                        mhclo = Mhclo()
-                        mhclo.load(asset["full_path"])
-                        if mhclo.uuid == uuid:
-                            _LOG.debug("Matching asset", (asset["full_path"], asset["fragment"]))
-                            human_info[bodypart] = asset["fragment"]
-                            profiler.leave("_check_parse_mhm_bodypart_line")
-                            return True
+
+                # Find asset which match uuid, preferably also filename. This is a lookup in the
+                # asset catalog, so no mhclo files need to be parsed.
+                candidates = AssetService.find_asset_names_by_uuid(uuid, root_name, asset_type)
+                mhclo_name = str(name).lower()
+                for asset_name in candidates:
+                    _LOG.debug("Checking ", (mhclo_name, str(asset_name).lower()))
+                    if mhclo_name in str(asset_name).lower():
+                        candidates = [asset_name]
+                        break
+                if candidates:
+                    asset = assets[candidates[0]]
+                    _LOG.debug("Matching asset", (asset["full_path"], asset["fragment"]))
+                    human_info[bodypart] = asset["fragment"]
+                    profiler.leave("_check_parse_mhm_bodypart_line")
+                    return True
 
                 if not perform_deep_search:
                     _LOG.warn("Giving up because bodypart could not be found", (bodypart, name))
+                    profiler.leave("_check_parse_mhm_bodypart_line")
                     return False
 
-                _LOG.warn("About to perform deep search for bodypart, which will take a long time", (bodypart, name))
+                _LOG.warn("About to perform deep search for bodypart", (bodypart, name))
 
-                # Find asset which match only uuid
-                for asset_name in assets:
-                    asset = assets[asset_name]
-                    mhclo = Mhclo()
-                    mhclo.load(asset["full_path"])
-                    if uuid and mhclo.uuid == uuid:
-                        _LOG.debug("Matching asset", (asset["full_path"], asset["fragment"]))
-                        human_info[bodypart] = asset["fragment"]
-                        profiler.leave("_check_parse_mhm_bodypart_line")
-                        return True
                 # Find asset which match only filename
                 for asset_name in assets:
                     asset = assets[asset_name]
-                    mhclo = Mhclo()
-                    mhclo.load(asset["full_path"])
                     given_name = str(asset_name).lower()
-                    mhclo_name = str(mhclo.name).lower()
+                    mhclo_name = str(AssetService.get_mhclo_name(asset_name, root_name, asset_type)).lower()
                     label = asset["label"].lower()
 
                     if given_name == mhclo_name or given_name == label:
@@ -964,65 +994,50 @@ class HumanService:
         assets = AssetService.get_asset_list(root_name, asset_type)
 
         _LOG.dump("Potential assets", assets)
-        # Find asset which match both filename and UUID
-        for asset_name in assets:
-            asset = assets[asset_name]
-            given_name = str(asset_name).lower()
-            given_name_compact = str(asset_name).lower().replace(" ", "")
-            given_name_compact = str(given_name_compact).lower().replace("_", "")
 
-            mhclo_name = str(name).lower()
-            mhclo_name_compact = mhclo_name.replace("_", "")
-            mhclo_name_compact = mhclo_name_compact.replace(" ", "")
+        mhclo_name = str(name).lower()
+        mhclo_name_compact = mhclo_name.replace("_", "")
+        mhclo_name_compact = mhclo_name_compact.replace(" ", "")
+
+        # Find asset which match uuid, preferably also filename. This is a lookup in the asset
+        # catalog, so no mhclo files need to be parsed.
+        candidates = AssetService.find_asset_names_by_uuid(uuid, root_name, asset_type)
+        for asset_name in candidates:
+            given_name = str(asset_name).lower()
+            given_name_compact = given_name.replace(" ", "")
+            given_name_compact = given_name_compact.replace("_", "")
 
             _LOG.debug("Checking ", (mhclo_name, given_name, given_name_compact))
-            if (mhclo_name in given_name or mhclo_name_compact in given_name_compact) and uuid:
-                mhclo = Mhclo()
-                mhclo.load(asset["full_path"])
-                if mhclo.uuid == uuid:
-                    _LOG.debug("Matching asset", (asset["full_path"], asset["fragment"]))
-                    human_info["clothes"].append(asset["fragment"])
-                    profiler.leave("_check_parse_mhm_clothes_line")
-                    return True
+            if mhclo_name in given_name or mhclo_name_compact in given_name_compact:
+                candidates = [asset_name]
+                break
+
+        if candidates:
+            asset = assets[candidates[0]]
+            _LOG.debug("Matching asset", (asset["full_path"], asset["fragment"]))
+            human_info["clothes"].append(asset["fragment"])
+            profiler.leave("_check_parse_mhm_clothes_line")
+            return True
 
         if not perform_deep_search:
             _LOG.warn("Giving up since asset could not be found: ", name)
+            profiler.leave("_check_parse_mhm_clothes_line")
             return False
 
-        _LOG.warn("Asset was not found in assets list, it will take time to find it", name)
-
-
-        # Find assets that only match UUID
-        for asset_name in assets:
-            asset = assets[asset_name]
-            mhclo = Mhclo()
-            try:
-                mhclo.load(asset["full_path"])
-                if uuid and mhclo.uuid == uuid:
-                    _LOG.debug("Matching asset", (asset["full_path"], asset["fragment"]))
-                    human_info["clothes"].append(asset["fragment"])
-                    profiler.leave("_check_parse_mhm_clothes_line")
-                    return True
-            except:
-                _LOG.error("Failed to load asset ", asset["full_path"])
+        _LOG.warn("Asset was not found by uuid, will try to find it by name", name)
 
         # Find assets that only match filename
         for asset_name in assets:
             asset = assets[asset_name]
-            mhclo = Mhclo()
-            try:
-                mhclo.load(asset["full_path"])
-                given_name = str(asset_name).lower()
-                mhclo_name = str(mhclo.name).lower()
-                label = asset["label"].lower()
-
-                if given_name == mhclo_name or given_name == label:
-                    _LOG.debug("Matching asset", (asset["full_path"], asset["fragment"]))
-                    human_info["clothes"].append(asset["fragment"])
-                    profiler.leave("_check_parse_mhm_clothes_line")
-                    return True
-            except:
-                _LOG.error("Failed to load asset ", asset["full_path"])
+            given_name = str(asset_name).lower()
+            mhclo_name = str(AssetService.get_mhclo_name(asset_name, root_name, asset_type)).lower()
+            label = asset["label"].lower()
+
+            if given_name == mhclo_name or given_name == label:
+                _LOG.debug("Matching asset", (asset["full_path"], asset["fragment"]))
+                human_info["clothes"].append(asset["fragment"])
+                profiler.leave("_check_parse_mhm_clothes_line")
+                return True
 
         profiler.leave("_check_parse_mhm_clothes_line")
 
@@ -1038,6 +1053,7 @@ class HumanService:
 
         profiler = PrimitiveProfiler("HumanService")
         profiler.enter("deserialize_from_mhm")
+        started = time.perf_counter()
         _LOG.debug("filename", filename)
         if not os.path.exists(filename):
             raise IOError(str(filename) + " does not exist")
@@ -1089,6 +1105,7 @@ class HumanService:
         human_info["name"] = name
 
         _LOG.dump("human_info", human_info)
+        HumanService._record_batch_stage("parse_mhm", started)
         basemesh = HumanService.deserialize_from_dict(human_info, deserialization_settings)
 
         profiler.leave("deserialize_from_mhm")
@@ -1116,7 +1133,10 @@ class HumanService:
 
         ObjectService.deselect_and_deactivate_all()
 
-        basemesh = ObjectService.load_base_mesh(context=bpy.context, scale_factor=scale, load_vertex_groups=True, exclude_vertex_groups=exclude)
+        if _BATCH is not None:
+            basemesh = HumanService._copy_batch_basemesh_template(scale, exclude)
+        else:
+            basemesh = ObjectService.load_base_mesh(context=bpy.context, scale_factor=scale, load_vertex_groups=True, exclude_vertex_groups=exclude)
 
         if macro_detail_dict is None:
             macro_detail_dict = TargetService.get_default_macro_info_dict()
@@ -1148,8 +1168,95 @@ class HumanService:
         profiler.leave("create_human")
         return basemesh
 
+    @staticmethod
+    def _copy_batch_basemesh_template(scale, exclude):
+        """Return a linked copy of the batch's unlinked base mesh template for the given scale and excluded
+        vertex groups, loading the template from base.obj if this is the first human needing it."""
+        templates = _BATCH["basemesh_templates"]
+        key = (scale, tuple(sorted(exclude)))
+        if key not in templates:
+            _LOG.debug("Loading base mesh template for batch", key)
+            template = ObjectService.load_base_mesh(context=bpy.context, scale_factor=scale, load_vertex_groups=True, exclude_vertex_groups=exclude)
+            for collection in list(template.users_collection):
+                collection.objects.unlink(template)
+            templates[key] = template
+        template = templates[key]
+        basemesh = template.copy()
+        basemesh.data = template.data.copy()
+        basemesh.name = "Human"
+        ObjectService.link_blender_object(basemesh)
+        ObjectService.activate_blender_object(basemesh, deselect_all=True)
+        return basemesh
+
+    @staticmethod
+    def _record_batch_stage(stage, started):
+        """If a batch is running, add the time elapsed since started to the timing of the given stage.
+        Returns the current time, to be used as start of the next stage."""
+        now = time.perf_counter()
+        if _BATCH is not None:
+            timings = _BATCH["timings"]
+            timings[stage] = timings.get(stage, 0.0) + (now - started)
+        return now
+
+    @staticmethod
+    def create_humans_in_batch(sources, deserialization_settings=None):
+        """Create a number of humans in one go. Each source is either a human_info dict, the path
+        to an MHM file or the path to a human.*.json preset. Within the batch, the base mesh is only
+        loaded once and then copied for each human, and MAKESKIN materials of identical assets are
+        shared between humans. Compiled targets stay resident for the whole session anyway.
+
+        Returns a tuple with the list of created basemeshes and a report dict on the form
+        {"humans": [{"source", "name", "timings", "total"}, ...], "stages": {...}, "total": seconds}"""
+
+        global _BATCH # pylint: disable=W0603
+
+        if deserialization_settings is None:
+            deserialization_settings = HumanService.get_default_deserialization_settings()
+        deserialization_settings = dict(deserialization_settings)
+        deserialization_settings.setdefault("clothes_deep_search", False)
+        deserialization_settings.setdefault("bodypart_deep_search", False)
+
+        basemeshes = []
+        report = {"humans": [], "stages": dict(), "total": 0.0}
+        batch_started = time.perf_counter()
+
+        _BATCH = {"basemesh_templates": dict(), "materials": dict(), "timings": dict()}
+        try:
+            for source in sources:
+                _BATCH["timings"] = dict()
+                started = time.perf_counter()
+                if isinstance(source, dict):
+                    label = source.get("name", "")
+                    basemesh = HumanService.deserialize_from_dict(source, deserialization_settings)
+                elif str(source).lower().endswith(".mhm"):
+                    label = str(source)
+                    basemesh = HumanService.deserialize_from_mhm(str(source), deserialization_settings)
+                else:
+                    label = str(source)
+                    basemesh = HumanService.deserialize_from_json_file(str(source), deserialization_settings)
+                total = time.perf_counter() - started
+                timings = _BATCH["timings"]
+                _LOG.debug("Created batch human", (label, basemesh.name, total))
+                report["humans"].append({"source": label, "name": basemesh.name, "timings": timings, "total": total})
+                for stage in timings:
+                    report["stages"][stage] = report["stages"].get(stage, 0.0) + timings[stage]
+                basemeshes.append(basemesh)
+        finally:
+            templates = _BATCH["basemesh_templates"]
+            _BATCH = None
+            for template in templates.values():
+                mesh = template.data
+                ObjectService.delete_object(template)
+                if mesh.users == 0:
+                    bpy.data.meshes.remove(mesh)
+
+        report["total"] = time.perf_counter() - batch_started
+        return basemeshes, report
+
     @staticmethod
     def add_builtin_rig(basemesh, rig_name, *, import_weights=True, operator=None):
+        HumanService.invalidate_refit_snapshot(basemesh)
+
         is_rigify = rig_name.startswith("rigify.")
         rig_name_base = rig_name[7:] if is_rigify else rig_name
 
@@ -1208,7 +1315,10 @@ class HumanService:
         return armature_object
 
     @staticmethod
-    def refit(blender_object):
+    def refit(blender_object, force_full=False):
+        """Refit mesh assets, rig and subrigs to the current shape of the basemesh. Unless force_full is set,
+        only assets and bones which depend on basemesh vertices that moved since the previous refit are
+        refitted. The first refit of a basemesh is always a full one."""
         _LOG.enter()
         basemesh = ObjectService.find_object_of_type_amongst_nearest_relatives(blender_object, "Basemesh")
         rig = ObjectService.find_object_of_type_amongst_nearest_relatives(blender_object, "Skeleton")
@@ -1222,12 +1332,35 @@ class HumanService:
 
         _LOG.dump("basemesh, rig, parent_object", (basemesh, rig, parent_object))
 
-        for child in ObjectService.find_related_mesh_assets(parent_object, only_children=True):
+        children = list(ObjectService.find_related_mesh_assets(parent_object, only_children=True))
+        fitted_assets = (rig.name if rig else None, frozenset(child.name for child in children))
+
+        human_coords = MeshService.get_mixed_vertex_coordinates(basemesh)
+        refit_key = (basemesh.as_pointer(), basemesh.name)
+        (previous_coords, previous_assets) = _REFIT_COORDS.pop(refit_key, (None, None))
+
+        changed_vertices = None
+        if previous_assets != fitted_assets:
+            # Assets were added or removed in a way which did not drop the snapshot
+            previous_coords = None
+        if not force_full and previous_coords is not None and previous_coords.shape == human_coords.shape:
+            changed_vertices = (numpy.abs(human_coords - previous_coords) > _REFIT_TOLERANCE).any(axis=1)
+            _LOG.debug("Number of vertices changed since last refit", int(changed_vertices.sum()))
+
+        refitted_anything = changed_vertices is None
+
+        for child in children:
+            mhclo = ClothesService.load_mhclo_for_clothes(child)
+            if changed_vertices is not None and not ClothesService.mhclo_depends_on_vertices(mhclo, changed_vertices):
+                _LOG.debug("Child proxy is not affected by the changes, not refitting", child)
+                continue
             _LOG.debug("Will try to refit child proxy", child)
-            ClothesService.fit_clothes_to_human(child, basemesh, set_parent=False)
+            ClothesService.fit_clothes_to_human(child, basemesh, mhclo=mhclo, set_parent=False, human_coords=human_coords)
+            refitted_anything = True
 
         if rig:
-            RigService.refit_existing_armature(rig, basemesh)
+            if RigService.refit_existing_armature(rig, basemesh, changed_vertices=changed_vertices):
+                refitted_anything = True
 
             subrigs = []
 
@@ -1240,7 +1373,8 @@ class HumanService:
                 if child and child not in subrigs:
                     subrigs.append(child)
 
-            if subrigs:
+            # Subrigs follow both the parent rig and their asset mesh, so they are refitted if either might have moved
+            if subrigs and refitted_anything:
                 rig.data.pose_position = "REST"
 
                 try:
@@ -1252,6 +1386,30 @@ class HumanService:
                 finally:
                     rig.data.pose_position = "POSE"
 
+        # Only remember the shape once everything has been fitted to it
+        if previous_assets is None:
+            HumanService._prune_refit_snapshots()
+        _REFIT_COORDS[refit_key] = (human_coords, fitted_assets)
+
+    @staticmethod
+    def _prune_refit_snapshots():
+        """Drop the snapshots of basemeshes which no longer exist under the name they had at their last refit."""
+        for (pointer, name) in list(_REFIT_COORDS.keys()):
+            blender_object = bpy.data.objects.get(name)
+            if blender_object is None or blender_object.as_pointer() != pointer:
+                del _REFIT_COORDS[(pointer, name)]
+
+    @staticmethod
+    def invalidate_refit_snapshot(basemesh=None):
+        """Forget the shape the basemesh had at its last refit, so that the next refit is a full one. With
+        None, the snapshots of all basemeshes are forgotten."""
+        if basemesh is None:
+            _REFIT_COORDS.clear()
+            return
+        pointer = basemesh.as_pointer()
+        for key in [key for key in _REFIT_COORDS if key[0] == pointer]:
+            del _REFIT_COORDS[key]
+
     @staticmethod
     def get_asset_sources_of_equipped_mesh_assets(basemesh):
         if not basemesh:
@@ -3,9 +3,23 @@ from .logservice import LogService
 
 import re
 import json
+import struct
+import numpy
 
 _LOG = LogService.get_logger("entities.jsoncall")
 
+_NUM_FORMAT = re.compile(r"^[\-]?[0-9][0-9]*\.?[0-9]+$")
+
+# The compact encoding is a json header, where numeric arrays are replaced by attachment descriptors,
+# followed by the raw bytes of the arrays. It is only used with servers which list "compact" among
+# their encodings in getProtocolInfo. Layout: magic, header length (uint32, network order), header, attachments.
+COMPACT_MAGIC = b"MPFB-COMPACT-1\n"
+_COMPACT_HEADER_LENGTH = struct.Struct("!I")
+_ATTACHMENT_KEY = "$attachment"
+
+# Numeric lists shorter than this are written inline in the json header
+_ATTACHMENT_MIN_LENGTH = 64
+
 
 class JsonCall():
 
@@ -99,8 +113,7 @@ class JsonCall():
             return True
         if isinstance(val, float):
             return True
-        num_format = re.compile("^[\-]?[0-9][0-9]*\.?[0-9]+$")
-        isnumber = re.match(num_format, str(val))
+        isnumber = re.match(_NUM_FORMAT, str(val))
         return isnumber
 
     def _number_as_string(self, val):
@@ -111,28 +124,15 @@ class JsonCall():
 
     def _dict_as_string(self, val):
         _LOG.enter()
-        ret = "{ "
-
-        first = True
-
-        for key in val.keys():
-            if first:
-                first = False
-            else:
-                ret = ret + ", "
-            ret = ret + self.python_value_to_json_value(val[key], key)
-
-        return ret + " }"
+        items = [self.python_value_to_json_value(val[key], key) for key in val.keys()]
+        return "{ " + ", ".join(items) + " }"
 
     def _array_as_string(self, array):
         _LOG.enter()
-        ret = "[ "
-        for i in range(len(array)):
-            val = array[i]
-            ret = ret + self.python_value_to_json_value(val)
-            if i + 1 < len(array):
-                ret += ","
-        return ret + " ]"
+        if isinstance(array, numpy.ndarray):
+            array = array.tolist()
+        items = [self.python_value_to_json_value(val) for val in array]
+        return "[ " + ",".join(items) + " ]"
 
     def python_value_to_json_value(self, val, key_name=None):
         _LOG.enter()
@@ -159,23 +159,113 @@ class JsonCall():
 
     def serialize(self):
         _LOG.enter()
-        ret = "{\n"
-        ret = ret + "  \"function\": \"" + self.function + "\",\n"
-        ret = ret + "  \"error\": \"" + self.error + "\",\n"
-        ret = ret + "  \"params\": {\n"
-
-        first = True
-
-        for key in self.params.keys():
-            if not first:
-                ret = ret + ",\n"
-            else:
-                first = False
-            ret = ret + "    " + self.python_value_to_json_value(self.params[key], key)
-
-        ret = ret + "\n  },\n"
-
-        ret = ret + "  " + self.python_value_to_json_value(self.data, "data") + "\n}\n"
-
-        return ret.replace('\\', '\\\\')  # allow windows paths in data
+        parts = ["{\n"]
+        parts.append("  \"function\": \"" + self.function + "\",\n")
+        parts.append("  \"error\": \"" + self.error + "\",\n")
+        parts.append("  \"params\": {\n")
+        parts.append(",\n".join(["    " + self.python_value_to_json_value(self.params[key], key) for key in self.params.keys()]))
+        parts.append("\n  },\n")
+        parts.append("  " + self.python_value_to_json_value(self.data, "data") + "\n}\n")
+
+        return "".join(parts).replace('\\', '\\\\')  # allow windows paths in data
+
+    @staticmethod
+    def _as_numeric_array(val):
+        """Return val as a numpy array if it is a numeric array large enough to be sent as an attachment,
+        otherwise None."""
+        if isinstance(val, numpy.ndarray):
+            return val if val.dtype.kind in "biuf" else None
+        if isinstance(val, (list, tuple)) and len(val) >= _ATTACHMENT_MIN_LENGTH:
+            if not isinstance(val[0], (int, float, list, tuple)) or isinstance(val[0], bool):
+                return None
+            try:
+                array = numpy.asarray(val)
+            except ValueError:
+                return None
+            return array if array.dtype.kind in "iuf" else None
+        return None
+
+    @staticmethod
+    def _extract_attachments(val, attachments):
+        """Return a copy of val where numeric arrays have been moved to the attachments list and replaced
+        by descriptors."""
+        array = JsonCall._as_numeric_array(val)
+        if array is not None:
+            array = numpy.ascontiguousarray(array)
+            attachments.append(array)
+            return {_ATTACHMENT_KEY: len(attachments) - 1, "dtype": array.dtype.str, "shape": list(array.shape)}
+        if isinstance(val, dict):
+            return {key: JsonCall._extract_attachments(val[key], attachments) for key in val}
+        if isinstance(val, (list, tuple)):
+            return [JsonCall._extract_attachments(item, attachments) for item in val]
+        if isinstance(val, numpy.generic):
+            return val.item()
+        return val
+
+    @staticmethod
+    def _insert_attachments(val, attachments):
+        if isinstance(val, dict):
+            if _ATTACHMENT_KEY in val:
+                return attachments[val[_ATTACHMENT_KEY]]
+            return {key: JsonCall._insert_attachments(val[key], attachments) for key in val}
+        if isinstance(val, list):
+            return [JsonCall._insert_attachments(item, attachments) for item in val]
+        return val
+
+    def serialize_compact(self):
+        """Serialize the call into the compact encoding. Numeric arrays (numpy arrays and long lists of
+        numbers) in params and data are sent as raw binary attachments."""
+        _LOG.enter()
+        attachments = []
+        header = {
+            "function": self.function,
+            "error": self.error,
+            "params": self._extract_attachments(self.params, attachments),
+            "data": self._extract_attachments(self.data, attachments)
+            }
+        header_bytes = json.dumps(header, separators=(",", ":")).encode()
+        parts = [COMPACT_MAGIC, _COMPACT_HEADER_LENGTH.pack(len(header_bytes)), header_bytes]
+        parts.extend([array.data.cast("B") if array.size else b"" for array in attachments])
+        return b"".join(parts)
+
+    def populate_from_compact(self, compact_data):
+        """Populate the call from data in the compact encoding. Attachments become numpy arrays which
+        share memory with compact_data."""
+        _LOG.enter()
+        offset = len(COMPACT_MAGIC)
+        (header_length,) = _COMPACT_HEADER_LENGTH.unpack_from(compact_data, offset)
+        offset = offset + _COMPACT_HEADER_LENGTH.size
+        header = json.loads(bytes(compact_data[offset:offset + header_length]).decode())
+        offset = offset + header_length
+
+        descriptors = []
+        JsonCall._collect_descriptors(header, descriptors)
+        descriptors.sort(key=lambda descriptor: descriptor[_ATTACHMENT_KEY])
+        attachments = []
+        for descriptor in descriptors:
+            dtype = numpy.dtype(descriptor["dtype"])
+            count = int(numpy.prod(descriptor["shape"]))
+            array = numpy.frombuffer(compact_data, dtype=dtype, count=count, offset=offset)
+            attachments.append(array.reshape(descriptor["shape"]))
+            offset = offset + count * dtype.itemsize
+
+        self.function = header["function"]
+        self.error = header["error"]
+        if header["params"]:
+            for key, value in JsonCall._insert_attachments(header["params"], attachments).items():
+                self.params[key] = value
+        if header["data"] is not None:
+            self.data = JsonCall._insert_attachments(header["data"], attachments)
+
+    @staticmethod
+    def _collect_descriptors(val, descriptors):
+        if isinstance(val, dict):
+            if _ATTACHMENT_KEY in val:
+                descriptors.append(val)
+                return
+            for item in val.values():
+                JsonCall._collect_descriptors(item, descriptors)
+        if isinstance(val, list):
+            for item in val:
+                JsonCall._collect_descriptors(item, descriptors)
 
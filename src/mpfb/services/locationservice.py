@@ -26,6 +26,7 @@ class _LocationService():
 
         self._user_data = os.path.join(self._user_home, "data")
         self._user_config = os.path.join(self._user_home, "config")
+        self._user_cache = os.path.join(self._user_home, "cache")
 
         self._log_dir = os.path.join(self._user_home, "logs")
 
@@ -44,6 +45,7 @@ class _LocationService():
         self._relevant_directories.append(self._user_home)
         self._relevant_directories.append(self._user_data)
         self._relevant_directories.append(self._user_config)
+        self._relevant_directories.append(self._user_cache)
 
         self._relevant_directories.append(self._log_dir)
 
@@ -76,6 +78,7 @@ class _LocationService():
         _LOG.enter()
         self._mh_user_data = None
         self._mh_auto_user_data = False
+        self._mh_user_data_discovery = None
         try:
             mh_user_data = get_preference("mh_user_data")
         except:
@@ -120,6 +123,17 @@ class _LocationService():
         if self._mh_auto_user_data:
             self._mh_user_data = new_path
 
+    def defer_mh_user_data_discovery(self, discover):
+        """Have discover() called the first time the mh user data dir is asked for, rather than now. It is
+        expected to call update_mh_user_data_if_relevant() if it finds a better location."""
+        self._mh_user_data_discovery = discover
+
+    def _run_deferred_mh_user_data_discovery(self):
+        discover = self._mh_user_data_discovery
+        if discover:
+            self._mh_user_data_discovery = None
+            discover()
+
     def ensure_relevant_directories_exist(self):
         _LOG.enter()
         for dir_path in self._relevant_directories:
@@ -154,6 +168,10 @@ class _LocationService():
         _LOG.enter()
         return self._return_path(self._user_config, sub_path)
 
+    def get_user_cache(self, sub_path=None):
+        _LOG.enter()
+        return self._return_path(self._user_cache, sub_path)
+
     def get_mpfb_data(self, sub_path=None):
         _LOG.enter()
         return self._return_path(self._mpfb_data, sub_path)
@@ -185,6 +203,7 @@ class _LocationService():
 
     def get_mh_user_data(self, sub_path=None):
         _LOG.enter()
+        self._run_deferred_mh_user_data_discovery()
         if not self.is_mh_user_data_enabled():
             return None
         return self._return_path(self._mh_user_data, sub_path)
@@ -197,6 +216,7 @@ class _LocationService():
         return os.path.exists(self._test_root)
 
     def is_mh_user_data_enabled(self):
+        self._run_deferred_mh_user_data_discovery()
         return self._mh_user_data is not None
 
     def is_mh_auto_user_data_enabled(self):
@@ -1,6 +1,6 @@
 """Functionality for logging"""
 
-import os, bpy, time, pprint, inspect, json
+import os, bpy, time, pprint, inspect, json, threading, atexit
 
 # There's a catch 22 where paths should be read from the location
 # service, but the location service is dependent on the log service
@@ -34,6 +34,97 @@ if not os.path.exists(_CONFIG_DIR):
 _JUSTIFICATION = 40
 _START = int(time.time() * 1000.0)
 
+# Log files are written via memory buffers which are flushed to disk at this interval (in seconds)
+_FLUSH_INTERVAL = 1.0
+_BUFFER_SIZE = 32 * 1024
+
+# Log files are opened on first write, and at most this many are kept open at the same time
+_MAX_OPEN_FILES = 16
+
+
+class _LogWriter():
+    """Writes to the log files via memory buffers. The buffers are flushed to disk by a background thread at
+    regular intervals, when a message of level error or worse is written and when blender exits. Files are
+    opened when they are first written to, and the least recently written file is closed when there are too
+    many open. After close(), the writer starts over with the next write."""
+
+    def __init__(self):
+        self._files = dict()
+        self._truncate_on_open = set()
+        self._lock = threading.Lock()
+        self._stopped = None
+        self._thread = None
+        atexit.register(self.close)
+
+    def _start(self):
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._flush_periodically, args=(self._stopped,), name="mpfb-log-writer", daemon=True)
+        self._thread.start()
+
+    def _get_file(self, path):
+        if self._thread is None:
+            self._start()
+        # Re-inserting the file keeps the dict ordered from least to most recently written
+        log_file = self._files.pop(path, None)
+        if log_file is None:
+            mode = "w" if path in self._truncate_on_open else "a"
+            self._truncate_on_open.discard(path)
+            if len(self._files) >= _MAX_OPEN_FILES:
+                self._files.pop(next(iter(self._files))).close()
+            log_file = open(path, mode, buffering=_BUFFER_SIZE)
+        self._files[path] = log_file
+        return log_file
+
+    def truncate(self, path):
+        """Have the file at the given path emptied when it is next written to."""
+        with self._lock:
+            log_file = self._files.pop(path, None)
+            if log_file is not None:
+                log_file.close()
+            self._truncate_on_open.add(path)
+
+    def ensure_exists(self, path):
+        """Write out any pending truncation of the file, so that it exists on disk even if nothing has been
+        written to it yet."""
+        with self._lock:
+            if path in self._truncate_on_open:
+                self._truncate_on_open.discard(path)
+                with open(path, "w"):
+                    pass
+
+    def write(self, path, text):
+        with self._lock:
+            self._get_file(path).write(text)
+
+    def flush(self):
+        with self._lock:
+            for log_file in self._files.values():
+                try:
+                    log_file.flush()
+                except (IOError, OSError, ValueError) as err:
+                    print("Could not flush log file " + str(log_file.name) + ": " + str(err))
+
+    def close(self):
+        """Flush and close all open files and stop the background thread."""
+        with self._lock:
+            if self._stopped is not None:
+                self._stopped.set()
+            self._stopped = None
+            self._thread = None
+            for log_file in self._files.values():
+                try:
+                    log_file.close()
+                except (IOError, OSError, ValueError) as err:
+                    print("Could not close log file " + str(log_file.name) + ": " + str(err))
+            self._files.clear()
+
+    def _flush_periodically(self, stopped):
+        while not stopped.wait(_FLUSH_INTERVAL):
+            self.flush()
+
+
+_WRITER = _LogWriter()
+
 
 class Logger():
     """This class implements a log channel. The log channel will report messages which are at
@@ -46,26 +137,34 @@ class Logger():
         self.level_is_overridden = False
         self.path = os.path.join(_LOGDIR, "separated." + name + ".txt")
         self.time_stamp = _START
-        with open(self.path, "w") as log_file:
-            log_file.write("")
+        self._location = str(self.name + " ").ljust(_JUSTIFICATION, ".") + ": "
+        _WRITER.truncate(self.path)
 
     def _log_message(self, level, message, extra_object=None):
+        # Nothing is formatted unless the message is actually going to be reported
         if level <= self.level:
             extra = ""
             if not extra_object is None:
                 extra = " " + str(extra_object)
-            location = str(self.name + " ").ljust(_JUSTIFICATION, ".") + ": "
-            long_message = "[" + LogService.LOGLEVELS[level] + "] " + location + message + extra
-            short_message = "[" + LogService.LOGLEVELS[level] + "] " + message + extra
+            short_message = "[" + LogService.LOGLEVELS[level] + "] " + str(message) + extra
+            long_message = "[" + LogService.LOGLEVELS[level] + "] " + self._location + str(message) + extra
             print(long_message)
-            with open(self.path, "a") as log_file:
-                log_file.write(short_message + "\n")
-            with open(_COMBINED, "a") as log_file:
-                log_file.write(long_message + "\n")
+            _WRITER.write(self.path, short_message + "\n")
+            _WRITER.write(_COMBINED, long_message + "\n")
+            if level <= LogService.ERROR:
+                # Make sure errors hit the disk, in case we are about to go down
+                _WRITER.flush()
+
+    def is_enabled(self, level):
+        """Check if messages of the given level will be reported. Use this to guard expensive log calls in hot code."""
+        return level <= self.level
 
     def debug_enabled(self):
         return self.level >= LogService.DEBUG
 
+    def trace_enabled(self):
+        return self.level >= LogService.TRACE
+
     def set_level(self, level):
         """Set the highest level to report for this channel"""
         self.level = level
@@ -85,15 +184,18 @@ class Logger():
 
     def info(self, message, extra_object=None):
         """Report an information, if the log level is at least 3."""
-        self._log_message(LogService.INFO, message, extra_object)
+        if self.level >= LogService.INFO:
+            self._log_message(LogService.INFO, message, extra_object)
 
     def debug(self, message, extra_object=None):
         """Report a debug message, if the log level is at least 4."""
-        self._log_message(LogService.DEBUG, message, extra_object)
+        if self.level >= LogService.DEBUG:
+            self._log_message(LogService.DEBUG, message, extra_object)
 
     def trace(self, message, extra_object=None):
         """Report an trace message, if the log level is at least 5."""
-        self._log_message(LogService.TRACE, message, extra_object)
+        if self.level >= LogService.TRACE:
+            self._log_message(LogService.TRACE, message, extra_object)
 
     def dump(self, message, extra_object):
         """Dump a large data structure to the log, if the log level is at least trace."""
@@ -112,7 +214,8 @@ class Logger():
             info["line_number"] = str(stack.f_lineno)
             info["caller_name"] = stack.f_globals["__name__"]
             info["file_name"] = stack.f_globals["__file__"]
-            info["caller_method"] = inspect.stack()[1][3]
+            # Note that inspect.stack() would read the source of every frame in the stack, which is very slow
+            info["caller_method"] = stack.f_code.co_name
             message = "Now entering {}.{}():{}".format(info["caller_name"], info["caller_method"], info["line_number"])
             self._log_message(LogService.TRACE, message)
 
@@ -122,14 +225,17 @@ class Logger():
 
     def time(self, message):
         """Report a timestamp message, if log level is at least debug."""
-        current = int(time.time() * 1000.0)
-        self._log_message(LogService.DEBUG, message, current - self.time_stamp)
+        if self.level >= LogService.DEBUG:
+            current = int(time.time() * 1000.0)
+            self._log_message(LogService.DEBUG, message, current - self.time_stamp)
 
     def reset_timer(self):
         """Reset the timer for this log channel"""
         self.time_stamp = int(time.time() * 1000.0)
 
     def get_path_to_log_file(self):
+        _WRITER.flush()
+        _WRITER.ensure_exists(self.path)
         return os.path.abspath(self.path)
 
 
@@ -191,8 +297,21 @@ class LogService():
 
     @staticmethod
     def get_path_to_combined_log_file():
+        _WRITER.flush()
+        _WRITER.ensure_exists(_COMBINED)
         return os.path.abspath(_COMBINED)
 
+    @staticmethod
+    def flush():
+        """Write all buffered log messages to disk now, rather than waiting for the next periodic flush."""
+        _WRITER.flush()
+
+    @staticmethod
+    def close():
+        """Flush and close all open log files and stop the background flush thread. Logging still works
+        afterwards, files are then opened again as needed."""
+        _WRITER.close()
+
 class _LogService():
 
     def __init__(self):
@@ -208,8 +327,7 @@ class _LogService():
         else:
             print("Log config does not exist. Creating empty template.")
             self.rewrite_json()
-        with open(_COMBINED, "w") as log_file:
-            log_file.write("")
+        _WRITER.truncate(_COMBINED)
 
     def reset_log_levels(self):
         self._default_log_level = LogService.INFO
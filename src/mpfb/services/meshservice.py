@@ -1,4 +1,4 @@
-import bpy
+import bpy, numpy, random
 from mpfb.services.logservice import LogService
 from mpfb.services.objectservice import ObjectService
 
@@ -27,21 +27,96 @@ class MeshService:
         raise RuntimeError("You should not instance MeshService. Use its static methods instead.")
 
     @staticmethod
-    def find_vertices_in_vertex_group(mesh_object, vertex_group_name):
-        """Find all vertices in a vertex group, return a list with vertex index and weight in group."""
+    def get_mixed_vertex_coordinates(mesh_object):
+        """Return the vertex positions of the mesh as they are with all shape keys applied at their current
+        values, as an (N, 3) float32 array."""
         _LOG.enter()
-        result = []
-
-        vertex_group = mesh_object.vertex_groups.get(vertex_group_name)
-        if not vertex_group:
-            return result
+        mesh = mesh_object.data
+        vertex_count = len(mesh.vertices)
+        coords = numpy.empty(vertex_count * 3, dtype=numpy.float32)
+        if mesh.shape_keys and len(mesh.shape_keys.key_blocks) > 0:
+            key_name = "temporary_mix_key." + str(random.randrange(1000, 9999))
+            shape_key = mesh_object.shape_key_add(name=key_name, from_mix=True)
+            shape_key.data.foreach_get("co", coords)
+            mesh_object.shape_key_remove(shape_key)
+        else:
+            mesh.vertices.foreach_get("co", coords)
+        return coords.reshape(-1, 3)
 
-        for vert in mesh_object.data.vertices:
-            for group in vert.groups:
-                if group.group == vertex_group.index:
-                    result.append([vert.index, group.weight])
+    @staticmethod
+    def get_vertex_group_weights(mesh_object, group_names=None):
+        """Return a dict with vertex group names as keys and (vertex indices, weights) tuples of int32 and
+        float32 arrays as values, sorted on vertex index. All groups, or only those in group_names, are extracted
+        in one pass over the vertices. The weights are read from the mesh on every call, since edits such as
+        weight painting cannot be detected. The returned arrays are read-only."""
+        _LOG.enter()
+        all_group_names = [str(group.name) for group in mesh_object.vertex_groups]
+        if group_names is None:
+            group_names = all_group_names
+        else:
+            requested = set(group_names)
+            group_names = [name for name in all_group_names if name in requested]
+        wanted = set(mesh_object.vertex_groups[name].index for name in group_names)
+
+        vertex_indices = []
+        group_indices = []
+        weights = []
+        for vertex in mesh_object.data.vertices:
+            for group in vertex.groups:
+                if group.group in wanted:
+                    vertex_indices.append(vertex.index)
+                    group_indices.append(group.group)
+                    weights.append(group.weight)
+
+        vertex_indices = numpy.array(vertex_indices, dtype=numpy.int32)
+        group_indices = numpy.array(group_indices, dtype=numpy.int32)
+        weights = numpy.array(weights, dtype=numpy.float32)
+
+        # A stable sort on group keeps the vertex order within each group
+        order = numpy.argsort(group_indices, kind="stable")
+        vertex_indices = vertex_indices[order]
+        weights = weights[order]
+        boundaries = numpy.searchsorted(group_indices[order], numpy.arange(len(all_group_names) + 1))
+
+        vertex_indices.flags.writeable = False
+        weights.flags.writeable = False
+
+        result = dict()
+        for group_name in group_names:
+            group_index = mesh_object.vertex_groups[group_name].index
+            start, end = boundaries[group_index], boundaries[group_index + 1]
+            result[group_name] = (vertex_indices[start:end], weights[start:end])
         return result
 
+    @staticmethod
+    def add_weights_to_vertex_group(vertex_group, vertex_indices, weights, mode='REPLACE'):
+        """Add vertices with weights to a vertex group, using one call per distinct weight rather than one per vertex.
+        A single float for weights means that all vertices get that weight."""
+        vertex_indices = numpy.asarray(vertex_indices, dtype=numpy.int64)
+        if len(vertex_indices) < 1:
+            return
+        if numpy.isscalar(weights):
+            vertex_group.add(vertex_indices.tolist(), float(weights), mode)
+            return
+        # Blender stores weights as 32-bit floats, so there is no point in separating weights which differ beyond that
+        weights = numpy.asarray(weights, dtype=numpy.float32)
+        unique_weights, inverse = numpy.unique(weights, return_inverse=True)
+        order = numpy.argsort(inverse, kind="stable")
+        sorted_indices = vertex_indices[order]
+        boundaries = numpy.searchsorted(inverse[order], numpy.arange(len(unique_weights) + 1))
+        for weight_number, weight in enumerate(unique_weights.tolist()):
+            vertex_group.add(sorted_indices[boundaries[weight_number]:boundaries[weight_number + 1]].tolist(), weight, mode)
+
+    @staticmethod
+    def find_vertices_in_vertex_group(mesh_object, vertex_group_name):
+        """Find all vertices in a vertex group, return a list with vertex index and weight in group."""
+        _LOG.enter()
+        group_weights = MeshService.get_vertex_group_weights(mesh_object, [vertex_group_name])
+        if vertex_group_name not in group_weights:
+            return []
+        vertex_indices, weights = group_weights[vertex_group_name]
+        return [list(pair) for pair in zip(vertex_indices.tolist(), weights.tolist())]
+
     @staticmethod
     def create_vertex_group(mesh_object, vertex_group_name, verts_and_weights, nuke_existing_group=False):
         """Create a new vertex group and add verts and weights to it."""
@@ -62,5 +137,6 @@ class MeshService:
 
         _LOG.debug("Final group", group)
 
-        for index, weight in verts_and_weights:
-            group.add([index], weight, 'REPLACE')
+        if verts_and_weights:
+            vertex_indices, weights = zip(*verts_and_weights)
+            MeshService.add_weights_to_vertex_group(group, vertex_indices, weights, 'REPLACE')
@@ -8,8 +8,10 @@ import inspect
 
 from mpfb.services.objectservice import ObjectService
 from mpfb.services.logservice import LogService
+from mpfb.entities.primitiveprofiler import PrimitiveProfiler
 
 _LOG = LogService.get_logger("services.nodeservice")
+_PROFILER = PrimitiveProfiler("NodeService")
 
 _NODETYPETOCLASS = dict()
 _NODETYPETOCLASS["BOOLEAN"] = "NodeSocketBool"
@@ -559,6 +561,7 @@ class NodeService:
                         _LOG.debug("Output socket already existed:", output_name)
 
     @staticmethod
+    @_PROFILER.profile()
     def apply_node_tree_from_dict(target_node_tree, dict_with_node_tree, wipe_node_tree=False):
         """Update an entire node tree based on information in the provided dict. The node tree
         must exist. This will also recursively update or create node groups if necessary."""
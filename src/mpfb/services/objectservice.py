@@ -108,19 +108,13 @@ class ObjectService:
     def get_vertex_indexes_for_vertex_group(blender_object, vertex_group_name):
         if not blender_object or not vertex_group_name:
             return []
-        group_index = None
-        for group in blender_object.vertex_groups:
-            if group.name == vertex_group_name:
-                group_index = group.index
-        if group_index is None:
+        vertex_group = blender_object.vertex_groups.get(vertex_group_name)
+        if vertex_group is None:
             return []
-        relevant_vertices = []
-        for vertex in blender_object.data.vertices:
-            for group in vertex.groups:
-                if group.group == group_index:
-                    if not vertex.index in relevant_vertices:
-                        relevant_vertices.append(vertex.index)
-        return relevant_vertices
+        group_index = vertex_group.index
+        # Each vertex is visited once, so no need to check for duplicates
+        return [vertex.index for vertex in blender_object.data.vertices
+                if any(group.group == group_index for group in vertex.groups)]
 
     @staticmethod
     def create_blender_object_with_mesh(name="NewObject", parent=None, skip_linking=False):
@@ -1,6 +1,6 @@
 """Service for working with rigs, bones and weights."""
 
-import bpy, os, fnmatch, shutil, json, re, typing
+import bpy, os, fnmatch, shutil, json, re, typing, hashlib, numpy
 from bpy.types import PoseBone
 from collections import defaultdict
 from mathutils import Matrix, Vector
@@ -12,12 +12,24 @@ from mpfb.services.logservice import LogService
 from mpfb.services.systemservice import SystemService
 from mpfb.services.targetservice import TargetService
 from mpfb.services.objectservice import ObjectService
+from mpfb.services.meshservice import MeshService
 
 
 _LOG = LogService.get_logger("services.rigservice")
 
 _RADIAN = 0.0174532925
 
+# Compiled weight files are stored as one npz file per source file: a group name table ("groups") and
+# CSR style arrays, where the vertex indices and weights of group number i are found in "indices" and
+# "weights" between "offsets"[i] and "offsets"[i + 1]. The cache file name is a hash of the source path,
+# its mtime and its size, so a changed source file will simply miss the cache and get recompiled.
+_COMPILED_WEIGHTS_VERSION = 1
+_COMPILED_WEIGHTS_DIR = LocationService.get_user_cache("weights")
+_COMPILED_WEIGHTS_FIELDS = ["groups", "offsets", "indices", "weights"]
+
+# Compiled weights which have already been loaded in this session, keyed on cache path
+_LOADED_COMPILED_WEIGHTS = dict()
+
 
 class RigService:
     """Service with utility functions for working with rigs, bones and weights. It only has static methods, so you don't
@@ -515,15 +527,14 @@ class RigService:
 
         _LOG.dump("Weights before vertices", weights)
 
-        for vertex in basemesh.data.vertices:
-            for group in vertex.groups:
-                group_index = int(group.group)
-                weight = max(0, min(1, round(group.weight, 5) + 0))
-                if group_index in vertex_group_index_to_name:
-                    name = vertex_group_index_to_name[group_index]
-                    if name in weights["weights"]:
-                        if weight >= exclude_weights_below:
-                            weights["weights"][name].append([vertex.index, weight])
+        group_weights = MeshService.get_vertex_group_weights(basemesh)
+
+        for name, (vertex_indices, vertex_weights) in group_weights.items():
+            if name in weights["weights"]:
+                for vertex_index, weight in zip(vertex_indices.tolist(), vertex_weights.tolist()):
+                    weight = max(0, min(1, round(weight, 5) + 0))
+                    if weight >= exclude_weights_below:
+                        weights["weights"][name].append([vertex_index, weight])
 
         return weights
 
@@ -540,13 +551,94 @@ class RigService:
             replace: Completely replace group content, i.e. vertices not mentioned in the file are removed.
         """
 
-        with open(mhw_filename, 'r') as json_file:
-            weights = json.load(json_file)
-
-        _LOG.dump("Weights", weights)
+        weights = RigService.load_compiled_weights(mhw_filename)
 
         RigService.apply_weights(armature_objects, basemesh, weights, all=all, replace=replace)
 
+    @staticmethod
+    def compile_weights(mhw_dict):
+        """Convert a weights dict, as found in weights json and mhw files, to the compiled form. This is a dict with
+        the list of group names as "groups", and the arrays "offsets", "indices" (int32) and "weights" (float32), where
+        the vertex indices and weights of group number i are found between offsets[i] and offsets[i + 1]."""
+        weights = mhw_dict["weights"]
+        groups = list(weights.keys())
+
+        offsets = numpy.zeros(len(groups) + 1, dtype=numpy.int64)
+        numpy.cumsum([len(weights[name]) for name in groups], out=offsets[1:])
+
+        pairs = numpy.array([pair for name in groups for pair in weights[name]], dtype=numpy.float64).reshape(-1, 2)
+
+        return {
+            "groups": groups,
+            "offsets": offsets,
+            "indices": pairs[:, 0].astype(numpy.int32),
+            "weights": pairs[:, 1].astype(numpy.float32),
+            }
+
+    @staticmethod
+    def compiled_weights_path(mhw_filename):
+        """Return the path where the compiled version of the weights file is cached. The file does not necessarily exist."""
+        realpath = os.path.realpath(mhw_filename)
+        stat = os.stat(realpath)
+        key = "|".join([realpath, str(stat.st_mtime_ns), str(stat.st_size), str(_COMPILED_WEIGHTS_VERSION)])
+        return os.path.join(_COMPILED_WEIGHTS_DIR, hashlib.sha1(key.encode("utf-8")).hexdigest() + ".npz")
+
+    @staticmethod
+    def load_compiled_weights(mhw_filename):
+        """Return the weights in a json or mhw file in compiled form, see compile_weights(). The compiled cache is used
+        if it is up to date, otherwise the file is parsed and compiled first. The arrays are shared, so do not modify them."""
+        cache_path = RigService.compiled_weights_path(mhw_filename)
+        if cache_path in _LOADED_COMPILED_WEIGHTS:
+            return _LOADED_COMPILED_WEIGHTS[cache_path]
+
+        compiled = None
+        if os.path.exists(cache_path):
+            try:
+                with numpy.load(cache_path) as npz:
+                    compiled = {field: npz[field] for field in _COMPILED_WEIGHTS_FIELDS}
+                compiled["groups"] = compiled["groups"].tolist()
+            except (ValueError, OSError, KeyError) as err:
+                _LOG.warn("Could not read compiled weights, will recompile", (cache_path, err))
+                compiled = None
+
+        if compiled is None:
+            with open(mhw_filename, 'r') as json_file:
+                weights = json.load(json_file)
+
+            _LOG.dump("Weights", weights)
+
+            compiled = RigService.compile_weights(weights)
+
+            if not os.path.exists(_COMPILED_WEIGHTS_DIR):
+                os.makedirs(_COMPILED_WEIGHTS_DIR, exist_ok=True)
+
+            # Write to a temporary file first, so that a concurrent reader never sees a half written cache entry
+            temp_path = cache_path + "." + str(os.getpid()) + ".tmp"
+            with open(temp_path, "wb") as cache_file:
+                numpy.savez(cache_file, **{**compiled, "groups": numpy.array(compiled["groups"], dtype=str)})
+            os.replace(temp_path, cache_path)
+            _LOG.debug("Compiled weights", (mhw_filename, cache_path))
+
+        for field in _COMPILED_WEIGHTS_FIELDS[1:]:
+            compiled[field].flags.writeable = False
+
+        _LOADED_COMPILED_WEIGHTS[cache_path] = compiled
+        return compiled
+
+    @staticmethod
+    def clear_compiled_weights():
+        """Forget all loaded weights and remove all entries from the compiled weights cache."""
+        _LOADED_COMPILED_WEIGHTS.clear()
+        if not os.path.exists(_COMPILED_WEIGHTS_DIR):
+            return
+        for filename in os.listdir(_COMPILED_WEIGHTS_DIR):
+            if filename.endswith(".npz") or filename.endswith(".tmp"):
+                try:
+                    os.remove(os.path.join(_COMPILED_WEIGHTS_DIR, filename))
+                except OSError as err:
+                    # Most likely the file is being written by another process (on windows)
+                    _LOG.warn("Could not remove compiled weights", (filename, err))
+
     @staticmethod
     def set_extra_bones(armature_object, extra_bones: list[str] | None):
         id_name = SkeletonObjectProperties.get_fullname_key_from_shortname_key("extra_bones")
@@ -626,13 +718,20 @@ class RigService:
 
     @staticmethod
     def apply_weights(armature_objects, basemesh, mhw_dict, *, all=False, replace=False):
-        weights = mhw_dict["weights"]
+        """Apply weights to the given mesh object. The weights can be either a weights dict or in compiled form."""
+        compiled = mhw_dict if "offsets" in mhw_dict else RigService.compile_weights(mhw_dict)
+        offsets = compiled["offsets"]
+        indices = compiled["indices"]
+        weights = compiled["weights"]
+
+        group_slices = {name: slice(offsets[number], offsets[number + 1])
+                        for number, name in enumerate(compiled["groups"])}
 
         # Map bones to groups
         if not isinstance(armature_objects, list):
             armature_objects = [armature_objects]
 
-        group_to_bone = RigService._map_weight_groups_to_bones(armature_objects, weights.keys())
+        group_to_bone = RigService._map_weight_groups_to_bones(armature_objects, group_slices.keys())
 
         bone_to_groups = defaultdict(list)
         for name, bone_name in group_to_bone.items():
@@ -648,7 +747,7 @@ class RigService:
         assert len(names) == len(group_to_bone)
 
         # Add masks and other groups
-        names += [name for name in weights.keys()
+        names += [name for name in group_slices.keys()
                   if name not in group_to_bone
                   and (all or name.startswith("mhmask-"))]
 
@@ -664,24 +763,22 @@ class RigService:
                     # Remove all vertices
                     vertex_group.remove(remove_indices)
 
-                elif weight_array := weights[group_name]:
+                else:
                     # Clear specific vertices
-                    vertex_indices, vertex_weights = zip(*weight_array)
-                    vertex_group.add(vertex_indices, 0.0, 'REPLACE')
+                    MeshService.add_weights_to_vertex_group(vertex_group, indices[group_slices[group_name]], 0.0, 'REPLACE')
 
         # Assign group weights: allows combining groups by adding duplicate vertex entries together
         for group_name in names:
-            weight_array = weights[group_name]
+            group_slice = group_slices[group_name]
 
-            if all or weight_array:
+            if all or group_slice.stop > group_slice.start:
                 bone_name = group_to_bone.get(group_name, group_name)
                 vertex_group = basemesh.vertex_groups.get(bone_name)
 
                 if not vertex_group:
                     vertex_group = basemesh.vertex_groups.new(name=bone_name)
 
-                for vertex_index, weight in weight_array:
-                    vertex_group.add([vertex_index], weight, 'ADD')
+                MeshService.add_weights_to_vertex_group(vertex_group, indices[group_slice], weights[group_slice], 'ADD')
 
     @staticmethod
     def identify_rig(armature_object):
@@ -915,13 +1012,15 @@ class RigService:
         return pose
 
     @staticmethod
-    def refit_existing_armature(armature_object, basemesh):
+    def refit_existing_armature(armature_object, basemesh, changed_vertices=None):
+        """Move the bones of the armature to fit the basemesh. If changed_vertices (a boolean array over the
+        basemesh vertices) is given, only bones whose positions depend on those vertices are moved. Returns
+        False if there was nothing to refit."""
         _LOG.debug("Armature object", armature_object)
 
         # Try to refit Rigify metarig instead and re-generate
         if metarig := ObjectService.find_rigify_metarig_by_rig(armature_object):
-            RigService.refit_existing_armature(metarig, basemesh)
-            return
+            return RigService.refit_existing_armature(metarig, basemesh, changed_vertices)
 
         rig_type = RigService.identify_rig(armature_object)
 
@@ -943,7 +1042,7 @@ class RigService:
 
         rig_file = os.path.join(rigdir, "rig." + rig_type + ".json")
 
-        RigService._do_refit_existing_armature(armature_object, basemesh, rig_file)
+        return RigService._do_refit_existing_armature(armature_object, basemesh, rig_file, changed_vertices=changed_vertices)
 
     @staticmethod
     def refit_existing_subrig(armature_object, parent_rig):
@@ -983,19 +1082,27 @@ class RigService:
         RigService._do_refit_existing_armature(armature_object, asset_mesh, rig_file, parent_rig)
 
     @staticmethod
-    def _do_refit_existing_armature(armature_object, basemesh, rig_file, parent_rig=None):
+    def _do_refit_existing_armature(armature_object, basemesh, rig_file, parent_rig=None, changed_vertices=None):
         from mpfb.entities.rig import Rig
         _LOG.reset_timer()
 
+        _LOG.debug("Rig file", rig_file)
+
+        bone_names = None
+        if changed_vertices is not None:
+            rig_definition = Rig.load_rig_definition(rig_file)["bones"]
+            bone_names = Rig.find_bones_depending_on_vertices(rig_definition, basemesh, changed_vertices)
+            _LOG.debug("Number of bones to refit", len(bone_names))
+            if not bone_names:
+                return False
+
         current_active_object = bpy.context.view_layer.objects.active
         bpy.context.view_layer.objects.active = armature_object
 
-        _LOG.debug("Rig file", rig_file)
-
         rig = Rig.from_json_file_and_basemesh(rig_file, basemesh, parent=parent_rig)
         rig.armature_object = armature_object
 
-        rig.reposition_edit_bone()
+        rig.reposition_edit_bone(bone_names=bone_names)
 
         # Automatically re-generate Rigify metarigs
         if ObjectService.find_rigify_rig_by_metarig(armature_object):
@@ -1004,6 +1111,7 @@ class RigService:
 
         bpy.context.view_layer.objects.active = current_active_object
         _LOG.time("Refitting took")
+        return True
 
     @staticmethod
     def normalize_rotation_mode(armature_object, rotation_mode="XYZ"):
@@ -1,10 +1,82 @@
-
 from .logservice import LogService
-from .jsoncall import JsonCall
-import asyncio
+from .jsoncall import JsonCall, COMPACT_MAGIC
+import asyncio, struct
+from collections import deque
 
 _LOG = LogService.get_logger("services.socketservice")
 
+# Servers which support it are talked to over one persistent connection, where each message is prefixed
+# by its length. The connection is opened by sending _FRAMED_HELLO, after which requests can be written
+# without waiting for earlier responses (the server answers in request order). Servers which do not know
+# about this (as told by the getProtocolInfo call) get one connection per call, read until EOF.
+# Independently of this, calls are sent in the compact encoding (see JsonCall) if the server lists it.
+_FRAMED_HELLO = b"MPFB-FRAMED-1\n"
+_FRAME_HEADER = struct.Struct("!Q")
+
+# Number of simultaneous connections when fetching concurrently from a server without framing support
+_LEGACY_CONCURRENCY = 4
+
+
+class _FramedConnection():
+    """A persistent, pipelined connection to the socket server. Responses are handed to the waiting
+    requests in the order the requests were written."""
+
+    def __init__(self, reader, writer):
+        self._reader = reader
+        self._writer = writer
+        self._pending = deque()
+        self._drain_lock = asyncio.Lock()
+        self.closed = False
+        self._reader_task = asyncio.ensure_future(self._read_responses())
+
+    @staticmethod
+    async def open(host, port):
+        reader, writer = await asyncio.open_connection(host, port)
+        writer.write(_FRAMED_HELLO)
+        return _FramedConnection(reader, writer)
+
+    async def request(self, payload):
+        if self.closed:
+            raise ConnectionResetError("The connection to the socket server is closed")
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append(future)
+        self._writer.writelines([_FRAME_HEADER.pack(len(payload)), payload])
+        async with self._drain_lock:
+            await self._writer.drain()
+        return await future
+
+    async def _read_responses(self):
+        error = ConnectionResetError("The socket server closed the connection")
+        try:
+            while True:
+                (length,) = _FRAME_HEADER.unpack(await self._reader.readexactly(_FRAME_HEADER.size))
+                payload = await self._reader.readexactly(length)
+                if not self._pending:
+                    _LOG.error("Got a response from the socket server without a pending request")
+                    continue
+                future = self._pending.popleft()
+                if not future.done():
+                    future.set_result(payload)
+        except asyncio.IncompleteReadError:
+            pass
+        except OSError as err:
+            error = err
+        self._fail_pending(error)
+
+    def _fail_pending(self, error):
+        self.closed = True
+        while self._pending:
+            future = self._pending.popleft()
+            if not future.done():
+                future.set_exception(error)
+
+    def close(self):
+        _LOG.enter()
+        self._fail_pending(ConnectionResetError("The connection to the socket server was closed"))
+        self._reader_task.cancel()
+        self._writer.close()
+
+
 class _SocketService():
 
     def __init__(self):
@@ -13,6 +85,10 @@ class _SocketService():
         self._host = "127.0.0.1"
         self._port = 12345
         self._call_cache = dict()
+        self._loop = None
+        self._connection = None
+        self._connection_lock = None
+        self._protocol_info = None
 
     def _value_from_cache(self, function_name):
         _LOG.enter()
@@ -24,61 +100,144 @@ class _SocketService():
 
     def set_host(self, host):
         _LOG.enter()
+        if host != self._host:
+            self.close()
         self._host = host
 
     def set_port(self, port):
         _LOG.enter()
+        if port != self._port:
+            self.close()
         self._port = port
 
-    async def _call_for_json(self, call):
+    def close(self):
+        """Close the persistent connection, if any, and forget what was negotiated with the server."""
         _LOG.enter()
-        _LOG.reset_timer()
+        if self._connection is not None:
+            self._connection.close()
+            self._run(asyncio.sleep(0))  # Let the connection's reader task finish
+        self._connection = None
+        self._protocol_info = None
+
+    def _run(self, coroutine):
+        """Run a coroutine to completion on the service's own event loop. The loop is kept between calls,
+        since the persistent connection belongs to it."""
+        if self._loop is None or self._loop.is_closed():
+            self._loop = asyncio.new_event_loop()
+            self._connection = None
+            self._connection_lock = None
+        return self._loop.run_until_complete(coroutine)
+
+    async def _legacy_request(self, payload):
         reader, writer = await asyncio.open_connection(self._host, self._port)
-
-        _LOG.debug("About to send call for", call.function)
-        serialized_data = call.serialize()
-        _LOG.dump("Serialized data", serialized_data)
-        data_to_send = serialized_data.encode()
-        writer.write(data_to_send)
+        writer.write(payload)
         await writer.drain()
-
         data_returned = await reader.read(-1)  # -1 = until EOF
-        decoded_data = data_returned.decode()
-        _LOG.dump("Decoded returned data", decoded_data)
         writer.close()
         await writer.wait_closed()
+        return data_returned
+
+    async def _prepare(self):
+        """Ask the server which protocol it speaks, if this has not been done already. This must be awaited
+        before issuing concurrent calls."""
+        if self._connection_lock is None:
+            self._connection_lock = asyncio.Lock()
+        async with self._connection_lock:
+            if self._protocol_info is not None:
+                return
+            call = JsonCall("getProtocolInfo")
+            data_returned = await self._legacy_request(call.serialize().encode())
+            protocol_info = dict()
+            try:
+                call.populate_from_json(data_returned.decode())
+                if not call.error and isinstance(call.data, dict):
+                    protocol_info = call.data
+            except ValueError:
+                pass
+            _LOG.debug("Socket server protocol info", protocol_info)
+            self._protocol_info = protocol_info
+
+    def _supports(self, key, value):
+        return self._protocol_info is not None and value in self._protocol_info.get(key, [])
+
+    async def _get_connection(self):
+        async with self._connection_lock:
+            if self._connection is None or self._connection.closed:
+                _LOG.debug("Opening persistent connection to socket server")
+                self._connection = await _FramedConnection.open(self._host, self._port)
+            return self._connection
+
+    async def _request(self, call, semaphore=None):
+        await self._prepare()
+        if self._supports("encodings", "compact"):
+            payload = call.serialize_compact()
+        else:
+            payload = call.serialize().encode()
+        if not self._supports("framing", "length-prefixed"):
+            if semaphore is None:
+                return await self._legacy_request(payload)
+            async with semaphore:
+                return await self._legacy_request(payload)
+        try:
+            return await (await self._get_connection()).request(payload)
+        except ConnectionError as err:
+            # The server may have dropped an idle connection. All calls are safe to repeat, so try once more
+            _LOG.warn("Persistent connection failed, reconnecting", err)
+            return await (await self._get_connection()).request(payload)
+
+    async def _call_for_json(self, call, semaphore=None):
+        _LOG.enter()
+        _LOG.reset_timer()
 
-        call.populate_from_json(decoded_data)
+        _LOG.debug("About to send call for", call.function)
+        data_returned = await self._request(call, semaphore)
+        if data_returned.startswith(COMPACT_MAGIC):
+            _LOG.debug("Length of returned compact data", len(data_returned))
+            call.populate_from_compact(data_returned)
+        else:
+            decoded_data = data_returned.decode()
+            _LOG.dump("Decoded returned data", decoded_data)
+            call.populate_from_json(decoded_data)
         _LOG.time("Milliseconds it took to perform the call and deserialize data:")
 
-    async def _call_for_binary(self, call):
+    async def _call_for_binary(self, call, semaphore=None):
         _LOG.enter()
         _LOG.reset_timer()
-        reader, writer = await asyncio.open_connection(self._host, self._port)
 
         _LOG.debug("About to send call for", call.function)
-        serialized_data = call.serialize()
-        _LOG.dump("Serialized data", serialized_data)
-        data_to_send = serialized_data.encode()
-        writer.write(data_to_send)
-        await writer.drain()
-
-        data_returned = await reader.read(-1)  # -1 = until EOF
+        data_returned = await self._request(call, semaphore)
         decoded_data = bytearray(data_returned)
         _LOG.debug("Length of returned data", len(decoded_data))
         _LOG.dump("Decoded returned data", decoded_data)
-        writer.close()
-        await writer.wait_closed()
         call.data = decoded_data
         _LOG.time("Milliseconds it took to perform the call and deserialize data:")
 
+    def _fetch_concurrently(self, calls):
+        """Perform a number of calls concurrently. The calls argument is a dict with (JsonCall, is_binary) tuples.
+        Returns a dict with the same keys and the data returned by each call."""
+        _LOG.enter()
+
+        async def fetch_all():
+            await self._prepare()
+            semaphore = asyncio.Semaphore(_LEGACY_CONCURRENCY)
+            coroutines = []
+            for (call, is_binary) in calls.values():
+                if is_binary:
+                    coroutines.append(self._call_for_binary(call, semaphore))
+                else:
+                    coroutines.append(self._call_for_json(call, semaphore))
+            await asyncio.gather(*coroutines)
+
+        self._run(fetch_all())
+        return {key: calls[key][0].data for key in calls}
+
     def get_user_dir(self):
         _LOG.enter()
         cached_value = self._value_from_cache("getUserDir")
         if not cached_value is None:
             return cached_value
         call = JsonCall("getUserDir")
-        asyncio.run(self._call_for_json(call))
+        self._run(self._call_for_json(call))
         self._call_cache["getUserDir"] = call.data
         return call.data
 
@@ -88,130 +247,176 @@ class _SocketService():
         if not cached_value is None:
             return cached_value
         call = JsonCall("getSysDir")
-        asyncio.run(self._call_for_json(call))
+        self._run(self._call_for_json(call))
         self._call_cache["getSysDir"] = call.data
         return call.data
 
     def get_body_mesh_info(self):
         _LOG.enter()
         call = JsonCall("getBodyMeshInfo")
-        asyncio.run(self._call_for_json(call))
+        self._run(self._call_for_json(call))
         return call.data
 
     def get_body_vertices(self):
         _LOG.enter()
         call = JsonCall("getBodyVerticesBinary")
-        asyncio.run(self._call_for_binary(call))
+        self._run(self._call_for_binary(call))
         return call.data
 
     def get_body_faces(self):
         _LOG.enter()
         call = JsonCall("getBodyFacesBinary")
-        asyncio.run(self._call_for_binary(call))
+        self._run(self._call_for_binary(call))
         return call.data
 
     def get_body_texture_coords(self):
         _LOG.enter()
         call = JsonCall("getBodyTextureCoordsBinary")
-        asyncio.run(self._call_for_binary(call))
+        self._run(self._call_for_binary(call))
         return call.data
 
     def get_body_uv_mapping(self):
         _LOG.enter()
         call = JsonCall("getBodyFaceUVMappingsBinary")
-        asyncio.run(self._call_for_binary(call))
+        self._run(self._call_for_binary(call))
         return call.data
 
     def get_body_material_info(self):
         _LOG.enter()
         call = JsonCall("getBodyMaterialInfo")
-        asyncio.run(self._call_for_json(call))
+        self._run(self._call_for_json(call))
         return call.data
 
     def get_skeleton(self):
         _LOG.enter()
         call = JsonCall("getSkeleton")
-        asyncio.run(self._call_for_json(call))
+        self._run(self._call_for_json(call))
         return call.data
 
     def get_body_weight_info(self):
         _LOG.enter()
         call = JsonCall("getBodyWeightInfo")
-        asyncio.run(self._call_for_json(call))
+        self._run(self._call_for_json(call))
         return call.data
 
     def get_body_weight_vertices(self):
         _LOG.enter()
         call = JsonCall("getBodyWeightsVertList")
-        asyncio.run(self._call_for_binary(call))
+        self._run(self._call_for_binary(call))
         return call.data
 
     def get_body_weights(self):
         _LOG.enter()
         call = JsonCall("getBodyWeights")
-        asyncio.run(self._call_for_binary(call))
+        self._run(self._call_for_binary(call))
         return call.data
 
     def get_proxies_info(self):
         _LOG.enter()
         call = JsonCall("getProxiesInfo")
-        asyncio.run(self._call_for_json(call))
+        self._run(self._call_for_json(call))
         return call.data
 
     def get_proxy_vertices(self, uuid):
         _LOG.enter()
         call = JsonCall("getProxyVerticesBinary")
         call.params = {"uuid": uuid}
-        asyncio.run(self._call_for_binary(call))
+        self._run(self._call_for_binary(call))
         return call.data
 
     def get_proxy_faces(self, uuid):
         _LOG.enter()
         call = JsonCall("getProxyFacesBinary")
         call.params = {"uuid": uuid}
-        asyncio.run(self._call_for_binary(call))
+        self._run(self._call_for_binary(call))
         return call.data
 
     def get_proxy_texture_coords(self, uuid):
         _LOG.enter()
         call = JsonCall("getProxyTextureCoordsBinary")
         call.params = {"uuid": uuid}
-        asyncio.run(self._call_for_binary(call))
+        self._run(self._call_for_binary(call))
         return call.data
 
     def get_proxy_uv_mapping(self, uuid):
         _LOG.enter()
         call = JsonCall("getProxyFaceUVMappingsBinary")
         call.params = {"uuid": uuid}
-        asyncio.run(self._call_for_binary(call))
+        self._run(self._call_for_binary(call))
         return call.data
 
     def get_proxy_weight_info(self, uuid):
         _LOG.enter()
         call = JsonCall("getProxyWeightInfo")
         call.params = {"uuid": uuid}
-        asyncio.run(self._call_for_json(call))
+        self._run(self._call_for_json(call))
         return call.data
 
     def get_proxy_weight_vertices(self, uuid):
         _LOG.enter()
         call = JsonCall("getProxyWeightsVertList")
         call.params = {"uuid": uuid}
-        asyncio.run(self._call_for_binary(call))
+        self._run(self._call_for_binary(call))
         return call.data
 
     def get_proxy_weights(self, uuid):
         _LOG.enter()
         call = JsonCall("getProxyWeights")
         call.params = {"uuid": uuid}
-        asyncio.run(self._call_for_binary(call))
+        self._run(self._call_for_binary(call))
         return call.data
 
     def get_proxy_material_info(self, uuid):
         _LOG.enter()
         call = JsonCall("getProxyMaterialInfo")
         call.params = {"uuid": uuid}
-        asyncio.run(self._call_for_json(call))
+        self._run(self._call_for_json(call))
         return call.data
 
+    def get_body_mesh_data(self):
+        """Fetch the mesh info, vertices, faces, texture coords and uv mappings of the body concurrently."""
+        _LOG.enter()
+        return self._fetch_concurrently({
+            "mesh_info": (JsonCall("getBodyMeshInfo"), False),
+            "vertices": (JsonCall("getBodyVerticesBinary"), True),
+            "faces": (JsonCall("getBodyFacesBinary"), True),
+            "texture_coords": (JsonCall("getBodyTextureCoordsBinary"), True),
+            "uv_mapping": (JsonCall("getBodyFaceUVMappingsBinary"), True)
+            })
+
+    def get_body_weight_data(self):
+        """Fetch the weight info, weight vertices and weights of the body concurrently."""
+        _LOG.enter()
+        return self._fetch_concurrently({
+            "weight_info": (JsonCall("getBodyWeightInfo"), False),
+            "weight_vertices": (JsonCall("getBodyWeightsVertList"), True),
+            "weights": (JsonCall("getBodyWeights"), True)
+            })
+
+    def get_proxies_mesh_data(self, uuids, include_weights=False):
+        """Fetch the vertices, faces, texture coords and uv mappings, and optionally the weight data, of all
+        the given proxies concurrently. Returns a dict with one dict per uuid."""
+        _LOG.enter()
+        functions = {
+            "vertices": "getProxyVerticesBinary",
+            "faces": "getProxyFacesBinary",
+            "texture_coords": "getProxyTextureCoordsBinary",
+            "uv_mapping": "getProxyFaceUVMappingsBinary"
+            }
+        if include_weights:
+            functions["weight_info"] = "getProxyWeightInfo"
+            functions["weight_vertices"] = "getProxyWeightsVertList"
+            functions["weights"] = "getProxyWeights"
+
+        calls = dict()
+        for uuid in uuids:
+            for key, function in functions.items():
+                calls[(uuid, key)] = (JsonCall(function, params={"uuid": uuid}), function != "getProxyWeightInfo")
+
+        fetched = self._fetch_concurrently(calls)
+        proxies_data = {uuid: dict() for uuid in uuids}
+        for (uuid, key), data in fetched.items():
+            proxies_data[uuid][key] = data
+        return proxies_data
+
 SocketService = _SocketService() # pylint: disable=C0103
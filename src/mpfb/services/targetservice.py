@@ -1,7 +1,6 @@
 """Module for managing targets and shape keys."""
 
-import os, gzip, bpy, json, random, re
-from itertools import count
+import os, gzip, bpy, json, random, re, hashlib, numpy
 
 from pathlib import Path
 from mpfb.services.logservice import LogService
@@ -30,17 +29,27 @@ _HEADER = """# This is a target file for MakeHuman
 _MIRROR_LEFT = None
 _MIRROR_RIGHT = None
 
-_MACRO_CONFIG = dict()
+_MACRO_CONFIG = None # Loaded on first use, see _get_macro_config()
 _TARGETS_DIR = LocationService.get_mpfb_data("targets")
 _MACRO_FILE = os.path.join(_TARGETS_DIR, "macrodetails", "macro.json")
 _MACRO_PATH_PATTERN = "/mpfb/data/targets/macrodetails/"
 
-with open(_MACRO_FILE, "r") as json_file:
-    _MACRO_CONFIG = json.load(json_file)
-
 _LOADER = LogService.get_logger("target loader")
 #_LOADER.set_level(LogService.DUMP)
 
+# Compiled targets are stored as one structured array per target file: an int32 vertex index
+# and a float32 offset triplet (already converted to blender's XYZ order) per modified vertex.
+# The cache file name is a hash of the source path, its mtime and its size, so a changed source
+# file will simply miss the cache and get recompiled.
+_COMPILED_TARGET_DTYPE = numpy.dtype([("index", "<i4"), ("offset", "<f4", (3,))])
+_COMPILED_TARGETS_DIR = LocationService.get_user_cache("targets")
+
+# Compiled targets which have already been loaded in this session, keyed on cache path. The targets are read
+# fully into memory rather than memory mapped, so that no file descriptors are held. The least recently used
+# target is dropped when the cache is full.
+_LOADED_COMPILED_TARGETS = dict()
+_MAX_LOADED_COMPILED_TARGETS = 256
+
 # This is very annoying, but the maximum length of a shape key name is 61 characters
 # in blender. The combinations used in MH filenames tend to be longer than that.
 _SHAPEKEY_ENCODING = [
@@ -75,6 +84,25 @@ _OPPOSITES = [
 
 _ODD_TARGET_NAMES = []
 
+# All macro detail targets are mixed into this single shape key rather than being
+# added as one shape key per macro target. The name must start with "$md" so that
+# it is treated as a macro target everywhere else.
+_COMBINED_MACRO_SHAPE_KEY = "$md-combined"
+
+# Compiled macro targets, keyed on the target path relative to the targets dir (for
+# example "macrodetails/universal-female-young-averagemuscle-averageweight"). These
+# are kept resident since the same few dozen targets are needed on every macro change.
+_RESIDENT_MACRO_TARGETS = dict()
+
+# Macro target stacks as returned by calculate_target_stack_from_macro_info_dict(), keyed on the macro values
+# and the cutoff. Dragging a slider back and forth revisits the same values, so a small cache is enough.
+_MACRO_TARGET_STACKS = dict()
+_MAX_MACRO_TARGET_STACKS = 256
+
+# Target name to value maps, keyed on object pointer, with the shape key datablock pointer and the array of
+# shape key values they were built from. See get_target_values().
+_TARGET_VALUES = dict()
+
 
 class TargetService:
 
@@ -149,38 +177,28 @@ class TargetService:
     def target_full_path(target_name):
         _LOG.enter()
 
-        # Strategy: First scan the system targets. This is the vast majority of cases,
+        # Strategy: First check the system targets. This is the vast majority of cases,
         # so it makes sense to check if the target is there first
         targets_dir = LocationService.get_mpfb_data("targets")
         _LOG.debug("Target dir:", targets_dir)
-        for name in Path(targets_dir).rglob("*.target.gz"):
-            _LOG.dump("matching vs file", name)
-            bn = str(os.path.basename(name)).lower()
-            if bn.startswith(str(target_name).lower()):
-                return str(name)
+        name = AssetService.find_target_by_name([targets_dir], target_name, (".target.gz",))
+        if name:
+            return str(name)
         _LOG.debug("Did not find matching system target for", target_name)
 
-        # Next scan the custom targets dir. This can be expected to be a small list of targets
+        # Next check the custom targets dir. This can be expected to be a small list of targets
         custom_asset_roots = AssetService.get_asset_roots("custom")
         custom_asset_roots.extend(AssetService.get_asset_roots("targets/custom"))
-        custom_targets = AssetService.find_asset_files_matching_pattern(custom_asset_roots, "*.target")
-        custom_targets.extend(AssetService.find_asset_files_matching_pattern(custom_asset_roots, "*.target.gz"))
-        for name in custom_targets:
-            _LOG.dump("matching vs file", name)
-            bn = str(os.path.basename(name)).lower()
-            if bn.startswith(str(target_name).lower()):
-                return str(name)
+        name = AssetService.find_target_by_name(custom_asset_roots, target_name)
+        if name:
+            return str(name)
         _LOG.debug("Did not find matching custom target for", target_name)
 
-        # Finally scan all potential dirs for targets
+        # Finally check all potential dirs for targets
         target_asset_roots = AssetService.get_asset_roots("targets")
-        targets = AssetService.find_asset_files_matching_pattern(target_asset_roots, "*.target")
-        targets.extend(AssetService.find_asset_files_matching_pattern(target_asset_roots, "*.target.gz"))
-        for name in targets:
-            _LOG.dump("matching vs file", name)
-            bn = str(os.path.basename(name)).lower()
-            if bn.startswith(str(target_name).lower()):
-                return str(name)
+        name = AssetService.find_target_by_name(target_asset_roots, target_name)
+        if name:
+            return str(name)
 
         _LOG.warn("Did not find matching target for", target_name)
         return None
@@ -199,6 +217,7 @@ class TargetService:
 
         shape_key = blender_object.shape_key_add(name=shape_key_name, from_mix=create_from_mix)
         shape_key.value = 1.0
+        TargetService.invalidate_target_values(blender_object)
 
         _LOG.debug("shape key", shape_key)
 
@@ -241,14 +260,23 @@ class TargetService:
 
         info = dict()
         info["name"] = shape_key_name
-        info["vertices"] = vertices = []
 
-        for i, basis_vert, target_vert in zip(count(0), basis.data, target.data):
-            offset = (target_vert.co - basis_vert.co) / scale_factor
-            size = abs(offset[0]) + abs(offset[1]) + abs(offset[2])
+        vertex_count = len(target.data)
+        basis_coords = numpy.empty(vertex_count * 3, dtype=numpy.float32)
+        target_coords = numpy.empty(vertex_count * 3, dtype=numpy.float32)
+        basis.data.foreach_get('co', basis_coords)
+        target.data.foreach_get('co', target_coords)
+
+        offsets = (target_coords.astype(numpy.float64) - basis_coords).reshape(-1, 3) / scale_factor
+
+        if only_modified_verts:
+            sizes = numpy.abs(offsets).sum(axis=1)
+            indices = numpy.flatnonzero(sizes > smaller_than_counts_as_unmodified)
+            offsets = offsets[indices]
+        else:
+            indices = numpy.arange(vertex_count)
 
-            if not only_modified_verts or size > smaller_than_counts_as_unmodified:
-                vertices.append((i, offset[0], offset[1], offset[2]))
+        info["vertices"] = list(zip(indices.tolist(), *offsets.T.tolist()))
 
         _LOG.time("Extracting shape key took")
 
@@ -263,21 +291,42 @@ class TargetService:
             if not scale_factor or scale_factor < 0.0001:
                 scale_factor = 1.0
 
+        vertices = info["vertices"]
+        if len(vertices) > 0:
+            vertices = numpy.asarray(vertices, dtype=numpy.float64)
+            indices = vertices[:, 0].astype(numpy.int32)
+            offsets = vertices[:, 1:4]
+        else:
+            indices = numpy.empty(0, dtype=numpy.int32)
+            offsets = numpy.empty((0, 3), dtype=numpy.float64)
+
+        TargetService._add_offsets_to_shape_key(shape_key, indices, offsets, scale_factor)
+
+    @staticmethod
+    def _add_offsets_to_shape_key(shape_key, indices, offsets, scale_factor):
+        """Set the coordinates of shape_key to those of its relative key plus the sparse offsets given as
+        an (N,) index array and an (N,3) offset array."""
         basis = shape_key.relative_key
 
         if not basis:
             raise ValueError("Object does not have a Basis shape key")
 
-        buffer = [0.0] * (len(shape_key.data) * 3)
-        basis.data.foreach_get('co', buffer)
-
-        for i, x, y, z in info["vertices"]:
-            base = i * 3
-            buffer[base] += x * scale_factor
-            buffer[base + 1] += y * scale_factor
-            buffer[base + 2] += z * scale_factor
+        coords = numpy.empty(len(shape_key.data) * 3, dtype=numpy.float32)
+        basis.data.foreach_get('co', coords)
+        coords = coords.reshape(-1, 3)
+        (indices, offsets) = TargetService._clip_offsets_to_vertex_count(indices, offsets, len(coords))
+        numpy.add.at(coords, indices, numpy.asarray(offsets, dtype=numpy.float32) * scale_factor)
+        shape_key.data.foreach_set('co', coords.ravel())
 
-        shape_key.data.foreach_set('co', buffer)
+    @staticmethod
+    def _clip_offsets_to_vertex_count(indices, offsets, vertex_count):
+        """Drop the offsets for vertices which are not in the mesh. Targets include the helper vertices, which
+        come last in the basemesh, so this is needed once the helpers have been deleted."""
+        indices = numpy.asarray(indices)
+        if len(indices) == 0 or indices.max() < vertex_count:
+            return (indices, offsets)
+        mask = indices < vertex_count
+        return (indices[mask], numpy.asarray(offsets)[mask])
 
     @staticmethod
     def shape_key_info_as_target_string(shape_key_info, include_header=True):
@@ -328,6 +377,149 @@ class TargetService:
         profiler.leave("_target_string_to_shape_key_info")
         return info
 
+    @staticmethod
+    def _read_target_file(full_path):
+        if str(full_path).endswith(".gz"):
+            with gzip.open(full_path, "rb") as gzip_file:
+                raw_data = gzip_file.read()
+                return raw_data.decode('utf-8')
+        with open(full_path, "r") as target_file:
+            return target_file.read()
+
+    @staticmethod
+    def compiled_target_path(full_path):
+        """Return the path where the compiled version of the target file at full_path is cached. The file
+        does not necessarily exist."""
+        full_path = os.path.abspath(full_path)
+        stat = os.stat(full_path)
+        key = "{}|{}|{}".format(full_path, stat.st_mtime_ns, stat.st_size)
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        return os.path.join(_COMPILED_TARGETS_DIR, digest + ".npy")
+
+    @staticmethod
+    def compile_target(full_path):
+        """Parse the target file at full_path and write it to the compiled target cache. Returns the
+        compiled target as a read-only array."""
+        profiler = PrimitiveProfiler("TargetService")
+        profiler.enter("compile_target")
+
+        info = TargetService._target_string_to_shape_key_info(TargetService._read_target_file(full_path), None)
+        compiled = numpy.zeros(len(info["vertices"]), dtype=_COMPILED_TARGET_DTYPE)
+        if info["vertices"]:
+            vertices = numpy.array(info["vertices"], dtype=numpy.float64)
+            compiled["index"] = vertices[:, 0]
+            compiled["offset"] = vertices[:, 1:4]
+
+        cache_path = TargetService.compiled_target_path(full_path)
+        if not os.path.exists(_COMPILED_TARGETS_DIR):
+            os.makedirs(_COMPILED_TARGETS_DIR, exist_ok=True)
+
+        # Write to a temporary file first, so that a concurrent reader never sees a half written cache entry
+        temp_path = cache_path + "." + str(os.getpid()) + ".tmp"
+        with open(temp_path, "wb") as cache_file:
+            numpy.save(cache_file, compiled)
+        os.replace(temp_path, cache_path)
+        _LOADER.debug("Compiled target", (full_path, cache_path))
+
+        compiled.flags.writeable = False
+        profiler.leave("compile_target")
+        return compiled
+
+    @staticmethod
+    def load_compiled_target(full_path):
+        """Return the target at full_path as a read-only structured array with the fields "index" and
+        "offset". The compiled cache is used if it is up to date, otherwise the target is compiled first."""
+        profiler = PrimitiveProfiler("TargetService")
+        profiler.enter("load_compiled_target")
+
+        cache_path = TargetService.compiled_target_path(full_path)
+        if cache_path in _LOADED_COMPILED_TARGETS:
+            # Re-inserting the target keeps the dict ordered from least to most recently used
+            compiled = _LOADED_COMPILED_TARGETS.pop(cache_path)
+            _LOADED_COMPILED_TARGETS[cache_path] = compiled
+            profiler.leave("load_compiled_target")
+            return compiled
+
+        compiled = None
+        if os.path.exists(cache_path):
+            try:
+                compiled = numpy.load(cache_path)
+                compiled.flags.writeable = False
+                if compiled.dtype != _COMPILED_TARGET_DTYPE:
+                    _LOADER.warn("Compiled target has unexpected layout, will recompile", cache_path)
+                    compiled = None
+            except (ValueError, OSError) as err:
+                _LOADER.warn("Could not read compiled target, will recompile", (cache_path, err))
+                compiled = None
+
+        if compiled is None:
+            compiled = TargetService.compile_target(full_path)
+
+        if len(_LOADED_COMPILED_TARGETS) >= _MAX_LOADED_COMPILED_TARGETS:
+            del _LOADED_COMPILED_TARGETS[next(iter(_LOADED_COMPILED_TARGETS))]
+        _LOADED_COMPILED_TARGETS[cache_path] = compiled
+
+        profiler.leave("load_compiled_target")
+        return compiled
+
+    @staticmethod
+    def compile_all_targets(include_user_targets=True):
+        """Compile all system targets (and optionally all user and custom targets) which do not already
+        have an up to date entry in the compiled target cache. Returns the number of targets compiled."""
+        _LOG.enter()
+        target_files = AssetService.find_target_files([LocationService.get_mpfb_data("targets")], (".target.gz",))
+        if include_user_targets:
+            roots = AssetService.get_asset_roots("custom")
+            roots.extend(AssetService.get_asset_roots("targets"))
+            roots = [root for root in roots if not str(root).startswith(str(LocationService.get_mpfb_data()))]
+            target_files.extend(AssetService.find_target_files(roots))
+
+        compiled_count = 0
+        for target_file in target_files:
+            if not os.path.exists(TargetService.compiled_target_path(target_file)):
+                TargetService.compile_target(target_file)
+                compiled_count = compiled_count + 1
+        _LOG.info("Compiled targets", (compiled_count, len(target_files)))
+        return compiled_count
+
+    @staticmethod
+    def clear_compiled_targets():
+        """Remove all entries from the compiled target cache."""
+        _LOG.enter()
+        _LOADED_COMPILED_TARGETS.clear()
+        _RESIDENT_MACRO_TARGETS.clear()
+        _MACRO_TARGET_STACKS.clear()
+        if not os.path.exists(_COMPILED_TARGETS_DIR):
+            return
+        for filename in os.listdir(_COMPILED_TARGETS_DIR):
+            if filename.endswith(".npy") or filename.endswith(".tmp"):
+                try:
+                    os.remove(os.path.join(_COMPILED_TARGETS_DIR, filename))
+                except OSError as err:
+                    # Most likely the file is being written by another process (on windows)
+                    _LOG.warn("Could not remove compiled target", (filename, err))
+
+    @staticmethod
+    def compiled_target_to_shape_key(compiled, shape_key_name, blender_object, *, reuse_existing=False):
+        """Create (or reuse) a shape key and populate it with the offsets from a compiled target array."""
+        _LOG.enter()
+        profiler = PrimitiveProfiler("TargetService")
+        profiler.enter("compiled_target_to_shape_key")
+
+        if reuse_existing and blender_object.data.shape_keys and shape_key_name in blender_object.data.shape_keys.key_blocks:
+            shape_key = blender_object.data.shape_keys.key_blocks[shape_key_name]
+        else:
+            shape_key = TargetService.create_shape_key(blender_object, shape_key_name)
+
+        scale_factor = GeneralObjectProperties.get_value("scale_factor", entity_reference=blender_object)
+        if not scale_factor or scale_factor < 0.0001:
+            scale_factor = 1.0
+
+        TargetService._add_offsets_to_shape_key(shape_key, compiled["index"], compiled["offset"], scale_factor)
+
+        profiler.leave("compiled_target_to_shape_key")
+        return shape_key
+
     @staticmethod
     def target_string_to_shape_key(target_string, shape_key_name, blender_object, *, reuse_existing=False):
         _LOG.enter()
@@ -353,6 +545,14 @@ class TargetService:
 
         return shape_key
 
+    @staticmethod
+    def _get_macro_config():
+        global _MACRO_CONFIG
+        if _MACRO_CONFIG is None:
+            with open(_MACRO_FILE, "r") as json_file:
+                _MACRO_CONFIG = json.load(json_file)
+        return _MACRO_CONFIG
+
     @staticmethod
     def _load_mirror_table():
         global _MIRROR_LEFT
@@ -446,31 +646,63 @@ class TargetService:
             return False
         return len(blender_object.data.shape_keys.key_blocks) > 0
 
+    @staticmethod
+    def get_target_values(blender_object):
+        """Return a dict with the names of all targets on the object as keys and their weights as values, in the same
+        way as get_target_stack(). The dict is cached per object. Added or removed shape keys and changed values are
+        detected by comparing the shape key values in bulk, so this is cheap enough to call on every panel redraw.
+        Renaming shape keys outside of TargetService is not detected, so call invalidate_target_values() after that.
+        Do not modify the returned dict."""
+        if blender_object is None or blender_object.type != 'MESH':
+            raise ValueError('Must provide a valid mesh object')
+
+        keys = blender_object.data.shape_keys
+        cache_key = blender_object.as_pointer()
+
+        if keys is None or keys.key_blocks is None or len(keys.key_blocks) < 1:
+            _TARGET_VALUES.pop(cache_key, None)
+            return dict()
+
+        key_blocks = keys.key_blocks
+        values = numpy.empty(len(key_blocks), dtype=numpy.float32)
+        key_blocks.foreach_get("value", values)
+
+        cached = _TARGET_VALUES.get(cache_key)
+        if cached and cached[0] == keys.as_pointer() and numpy.array_equal(cached[1], values):
+            return cached[2]
+
+        target_values = dict()
+        for shape_key, value in zip(key_blocks, values.tolist()):
+            if "basis" not in str(shape_key.name).lower():
+                target_values[shape_key.name] = value
+
+        _TARGET_VALUES[cache_key] = (keys.as_pointer(), values, target_values)
+        return target_values
+
+    @staticmethod
+    def invalidate_target_values(blender_object=None):
+        """Forget the cached target values of the given object, or of all objects if None."""
+        if blender_object is None:
+            _TARGET_VALUES.clear()
+        else:
+            _TARGET_VALUES.pop(blender_object.as_pointer(), None)
+
     @staticmethod
     def has_target(blender_object, target_name, also_check_for_encoded=True):
         if blender_object is None or target_name is None or not target_name:
             _LOG.debug("Empty object or target", (blender_object, target_name))
             return False
-        encoded_name = TargetService.encode_shapekey_name(target_name)
-        stack = TargetService.get_target_stack(blender_object)
-        for target in stack:
-            if target["target"] == target_name:
-                return True
-            if also_check_for_encoded and target["target"] == encoded_name:
-                return True
-        return False
+        target_values = TargetService.get_target_values(blender_object)
+        if target_name in target_values:
+            return True
+        return also_check_for_encoded and TargetService.encode_shapekey_name(target_name) in target_values
 
     @staticmethod
     def get_target_value(blender_object, target_name):
         if blender_object is None or target_name is None or not target_name:
             _LOG.debug("Empty object or target", (blender_object, target_name))
             return 0.0
-        stack = TargetService.get_target_stack(blender_object)
-        for target in stack:
-            _LOG.debug("Target", target)
-            if target["target"] == target_name:
-                return target["value"]
-        return 0.0
+        return TargetService.get_target_values(blender_object).get(target_name, 0.0)
 
     @staticmethod
     def set_target_value(blender_object, target_name, value, delete_target_on_zero=False):
@@ -500,7 +732,7 @@ class TargetService:
         load_info = dict()
         load_info["parsed_target_stack"] = []
 
-        profiler.enter(" -- bulk load -> load string data")
+        profiler.enter(" -- bulk load -> load compiled data")
         for target in target_stack:
             _LOG.debug("Listed target", target)
             target_full_path = TargetService.target_full_path(target["target"])
@@ -510,23 +742,17 @@ class TargetService:
                 parsed_target["full_path"] = target_full_path
                 parsed_target["name"] = target["target"]
                 parsed_target["value"] = target["value"]
-                if str(target_full_path).endswith(".gz"):
-                    with gzip.open(target_full_path, "rb") as gzip_file:
-                        raw_data = gzip_file.read()
-                        parsed_target["target_string"] = raw_data.decode('utf-8')
-                else:
-                    with open(target_full_path, "r") as target_file:
-                        parsed_target["target_string"] = target_file.read()
+                parsed_target["compiled"] = TargetService.load_compiled_target(target_full_path)
                 parsed_target["shape_key_name"] = TargetService.filename_to_shapekey_name(target_full_path)
                 load_info["parsed_target_stack"].append(parsed_target)
             else:
                 _LOG.warn("Skipping target because it could not be resolved to a path", target)
-        profiler.leave(" -- bulk load -> load string data")
+        profiler.leave(" -- bulk load -> load compiled data")
 
         profiler.enter(" -- bulk load -> populate shape keys")
         for target_info in load_info["parsed_target_stack"]:
-            shape_key = TargetService.target_string_to_shape_key(
-                target_info["target_string"], target_info["shape_key_name"], blender_object)
+            shape_key = TargetService.compiled_target_to_shape_key(
+                target_info["compiled"], target_info["shape_key_name"], blender_object)
             shape_key.value = target_info["value"]
         profiler.leave(" -- bulk load -> populate shape keys")
 
@@ -544,28 +770,15 @@ class TargetService:
             raise ValueError("Must specify a valid path - null or none was given")
         if not os.path.exists(full_path):
             raise IOError(full_path + " does not exist")
-        target_string = None
         shape_key = None
 
         if name is None:
             name = TargetService.filename_to_shapekey_name(full_path)
 
         _LOADER.reset_timer()
-        if str(full_path).endswith(".gz"):
-            profiler.enter("load_target_gzip")
-            with gzip.open(full_path, "rb") as gzip_file:
-                raw_data = gzip_file.read()
-                target_string = raw_data.decode('utf-8')
-                profiler.leave("load_target_gzip")
-        else:
-            profiler.enter("load_target_plain")
-            with open(full_path, "r") as target_file:
-                target_string = target_file.read()
-                profiler.leave("load_target_plain")
-
-        if target_string is not None:
-            shape_key = TargetService.target_string_to_shape_key(target_string, name, blender_object)
-            shape_key.value = weight
+        compiled = TargetService.load_compiled_target(full_path)
+        shape_key = TargetService.compiled_target_to_shape_key(compiled, name, blender_object)
+        shape_key.value = weight
 
         _LOADER.time(str(full_path) + " " + str(weight))
         profiler.leave("load_target")
@@ -618,7 +831,7 @@ class TargetService:
         profiler.enter("_interpolate_macro_components")
 
         _LOG.debug("Interpolating macro target", (macro_name, value))
-        macrotarget = _MACRO_CONFIG["macrotargets"][macro_name]
+        macrotarget = TargetService._get_macro_config()["macrotargets"][macro_name]
         components = []
         _LOG.debug("target", macrotarget)
         for parts in macrotarget["parts"]:
@@ -651,6 +864,8 @@ class TargetService:
 
     @staticmethod
     def calculate_target_stack_from_macro_info_dict(macro_info, cutoff=0.01):
+        """Return a list of [target name, weight] pairs for the macro detail targets needed for the values in
+        macro_info. Stacks are cached per set of macro values, so the returned list is a copy."""
 
         profiler = PrimitiveProfiler("TargetService")
         profiler.enter("calculate_target_stack_from_macro_info_dict")
@@ -658,6 +873,24 @@ class TargetService:
         if macro_info is None:
             macro_info = TargetService.get_default_macro_info_dict()
 
+        key = TargetService._macro_info_key(macro_info, cutoff)
+        if key not in _MACRO_TARGET_STACKS:
+            if len(_MACRO_TARGET_STACKS) >= _MAX_MACRO_TARGET_STACKS:
+                # Dicts keep insertion order, so this drops the oldest stack
+                del _MACRO_TARGET_STACKS[next(iter(_MACRO_TARGET_STACKS))]
+            _MACRO_TARGET_STACKS[key] = TargetService._build_target_stack_from_macro_info_dict(macro_info, cutoff)
+
+        profiler.leave("calculate_target_stack_from_macro_info_dict")
+        return [list(target) for target in _MACRO_TARGET_STACKS[key]]
+
+    @staticmethod
+    def _macro_info_key(macro_info, cutoff):
+        values = [macro_info[macro_name] for macro_name in ["gender", "age", "muscle", "weight", "proportions", "height", "cupsize", "firmness"]]
+        return (tuple(values), tuple(sorted(macro_info["race"].items())), cutoff)
+
+    @staticmethod
+    def _build_target_stack_from_macro_info_dict(macro_info, cutoff):
+
         components = dict()
         for macro_name in ["gender", "age", "muscle", "weight", "proportions", "height", "cupsize", "firmness"]:
             value = macro_info[macro_name]
@@ -808,8 +1041,7 @@ class TargetService:
         _MACLOG.dump("Macro targets after recalculation", targets)
 
         _LOG.dump("targets", targets)
-        profiler.leave("calculate_target_stack_from_macro_info_dict")
-        return targets
+        return tuple((name, weight) for (name, weight) in targets)
 
     @staticmethod
     def get_current_macro_targets(basemesh, decode_names=True):
@@ -832,45 +1064,66 @@ class TargetService:
             TargetService.set_target_value(basemesh, tinfo['target'], 0.0, delete_target_on_zero=True)
         TargetService.bulk_load_targets(basemesh, target_stack, encode_target_names=False)
 
+    @staticmethod
+    def _get_resident_macro_target(macro_target_name):
+        if not macro_target_name in _RESIDENT_MACRO_TARGETS:
+            full_path = os.path.join(_TARGETS_DIR, macro_target_name + ".target.gz")
+            _RESIDENT_MACRO_TARGETS[macro_target_name] = TargetService.load_compiled_target(full_path)
+        return _RESIDENT_MACRO_TARGETS[macro_target_name]
+
+    @staticmethod
+    def calculate_macro_offsets(macro_info, vertex_count, cutoff=0.01):
+        """Calculate the combined offsets of all macro detail targets for the given macro info dict,
+        as a (vertex_count, 3) float32 array in unscaled target units. This is a weighted sum over the
+        targets returned by calculate_target_stack_from_macro_info_dict()."""
+        profiler = PrimitiveProfiler("TargetService")
+        profiler.enter("calculate_macro_offsets")
+
+        offsets = numpy.zeros((vertex_count, 3), dtype=numpy.float32)
+        for macro_target_name, weight in TargetService.calculate_target_stack_from_macro_info_dict(macro_info, cutoff):
+            compiled = TargetService._get_resident_macro_target(macro_target_name)
+            (indices, target_offsets) = TargetService._clip_offsets_to_vertex_count(compiled["index"], compiled["offset"], vertex_count)
+            numpy.add.at(offsets, indices, target_offsets * numpy.float32(weight))
+
+        profiler.leave("calculate_macro_offsets")
+        return offsets
+
     @staticmethod
     def reapply_macro_details(basemesh, remove_zero_weight_targets=True):
+        """Recalculate the macro detail shape key of the basemesh from its current macro properties. All
+        macro targets are mixed into a single shape key. Any separate macro detail shape keys (as created
+        by earlier versions of MPFB) are removed. The remove_zero_weight_targets argument is retained for
+        compatibility only."""
         profiler = PrimitiveProfiler("TargetService")
         profiler.enter("reapply_macro_details")
 
         macro_info = TargetService.get_macro_info_dict_from_basemesh(basemesh)
-        for target in TargetService.get_current_macro_targets(basemesh, decode_names=False):
-            _LOG.debug("Setting target to 0", target)
-            basemesh.data.shape_keys.key_blocks[target].value = 0.0
-        current_macro_targets = TargetService.get_current_macro_targets(basemesh, decode_names=True)
-        required_macro_targets = TargetService.calculate_target_stack_from_macro_info_dict(macro_info)
-        _LOG.dump("current macro targets", current_macro_targets)
-        _LOG.dump("required macro targets", required_macro_targets)
-        for target in required_macro_targets:
-            requested = str(TargetService.macrodetail_filename_to_shapekey_name(target[0], encode_name=False)).strip()
-            _LOG.debug("Checking if target exists", requested)
-            if requested not in current_macro_targets:
-                to_load = os.path.join(LocationService.get_mpfb_data("targets"), target[0] + ".target.gz")
-                name = TargetService.macrodetail_filename_to_shapekey_name(to_load, encode_name=True)
-                _LOG.debug("Need to add target: ", (name, to_load))
-                TargetService.load_target(basemesh, to_load, weight=0.0, name=name)
-        for target in required_macro_targets:
-            requested = str(TargetService.macrodetail_filename_to_shapekey_name(target[0], encode_name=True)).strip()
-            _LOG.debug("Will attempt to set target value for", (requested, target[1]))
-            TargetService.set_target_value(basemesh, requested, target[1])
-
-        if not basemesh.data.shape_keys:
-            _LOG.warn("Basemesh has no shape keys at this point. This is somewhat surprising.")
-
-        if remove_zero_weight_targets and basemesh.data.shape_keys:
-            _LOG.debug("Checking for targets to remove")
-            for shape_key in basemesh.data.shape_keys.key_blocks:
-                _LOG.debug("Checking shape key", (shape_key.name, shape_key.value))
-                if str(shape_key.name).startswith("$md") and shape_key.value < 0.0001:
-                    _LOG.debug("Will remove macrodetail target", TargetService.decode_shapekey_name(shape_key.name))
+        _MACLOG.dump("macro info", macro_info)
+
+        if basemesh.data.shape_keys:
+            for shape_key in list(basemesh.data.shape_keys.key_blocks):
+                if str(shape_key.name).startswith("$md") and shape_key.name != _COMBINED_MACRO_SHAPE_KEY:
+                    _LOG.debug("Removing separate macrodetail target", TargetService.decode_shapekey_name(shape_key.name))
                     basemesh.shape_key_remove(shape_key)
 
-        profiler.leave("reapply_macro_details")
+        if basemesh.data.shape_keys and _COMBINED_MACRO_SHAPE_KEY in basemesh.data.shape_keys.key_blocks:
+            shape_key = basemesh.data.shape_keys.key_blocks[_COMBINED_MACRO_SHAPE_KEY]
+        else:
+            shape_key = TargetService.create_shape_key(basemesh, _COMBINED_MACRO_SHAPE_KEY)
 
+        scale_factor = GeneralObjectProperties.get_value("scale_factor", entity_reference=basemesh)
+        if not scale_factor or scale_factor < 0.0001:
+            scale_factor = 1.0
+
+        basis = shape_key.relative_key
+        coords = numpy.empty(len(shape_key.data) * 3, dtype=numpy.float32)
+        basis.data.foreach_get('co', coords)
+        offsets = TargetService.calculate_macro_offsets(macro_info, len(shape_key.data))
+        coords = coords.reshape(-1, 3) + offsets * numpy.float32(scale_factor)
+        shape_key.data.foreach_set('co', coords.ravel())
+        shape_key.value = 1.0
+
+        profiler.leave("reapply_macro_details")
 
     @staticmethod
     def encode_shapekey_name(original_name):
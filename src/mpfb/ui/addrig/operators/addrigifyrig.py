@@ -25,6 +25,10 @@ class MPFB_OT_AddRigifyRigOperator(bpy.types.Operator):
 
     def execute(self, context):
 
+        # Slider changes may still be waiting to be applied to the mesh
+        from mpfb.ui.model import flush_pending_updates # pylint: disable=C0415
+        flush_pending_updates()
+
         if not SystemService.check_for_rigify():
             self.report({'ERROR'}, "The rigify addon isn't enabled. You need to enable it under preferences.")
             return {'FINISHED'}
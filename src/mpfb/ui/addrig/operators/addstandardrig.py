@@ -23,6 +23,10 @@ class MPFB_OT_AddStandardRigOperator(bpy.types.Operator):
         return False
 
     def execute(self, context):
+        # Slider changes may still be waiting to be applied to the mesh
+        from mpfb.ui.model import flush_pending_updates # pylint: disable=C0415
+        flush_pending_updates()
+
         scene = context.scene
 
         if not ObjectService.object_is_basemesh(context.active_object):
@@ -18,6 +18,28 @@ _NOASSETS = [
     "or install assets in MPFB user data"
     ]
 
+# Decoding thumbnails is slow, so only this many are loaded per redraw. The rest are loaded in
+# following redraws, which are requested until all drawn thumbnails are loaded.
+_THUMB_LOADS_PER_DRAW = 12
+_THUMB_REDRAW_INTERVAL = 0.05
+
+# Sections are drawn one page at a time, so that only the thumbnails on the current page are loaded. With
+# all sections open, the thumbnails drawn must still fit in AssetService's thumbnail cache, otherwise a draw
+# would evict thumbnails it needs itself.
+_ASSETS_PER_PAGE = 48
+
+# Current page per asset subdir, changed by the mpfb.asset_library_page operator
+ASSET_LIBRARY_PAGES = dict()
+
+
+def _redraw_asset_panels():
+    for window in bpy.context.window_manager.windows:
+        for area in window.screen.areas:
+            if area.type == "VIEW_3D":
+                area.tag_redraw()
+    # Returning None unregisters the timer
+    return None
+
 
 class _Abstract_Asset_Library_Panel(bpy.types.Panel):
     """Asset library panel"""
@@ -78,8 +100,18 @@ class _Abstract_Asset_Library_Panel(bpy.types.Panel):
             layout.label(text="Maybe change filter?")
             return
 
+        page_count = math.ceil(len(names) / _ASSETS_PER_PAGE)
+        page = min(ASSET_LIBRARY_PAGES.get(self.asset_subdir, 0), page_count - 1)
+        ASSET_LIBRARY_PAGES[self.asset_subdir] = page
+        if page_count > 1:
+            self._draw_page_buttons(layout, page, page_count)
+        names = names[page * _ASSETS_PER_PAGE:(page + 1) * _ASSETS_PER_PAGE]
+
         grid = layout.grid_flow(columns=cols, even_columns=True, even_rows=False)
 
+        thumb_loads_left = _THUMB_LOADS_PER_DRAW
+        thumbs_pending = False
+
         for name in names:
             box = grid.box()
             box.label(text=name)
@@ -93,8 +125,13 @@ class _Abstract_Asset_Library_Panel(bpy.types.Panel):
             _LOG.debug("Now checking asset", asset)
             _LOG.dump("Asset is equipped", is_equipped)
 
-            if "thumb" in asset and not asset["thumb"] is None:
-                box.template_icon(icon_value=asset["thumb"].icon_id, scale=6.0)
+            if asset["thumb_path"]:
+                if AssetService.is_asset_thumb_loaded(asset) or thumb_loads_left > 0:
+                    if not AssetService.is_asset_thumb_loaded(asset):
+                        thumb_loads_left = thumb_loads_left - 1
+                    box.template_icon(icon_value=AssetService.get_asset_thumb(asset).icon_id, scale=6.0)
+                else:
+                    thumbs_pending = True
             operator = None
             if self.asset_type == "mhclo":
                 if is_equipped:
@@ -124,6 +161,27 @@ class _Abstract_Asset_Library_Panel(bpy.types.Panel):
                 else:
                     _LOG.debug("Operator does not have a material type")
 
+        if page_count > 1:
+            self._draw_page_buttons(layout, page, page_count)
+
+        # Only ask for another redraw if this one loaded something, so that a thumbnail which cannot be
+        # kept loaded does not cause redraws forever
+        made_progress = thumb_loads_left < _THUMB_LOADS_PER_DRAW
+        if thumbs_pending and made_progress and not bpy.app.timers.is_registered(_redraw_asset_panels):
+            bpy.app.timers.register(_redraw_asset_panels, first_interval=_THUMB_REDRAW_INTERVAL)
+
+    def _draw_page_buttons(self, layout, page, page_count):
+        row = layout.row()
+        if page > 0:
+            operator = row.operator("mpfb.asset_library_page", text="", icon="TRIA_LEFT")
+            operator.asset_subdir = self.asset_subdir
+            operator.step = -1
+        row.label(text="Page " + str(page + 1) + " of " + str(page_count))
+        if page < page_count - 1:
+            operator = row.operator("mpfb.asset_library_page", text="", icon="TRIA_RIGHT")
+            operator.asset_subdir = self.asset_subdir
+            operator.step = 1
+
 
     def draw(self, context):
         _LOG.enter()
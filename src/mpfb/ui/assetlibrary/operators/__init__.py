@@ -10,6 +10,7 @@ from .loadlibraryproxy import MPFB_OT_Load_Library_Proxy_Operator
 from .loadlibraryskin import MPFB_OT_Load_Library_Skin_Operator
 from .loadlibrarymaterial import MPFB_OT_Load_Library_Material_Operator
 from .loadpack import MPFB_OT_Load_Pack_Operator
+from .assetlibrarypage import MPFB_OT_Asset_Library_Page_Operator
 from mpfb.ui.assetlibrary.operators.installtarget import MPFB_OT_Install_Target_Operator
 
 __all__ = [
@@ -19,5 +20,6 @@ __all__ = [
     "MPFB_OT_Load_Library_Skin_Operator",
     "MPFB_OT_Load_Library_Material_Operator",
     "MPFB_OT_Load_Pack_Operator",
+    "MPFB_OT_Asset_Library_Page_Operator",
     "MPFB_OT_Install_Target_Operator"
     ]
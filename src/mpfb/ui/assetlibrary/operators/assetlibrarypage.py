@@ -0,0 +1,26 @@
+"""Operator for paging through an asset library section."""
+
+import bpy
+from bpy.props import StringProperty, IntProperty
+from mpfb.services.logservice import LogService
+from mpfb import ClassManager
+
+_LOG = LogService.get_logger("assetlibrary.assetlibrarypage")
+
+class MPFB_OT_Asset_Library_Page_Operator(bpy.types.Operator):
+    """Show another page of assets in this section"""
+    bl_idname = "mpfb.asset_library_page"
+    bl_label = "Page"
+    bl_options = {'INTERNAL'}
+
+    asset_subdir: StringProperty(name="asset_subdir", description="Asset section to page through", default="")
+    step: IntProperty(name="step", description="Number of pages to move forward (or backward if negative)", default=1)
+
+    def execute(self, context):
+        from mpfb.ui.assetlibrary.assetlibrarypanel import ASSET_LIBRARY_PAGES # pylint: disable=C0415
+        page = max(0, ASSET_LIBRARY_PAGES.get(self.asset_subdir, 0) + self.step)
+        _LOG.debug("New page", (self.asset_subdir, page))
+        ASSET_LIBRARY_PAGES[self.asset_subdir] = page
+        return {'FINISHED'}
+
+ClassManager.add_class(MPFB_OT_Asset_Library_Page_Operator)
@@ -21,6 +21,10 @@ class MPFB_OT_Load_Library_Clothes_Operator(bpy.types.Operator):
 
     def execute(self, context):
 
+        # Slider changes may still be waiting to be applied to the mesh
+        from mpfb.ui.model import flush_pending_updates # pylint: disable=C0415
+        flush_pending_updates()
+
         _LOG.debug("filepath", self.filepath)
         _LOG.debug("object_type", self.object_type)
         _LOG.debug("material_type", self.material_type)
@@ -33,6 +33,10 @@ class MPFB_OT_Bake_Shapekeys_Operator(bpy.types.Operator):
     def execute(self, context):
         _LOG.enter()
 
+        # Slider changes may still be waiting to be applied to the mesh
+        from mpfb.ui.model import flush_pending_updates # pylint: disable=C0415
+        flush_pending_updates()
+
         if context.object is None:
             self.report({'ERROR'}, "Must have an active object")
             return {'FINISHED'}
@@ -4,6 +4,7 @@ from mpfb._classmanager import ClassManager
 from mpfb.services.logservice import LogService
 from mpfb.services.uiservice import UiService
 from mpfb.services.sceneconfigset import SceneConfigSet
+from mpfb.entities.primitiveprofiler import is_profiling_enabled
 import bpy, os
 
 _LOG = LogService.get_logger("ui.developerpanel")
@@ -98,6 +99,14 @@ class MPFB_PT_Developer_Panel(bpy.types.Panel):
         box = self._create_box(layout, "Load/Save targets")
         box.operator("mpfb.load_target")
         box.operator("mpfb.save_target")
+        box.operator("mpfb.compile_targets")
+        box.operator("mpfb.clear_target_cache")
+
+    def _profiling(self, scene, layout):
+        box = self._create_box(layout, "Profiling")
+        box.label(text="Recording" if is_profiling_enabled() else "Not recording")
+        box.operator("mpfb.toggle_profiling")
+        box.operator("mpfb.save_profile")
 
     def _tests(self, scene, layout):
         box = self._create_box(layout, "Unit tests")
@@ -114,6 +123,7 @@ class MPFB_PT_Developer_Panel(bpy.types.Panel):
         self._rig(scene, layout)
         self._weights(scene, layout)
         self._targets(scene, layout)
+        self._profiling(scene, layout)
         self._tests(scene, layout)
 
 
@@ -16,6 +16,8 @@ from .saveweights import MPFB_OT_Save_Weights_Operator
 from .loadweights import MPFB_OT_Load_Weights_Operator
 from .savetarget import MPFB_OT_Save_Target_Operator
 from .loadtarget import MPFB_OT_Load_Target_Operator
+from .compiletargets import MPFB_OT_Compile_Targets_Operator
+from .cleartargetcache import MPFB_OT_Clear_Target_Cache_Operator
 from .create_groups import MPFB_OT_Create_Groups_Operator
 from .destroygroups import MPFB_OT_Destroy_Groups_Operator
 from .unittests import MPFB_OT_Unit_Tests_Operator
@@ -23,6 +25,8 @@ from .writecomposite import MPFB_OT_Write_Composite_Operator
 from .writematerial import MPFB_OT_Write_Material_Operator
 from .replacewithskin import MPFB_OT_Replace_With_Skin_Operator
 from .rewritenodetypes import MPFB_OT_Rewrite_Node_Types_Operator
+from .toggleprofiling import MPFB_OT_Toggle_Profiling_Operator
+from .saveprofile import MPFB_OT_Save_Profile_Operator
 
 __all__ = [
     "MPFB_OT_List_Log_Levels_Operator",
@@ -36,11 +40,15 @@ __all__ = [
     "MPFB_OT_Load_Weights_Operator",
     "MPFB_OT_Save_Target_Operator",
     "MPFB_OT_Load_Target_Operator",
+    "MPFB_OT_Compile_Targets_Operator",
+    "MPFB_OT_Clear_Target_Cache_Operator",
     "MPFB_OT_Create_Groups_Operator",
     "MPFB_OT_Destroy_Groups_Operator",
     "MPFB_OT_Unit_Tests_Operator",
     "MPFB_OT_Write_Composite_Operator",
     "MPFB_OT_Write_Material_Operator",
     "MPFB_OT_Replace_With_Skin_Operator",
-    "MPFB_OT_Rewrite_Node_Types_Operator"
+    "MPFB_OT_Rewrite_Node_Types_Operator",
+    "MPFB_OT_Toggle_Profiling_Operator",
+    "MPFB_OT_Save_Profile_Operator"
     ]
@@ -0,0 +1,24 @@
+"""Functionality for clearing the binary target cache"""
+
+from mpfb.services.logservice import LogService
+from mpfb.services.targetservice import TargetService
+from mpfb._classmanager import ClassManager
+import bpy
+
+_LOG = LogService.get_logger("developer.operators.cleartargetcache")
+
+
+class MPFB_OT_Clear_Target_Cache_Operator(bpy.types.Operator):
+    """Remove all compiled targets from the binary target cache"""
+    bl_idname = "mpfb.clear_target_cache"
+    bl_label = "Clear target cache"
+    bl_options = {'REGISTER'}
+
+    def execute(self, context):
+        _LOG.enter()
+        TargetService.clear_compiled_targets()
+        self.report({"INFO"}, "The target cache was cleared")
+        return {'FINISHED'}
+
+
+ClassManager.add_class(MPFB_OT_Clear_Target_Cache_Operator)
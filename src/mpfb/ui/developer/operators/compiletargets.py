@@ -0,0 +1,24 @@
+"""Functionality for compiling all targets into the binary target cache"""
+
+from mpfb.services.logservice import LogService
+from mpfb.services.targetservice import TargetService
+from mpfb._classmanager import ClassManager
+import bpy
+
+_LOG = LogService.get_logger("developer.operators.compiletargets")
+
+
+class MPFB_OT_Compile_Targets_Operator(bpy.types.Operator):
+    """Compile all system and user targets into the binary target cache. This is otherwise done lazily the first time each target is loaded"""
+    bl_idname = "mpfb.compile_targets"
+    bl_label = "Compile all targets"
+    bl_options = {'REGISTER'}
+
+    def execute(self, context):
+        _LOG.enter()
+        compiled_count = TargetService.compile_all_targets()
+        self.report({"INFO"}, "Compiled " + str(compiled_count) + " targets")
+        return {'FINISHED'}
+
+
+ClassManager.add_class(MPFB_OT_Compile_Targets_Operator)
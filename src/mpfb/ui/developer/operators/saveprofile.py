@@ -0,0 +1,48 @@
+"""Functionality for saving a recorded profile"""
+
+from mpfb.services.logservice import LogService
+from mpfb.entities.primitiveprofiler import get_trace_events, export_chrome_trace, export_speedscope
+from mpfb._classmanager import ClassManager
+from bpy_extras.io_utils import ExportHelper
+from bpy.props import EnumProperty
+import bpy
+
+_LOG = LogService.get_logger("developer.operators.saveprofile")
+
+
+class MPFB_OT_Save_Profile_Operator(bpy.types.Operator, ExportHelper):
+    """Save the recorded profile as a Chrome trace or speedscope file"""
+    bl_idname = "mpfb.save_profile"
+    bl_label = "Save profile"
+    bl_options = {'REGISTER'}
+
+    filename_ext = '.json'
+
+    file_format: EnumProperty(
+        name="Format",
+        description="Chrome traces can be opened in chrome://tracing or ui.perfetto.dev, speedscope files in speedscope.app",
+        items=[
+            ("CHROME", "Chrome trace", "Chrome trace event format", 0),
+            ("SPEEDSCOPE", "Speedscope", "Speedscope file format", 1)
+            ],
+        default="CHROME")
+
+    def execute(self, context):
+        _LOG.enter()
+
+        if not get_trace_events():
+            self.report({"ERROR"}, "Nothing has been recorded. Start profiling first.")
+            return {'CANCELLED'}
+
+        output_path = bpy.path.abspath(self.filepath)
+
+        if self.file_format == "SPEEDSCOPE":
+            export_speedscope(output_path)
+        else:
+            export_chrome_trace(output_path)
+
+        self.report({"INFO"}, "The profile was saved as " + output_path)
+        return {'FINISHED'}
+
+
+ClassManager.add_class(MPFB_OT_Save_Profile_Operator)
@@ -0,0 +1,28 @@
+"""Functionality for starting and stopping profiling"""
+
+from mpfb.services.logservice import LogService
+from mpfb.entities.primitiveprofiler import is_profiling_enabled, start_profiling, stop_profiling
+from mpfb._classmanager import ClassManager
+import bpy
+
+_LOG = LogService.get_logger("developer.operators.toggleprofiling")
+
+
+class MPFB_OT_Toggle_Profiling_Operator(bpy.types.Operator):
+    """Start recording a new profile, or stop recording if a profile is being recorded"""
+    bl_idname = "mpfb.toggle_profiling"
+    bl_label = "Start/stop profiling"
+    bl_options = {'REGISTER'}
+
+    def execute(self, context):
+        _LOG.enter()
+        if is_profiling_enabled():
+            stop_profiling()
+            self.report({"INFO"}, "Profiling was stopped")
+        else:
+            start_profiling()
+            self.report({"INFO"}, "Profiling was started")
+        return {'FINISHED'}
+
+
+ClassManager.add_class(MPFB_OT_Toggle_Profiling_Operator)
@@ -116,6 +116,10 @@ class MPFB_OT_ImportHumanOperator(MpfbOperator):
             proxy_info["import_this_proxy"] = import_this_proxy
             proxy_info["basic_proxy_type"] = basic_proxy_type
 
+        # Fetch the mesh data of all proxies at once, so that the calls can be pipelined
+        uuids = [proxy_info["uuid"] for proxy_info in temp["proxies_info"] if proxy_info["import_this_proxy"]]
+        temp["proxies_data"] = SocketService.get_proxies_mesh_data(uuids, include_weights=bool(derived["import_weights"]))
+
     def _assign_material(self, importer, blender_object, proxy_info=None):
         blender = importer["blender_entities"]
         ui = importer["settings_from_ui"]
@@ -197,7 +201,7 @@ class MPFB_OT_ImportHumanOperator(MpfbOperator):
             _LOG.debug("Importing proxy with type:", proxy_info["type"])
             _LOG.dump("proxy_info:", proxy_info)
             uuid = proxy_info["uuid"]
-            proxy = SocketProxyObject(proxy_info, ui, derived["import_weights"])
+            proxy = SocketProxyObject(proxy_info, ui, derived["import_weights"], temp["proxies_data"][uuid])
             temp["proxies"][uuid] = proxy
             proxy_lowest = proxy.get_lowest_point()
             if proxy_lowest < derived["lowest_point"]:
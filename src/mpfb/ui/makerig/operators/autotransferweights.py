@@ -77,9 +77,15 @@ class MPFB_OT_Auto_Transfer_Weights_Operator(MpfbOperator):
 
         done_bones = []
 
+        # Only the destination is written to, so the source weights can be extracted once for all bones
+        src_weights = MeshService.get_vertex_group_weights(src_bm, [src_bone for (src_bone, _) in bones_to_transfer])
+
         for src_bone, dst_bone in bones_to_transfer:
             _LOG.debug("Transferring weights", (src_bone, dst_bone))
-            weights = MeshService.find_vertices_in_vertex_group(src_bm, src_bone)
+            weights = []
+            if src_bone in src_weights:
+                (vertex_indices, vertex_weights) = src_weights[src_bone]
+                weights = [list(pair) for pair in zip(vertex_indices.tolist(), vertex_weights.tolist())]
             _LOG.dump("Weights", weights)
             MeshService.create_vertex_group(dst_bm, dst_bone, weights, True)
             done_bones.append(dst_bone)
@@ -9,8 +9,13 @@ _LOG = _LogService.get_logger("model.init")
 _LOG.trace("initializing the model module")
 
 from .modelpanel import MPFB_PT_Model_Panel
+from ._updatescheduler import flush_pending_updates
+from ._modelsubpanels import ensure_extra_sections_loaded, cancel_pending_extra_sections_load
 from mpfb.ui.model.operators import *
 
 __all__ = [
-    "MPFB_PT_Model_Panel"
+    "MPFB_PT_Model_Panel",
+    "flush_pending_updates",
+    "ensure_extra_sections_loaded",
+    "cancel_pending_extra_sections_load"
     ]
@@ -1,6 +1,6 @@
 """Macro subpanel for modeling humans"""
 
-import bpy, os, json
+import bpy
 from bpy.props import FloatProperty
 from mpfb import ClassManager
 from mpfb.services.logservice import LogService
@@ -10,6 +10,7 @@ from mpfb.services.humanservice import HumanService
 from mpfb.services.targetservice import TargetService
 from mpfb.services.uiservice import UiService
 from mpfb.entities.objectproperties import HumanObjectProperties
+from ._updatescheduler import schedule_update
 
 _LOG = LogService.get_logger("model.macrosubpanel")
 
@@ -74,8 +75,6 @@ class MPFB_PT_Macro_Sub_Panel(bpy.types.Panel):
 
 ClassManager.add_class(MPFB_PT_Macro_Sub_Panel)
 
-_PROPS_DIR = os.path.join(LocationService.get_mpfb_root("entities"), "objectproperties", "humanproperties")
-
 def _general_set_target_value(name, value):
     _LOG.trace("_general_set_target_value", (name, value))
     basemesh = ObjectService.find_object_of_type_amongst_nearest_relatives(bpy.context.active_object, "Basemesh")
@@ -83,9 +82,14 @@ def _general_set_target_value(name, value):
     from mpfb.ui.model.modelpanel import MODEL_PROPERTIES
     prune = MODEL_PROPERTIES.get_value("prune", entity_reference=bpy.context.scene)
     ObjectService.activate_blender_object(basemesh)
-    TargetService.reapply_macro_details(basemesh, remove_zero_weight_targets=prune)
+
+    # The shape is updated once per timer tick while dragging, the refit only when the slider has settled
+    def _reapply():
+        TargetService.reapply_macro_details(basemesh, remove_zero_weight_targets=prune)
+
+    schedule_update(("macro", basemesh.name), preview=_reapply)
     if MODEL_PROPERTIES.get_value("refit", entity_reference=bpy.context.scene):
-        HumanService.refit(basemesh)
+        schedule_update(("refit", basemesh.name), settle=lambda: HumanService.refit(basemesh))
 
 def _general_get_target_value(name):
     basemesh = ObjectService.find_object_of_type_amongst_nearest_relatives(bpy.context.active_object, "Basemesh")
@@ -93,28 +97,29 @@ def _general_get_target_value(name):
     _LOG.trace("_general_get_target_value", (name, value))
     return value
 
-for _main in _MACROTARGETS.keys():
-    for _target in _MACROTARGETS[_main]:
-        _getstr = "def _get_macro_target(self):\n"
-        _getstr = _getstr + "    return _general_get_target_value(\"" + _target + "\")\n"
-        exec(_getstr)
+def _macro_target_getter(target):
+    def _get_macro_target(self):
+        return _general_get_target_value(target)
+    return _get_macro_target
 
-        _setstr = "def _set_macro_target(self, value):\n"
-        _setstr = _setstr + "    _general_set_target_value(\"" + _target + "\", value)\n"
-        exec(_setstr)
+def _macro_target_setter(target):
+    def _set_macro_target(self, value):
+        _general_set_target_value(target, value)
+    return _set_macro_target
 
+for _main in _MACROTARGETS.keys():
+    for _target in _MACROTARGETS[_main]:
         _label = _target
         _description = _target
         _default = 0.5
 
-        _propdef = os.path.join(_PROPS_DIR, _target + ".json")
-
-        if os.path.exists(_propdef):
-            with open(_propdef, "r") as json_file:
-                _prop = json.load(json_file)
-                _label = _prop["label"]
-                _description = _prop["description"]
-                _default = _prop["default"]
+        # The definitions are the same as those already loaded for the human object properties,
+        # so there is no need to parse the json files again
+        _prop = HumanObjectProperties.get_definition(_target)
+        if _prop:
+            _label = _prop["label"]
+            _description = _prop["description"]
+            _default = _prop["default"]
 
-        prop = FloatProperty(name=_label, get=_get_macro_target, set=_set_macro_target, description=_description, max=1.0, min=0.0, default=_default)
+        prop = FloatProperty(name=_label, get=_macro_target_getter(_target), set=_macro_target_setter(_target), description=_description, max=1.0, min=0.0, default=_default)
         setattr(bpy.types.Scene, _INTERNAL_PREFIX + _target, prop)
@@ -12,11 +12,26 @@ MODELING_ICONS = bpy.utils.previews.new()
 _TARGETS_DIR = LocationService.get_mpfb_data("targets")
 _IMAGES_DIR = os.path.join(_TARGETS_DIR, "_images")
 
-for image in os.listdir(_IMAGES_DIR):
-    if ".png" in image:
-        name = re.sub(r"\.png$", "", image)
-        name = re.sub("^r-", "", name)
-        name = re.sub("^l-", "", name)
-        image_path = os.path.join(_IMAGES_DIR, image)
+_SYSTEM_ICONS_LOADED = False
+
+
+def load_modeling_icon(name, image_path):
+    """Add an icon to MODELING_ICONS, unless there already is one with the same name."""
+    if name not in MODELING_ICONS:
         _LOG.debug("Will try to load icon", (name, image_path))
         MODELING_ICONS.load(name, image_path, 'IMAGE')
+
+
+def ensure_modeling_icons_loaded():
+    """Populate MODELING_ICONS with the icons for system targets. This is done on first use rather than on import,
+    so that registering MPFB does not have to list the images dir."""
+    global _SYSTEM_ICONS_LOADED # pylint: disable=W0603
+    if _SYSTEM_ICONS_LOADED:
+        return
+    _SYSTEM_ICONS_LOADED = True
+    for image in os.listdir(_IMAGES_DIR):
+        if ".png" in image:
+            name = re.sub(r"\.png$", "", image)
+            name = re.sub("^r-", "", name)
+            name = re.sub("^l-", "", name)
+            load_modeling_icon(name, os.path.join(_IMAGES_DIR, image))
@@ -11,7 +11,8 @@ from mpfb.services.assetservice import AssetService
 from mpfb.services.humanservice import HumanService
 from mpfb.services.uiservice import UiService
 
-from ._modelingicons import MODELING_ICONS
+from ._modelingicons import MODELING_ICONS, load_modeling_icon, ensure_modeling_icons_loaded
+from ._updatescheduler import schedule_update
 
 _LOG = LogService.get_logger("model.modelsubpanel")
 
@@ -34,7 +35,7 @@ class _Abstract_Model_Panel(bpy.types.Panel):
     section_name = "-"
     target_dir = "-"
 
-    def _draw_category(self, scene, layout, category, basemesh):
+    def _draw_category(self, scene, layout, category, basemesh, target_values):
         box = layout.box()
         box.label(text=category["label"])
 
@@ -42,6 +43,7 @@ class _Abstract_Model_Panel(bpy.types.Panel):
         hideimg = MODEL_PROPERTIES.get_value("hideimg", entity_reference=bpy.context.scene)
 
         if not hideimg:
+            ensure_modeling_icons_loaded()
             if category["name"] in MODELING_ICONS:
                 image = MODELING_ICONS[category["name"]]
                 box.template_icon(icon_value=image.icon_id, scale=6.0)
@@ -51,7 +53,7 @@ class _Abstract_Model_Panel(bpy.types.Panel):
         is_modified = False
         for target in category["targets"]:
             name = str(os.path.basename(target)).replace(".target", "")
-            value = TargetService.get_target_value(basemesh, name)
+            value = target_values.get(name, 0.0)
             if abs(value) > 0.001:
                 is_modified = True
                 _LOG.debug("Target value modified", (name, value))
@@ -83,82 +85,87 @@ class _Abstract_Model_Panel(bpy.types.Panel):
 
         _LOG.dump("target_dir", self.target_dir)
 
+        target_values = TargetService.get_target_values(basemesh)
+
         for category_name in _SORTED_CATEGORIES[self.section_name]:
             if not str(filter) or str(filter).lower() in str(category_name).lower():
                 category = _CATEGORIES_BY_LABEL[self.section_name][category_name]
-                self._draw_category(scene, grid, category, basemesh)
+                self._draw_category(scene, grid, category, basemesh, target_values)
 
 _sections = dict()
 with open(_TARGETS_JSON, "r") as _json_file:
     _sections = json.load(_json_file)
 
-custom_asset_roots = AssetService.get_asset_roots("custom")
-custom_asset_roots.extend(AssetService.get_asset_roots("targets/custom"))
-
-custom_targets = AssetService.find_asset_files_matching_pattern(custom_asset_roots, "*.target")
-custom_targets.extend(AssetService.find_asset_files_matching_pattern(custom_asset_roots, "*.target.gz"))
-
-if len(custom_targets) > 0:
-    _sections["custom"] = dict()
-    _sections["custom"]["include_per_default"] = True
-    _sections["custom"]["label"] = "Custom targets"
-    _sections["custom"]["categories"] = []
-    for target in custom_targets:
-        _sections["custom"]["categories"].append({
-                "has_left_and_right": False,
-                "label": os.path.basename(target).replace(".target","").replace("_", " "),
-                "name": os.path.basename(target).replace(".target",""),
-                "targets": [target],
-                "full_path": target
-                })
-
-user_targets_dir = LocationService.get_user_data("targets")
-_LOG.debug("User targets dir:", user_targets_dir)
-if os.path.exists(user_targets_dir):
-    user_targets = AssetService.find_asset_files_matching_pattern([user_targets_dir], "*.target")
-    for target in user_targets:
-        dirn = str(os.path.basename(os.path.dirname(target)))
-        if dirn not in _sections:
-            _sections[dirn] = dict()
-            _sections[dirn]["include_per_default"] = True
-            _sections[dirn]["label"] = dirn
-            _sections[dirn]["categories"] = []
-        section = _sections[dirn]
-        _LOG.debug("section:", section)
-        cat = {
-                "has_left_and_right": False,
-                "label": os.path.basename(target).replace(".target","").replace("_", " "),
-                "name": os.path.basename(target).replace(".target",""),
-                "targets": [target],
-                "full_path": target
-                }
-        _LOG.debug("cat", cat)
-        section["categories"].append(cat)
-        bn = str(os.path.basename(target)).replace(".target","")
-        img = None
-        png = os.path.join(os.path.dirname(target),bn + ".png")
-        if os.path.exists(png):
-            img = png
-        thumb = os.path.join(os.path.dirname(target),bn + ".thumb")
-        if os.path.exists(thumb):
-            img = thumb
-        if img:
-            MODELING_ICONS.load(bn, img, 'IMAGE')
-        else:
-            _LOG.warn("No image for ", str(target))
-else:
-    _LOG.debug("User targets dir does not exist", user_targets_dir)
-
 _SORTED_CATEGORIES = {}
 _CATEGORIES_BY_LABEL = {}
 
-for key in _sections.keys():
-    _SORTED_CATEGORIES[str(key)] = []
-    _CATEGORIES_BY_LABEL[str(key)] = {}
-    for cat in _sections[str(key)]["categories"]:
-        _SORTED_CATEGORIES[str(key)].append(cat["label"])
-        _CATEGORIES_BY_LABEL[str(key)][cat["label"]] = cat
-    _SORTED_CATEGORIES[str(key)].sort()
+# Sub panel class per section name
+_SECTION_PANELS = {}
+
+_EXTRA_SECTIONS_LOADED = False
+
+def _target_category(target):
+    return {
+        "has_left_and_right": False,
+        "label": os.path.basename(target).replace(".target","").replace("_", " "),
+        "name": os.path.basename(target).replace(".target",""),
+        "targets": [target],
+        "full_path": target
+        }
+
+def _find_extra_sections():
+    """Scan the custom asset roots and the user targets dir for targets which are not part of target.json.
+    Each sub directory of the user targets dir becomes a section of its own."""
+    extra_sections = dict()
+
+    custom_asset_roots = AssetService.get_asset_roots("custom")
+    custom_asset_roots.extend(AssetService.get_asset_roots("targets/custom"))
+
+    custom_targets = AssetService.find_target_files(custom_asset_roots)
+
+    if len(custom_targets) > 0:
+        extra_sections["custom"] = dict()
+        extra_sections["custom"]["include_per_default"] = True
+        extra_sections["custom"]["label"] = "Custom targets"
+        extra_sections["custom"]["categories"] = []
+        for target in custom_targets:
+            extra_sections["custom"]["categories"].append(_target_category(target))
+
+    user_targets_dir = LocationService.get_user_data("targets")
+    _LOG.debug("User targets dir:", user_targets_dir)
+    if os.path.exists(user_targets_dir):
+        user_targets = AssetService.find_target_files([user_targets_dir], (".target",))
+        if user_targets:
+            # System icons take precedence over user icons with the same name
+            ensure_modeling_icons_loaded()
+        for target in user_targets:
+            dirn = str(os.path.basename(os.path.dirname(target)))
+            if dirn not in extra_sections:
+                extra_sections[dirn] = dict()
+                extra_sections[dirn]["include_per_default"] = True
+                extra_sections[dirn]["label"] = dirn
+                extra_sections[dirn]["categories"] = []
+            section = extra_sections[dirn]
+            _LOG.debug("section:", section)
+            cat = _target_category(target)
+            _LOG.debug("cat", cat)
+            section["categories"].append(cat)
+            bn = str(os.path.basename(target)).replace(".target","")
+            img = None
+            png = os.path.join(os.path.dirname(target),bn + ".png")
+            if os.path.exists(png):
+                img = png
+            thumb = os.path.join(os.path.dirname(target),bn + ".thumb")
+            if os.path.exists(thumb):
+                img = thumb
+            if img:
+                load_modeling_icon(bn, img)
+            else:
+                _LOG.warn("No image for ", str(target))
+    else:
+        _LOG.debug("User targets dir does not exist", user_targets_dir)
+
+    return extra_sections
 
 def _set_simple_modifier_value(scene, blender_object, section, category, value, side="unsided", load_target_if_needed=True):
     """This modifier is not a combination of opposing targets ("decr-incr", "in-out"...)"""
@@ -258,7 +265,8 @@ def _set_modifier_value(scene, blender_object, section, category, value, side="u
         _set_simple_modifier_value(scene, blender_object, section, category, value, side)
     from mpfb.ui.model.modelpanel import MODEL_PROPERTIES
     if MODEL_PROPERTIES.get_value("refit", entity_reference=bpy.context.scene):
-        HumanService.refit(blender_object)
+        # Setting the target value is cheap and shows the new shape, the refit waits for the slider to settle
+        schedule_update(("refit", blender_object.name), settle=lambda: HumanService.refit(blender_object))
 
 def _get_modifier_value(scene, blender_object, section, category, side="unsided"):
     _LOG.dump("enter _get_modifier_value", (blender_object, category, side))
@@ -266,100 +274,64 @@ def _get_modifier_value(scene, blender_object, section, category, side="unsided"
         return _get_opposed_modifier_value(scene, blender_object, section, category, side)
     return _get_simple_modifier_value(scene, blender_object, section, category, side)
 
-_section_names = list(_sections.keys())
-_section_names.sort()
-
-for name in _section_names:
-    _section = _sections[name]
-    _i = 0
-    for _category in _section["categories"]:
-        _LOG.debug("_category", _category)
-
-        _unsided_name = UiService.as_valid_identifier(name + "." + _category["name"])
-        _left_name = UiService.as_valid_identifier(name + ".l-" + _category["name"])
-        _right_name = UiService.as_valid_identifier(name + ".r-" + _category["name"])
-
-        _LOG.debug("names", (_unsided_name, _left_name, _right_name))
-
-        # This is so ugly it makes me want to cry, but there doesn't seem to be any clean way to get both
-        # dynamically created properties AND getter/setter methods
-        #
-        # Anyway, we can keep creating functions with the same name here. When we feed the property with the
-        # reference to a function, what it gets is a function pointer. This is independent of name.
-
-        _function_str_general = ""
-        _function_str_general = _function_str_general + "    obj = ObjectService.find_object_of_type_amongst_nearest_relatives(bpy.context.active_object, \"Basemesh\")\n"
-        _function_str_general = _function_str_general + "    secname = \"" + name + "\"\n"
-        _function_str_general = _function_str_general + "    cat = _sections[secname][\"categories\"][" + str(_i) + "]\n"
-
-        _function_str = "def _get_wrapper_unsided(self):\n"
-        _function_str = _function_str + _function_str_general
-        _function_str = _function_str + "    modif = \"" + _unsided_name + "\"\n"
-        _function_str = _function_str + "    _LOG.trace(\"_get_wrapper_unsided for\", modif)\n"
-        _function_str = _function_str + "    return _get_modifier_value(self, obj, secname, cat)\n"
-        exec(_function_str)
-
-        _function_str = "def _set_wrapper_unsided(self, value):\n"
-        _function_str = _function_str + _function_str_general
-        _function_str = _function_str + "    modif = \"" + _unsided_name + "\"\n"
-        _function_str = _function_str + "    _LOG.trace(\"_set_wrapper_unsided for\", modif)\n"
-        _function_str = _function_str + "    _set_modifier_value(self, obj, secname, cat, value)\n"
-        exec(_function_str)
-
-        _function_str = "def _get_wrapper_left(self):\n"
-        _function_str = _function_str + _function_str_general
-        _function_str = _function_str + "    modif = \"" + _left_name + "\"\n"
-        _function_str = _function_str + "    side = \"left\"\n"
-        _function_str = _function_str + "    _LOG.trace(\"_get_wrapper_left for\", modif)\n"
-        _function_str = _function_str + "    return _get_modifier_value(self, obj, secname, cat, side)\n"
-        exec(_function_str)
-
-        _function_str = "def _set_wrapper_left(self, value):\n"
-        _function_str = _function_str + _function_str_general
-        _function_str = _function_str + "    modif = \"" + _left_name + "\"\n"
-        _function_str = _function_str + "    side = \"left\"\n"
-        _function_str = _function_str + "    _LOG.trace(\"_set_wrapper_left for\", modif)\n"
-        _function_str = _function_str + "    _set_modifier_value(self, obj, secname, cat, value, side)\n"
-        exec(_function_str)
-
-        _function_str = "def _get_wrapper_right(self):\n"
-        _function_str = _function_str + _function_str_general
-        _function_str = _function_str + "    modif = \"" + _right_name + "\"\n"
-        _function_str = _function_str + "    side = \"right\"\n"
-        _function_str = _function_str + "    _LOG.trace(\"_get_wrapper_right for\", modif)\n"
-        _function_str = _function_str + "    return _get_modifier_value(self, obj, secname, cat, side)\n"
-        exec(_function_str)
-
-        _function_str = "def _set_wrapper_right(self, value):\n"
-        _function_str = _function_str + _function_str_general
-        _function_str = _function_str + "    modif = \"" + _right_name + "\"\n"
-        _function_str = _function_str + "    side = \"right\"\n"
-        _function_str = _function_str + "    _LOG.trace(\"_set_wrapper_right for\", modif)\n"
-        _function_str = _function_str + "    _set_modifier_value(self, obj, secname, cat, value, side)\n"
-        exec(_function_str)
-
-        _min_val = 0.0
-        if "opposites" in _category:
-            _min_val = -1.0
-
-        if _category["has_left_and_right"]:
-            prop = FloatProperty(name=_left_name, get=_get_wrapper_left, set=_set_wrapper_left, description="Set target value", max=1.0, min=_min_val)
-            setattr(bpy.types.Scene, _left_name, prop)
+def _modifier_getter(name, category, side="unsided"):
+    def _get_wrapper(self):
+        _LOG.trace("_get_wrapper for", (name, side))
+        obj = ObjectService.find_object_of_type_amongst_nearest_relatives(bpy.context.active_object, "Basemesh")
+        return _get_modifier_value(self, obj, name, category, side)
+    return _get_wrapper
+
+def _modifier_setter(name, category, side="unsided"):
+    def _set_wrapper(self, value):
+        _LOG.trace("_set_wrapper for", (name, side))
+        obj = ObjectService.find_object_of_type_amongst_nearest_relatives(bpy.context.active_object, "Basemesh")
+        _set_modifier_value(self, obj, name, category, value, side)
+    return _set_wrapper
+
+def _add_categories(name, categories):
+    """Create the scene properties for the categories and list them under the section with the given name."""
+    sorted_categories = _SORTED_CATEGORIES.setdefault(name, [])
+    categories_by_label = _CATEGORIES_BY_LABEL.setdefault(name, {})
+    for cat in categories:
+        sorted_categories.append(cat["label"])
+        categories_by_label[cat["label"]] = cat
+    sorted_categories.sort()
+
+    for category in categories:
+        _LOG.debug("category", category)
+
+        unsided_name = UiService.as_valid_identifier(name + "." + category["name"])
+        left_name = UiService.as_valid_identifier(name + ".l-" + category["name"])
+        right_name = UiService.as_valid_identifier(name + ".r-" + category["name"])
+
+        _LOG.debug("names", (unsided_name, left_name, right_name))
+
+        min_val = 0.0
+        if "opposites" in category:
+            min_val = -1.0
+
+        if category["has_left_and_right"]:
+            prop = FloatProperty(name=left_name, get=_modifier_getter(name, category, "left"), set=_modifier_setter(name, category, "left"), description="Set target value", max=1.0, min=min_val)
+            setattr(bpy.types.Scene, left_name, prop)
             _LOG.debug("property", prop)
-            prop = FloatProperty(name=_right_name, get=_get_wrapper_right, set=_set_wrapper_right, description="Set target value", max=1.0, min=_min_val)
-            setattr(bpy.types.Scene, _right_name, prop)
+            prop = FloatProperty(name=right_name, get=_modifier_getter(name, category, "right"), set=_modifier_setter(name, category, "right"), description="Set target value", max=1.0, min=min_val)
+            setattr(bpy.types.Scene, right_name, prop)
             _LOG.debug("property", prop)
         else:
-            prop = FloatProperty(name=_unsided_name, get=_get_wrapper_unsided, set=_set_wrapper_unsided, description="Set target value", max=1.0, min=_min_val)
-            setattr(bpy.types.Scene, _unsided_name, prop)
+            prop = FloatProperty(name=unsided_name, get=_modifier_getter(name, category), set=_modifier_setter(name, category), description="Set target value", max=1.0, min=min_val)
+            setattr(bpy.types.Scene, unsided_name, prop)
             _LOG.debug("property", prop)
 
-        _i = _i + 1
+def _add_section(name, section):
+    """Create the scene properties for all categories in the section, and return a new sub panel class for it.
+    The class is not registered here."""
+    _sections[name] = section
+    _add_categories(name, section["categories"])
 
     definition = {
-        "bl_label": _section["label"],
+        "bl_label": section["label"],
         "target_dir": os.path.join(_TARGETS_DIR, name),
-        "section": _section,
+        "section": section,
         "section_name": name
         }
 
@@ -367,6 +339,50 @@ for name in _section_names:
 
     _LOG.debug("sub_panel", sub_panel)
 
-    ClassManager.add_class(sub_panel)
-
-
+    _SECTION_PANELS[name] = sub_panel
+    return sub_panel
+
+def ensure_extra_sections_loaded():
+    """Create the scene properties and sub panels for custom and user targets. Scanning for these is postponed
+    until after the addon has been registered, since it means walking all asset roots. With a UI, this is done
+    shortly after startup. In background mode it is only done when this function is called, so scripts which
+    set the scene properties of custom or user targets need to call it first. Calling it again does nothing."""
+    global _EXTRA_SECTIONS_LOADED # pylint: disable=W0603
+    if _EXTRA_SECTIONS_LOADED:
+        return
+    _EXTRA_SECTIONS_LOADED = True
+    extra_sections = _find_extra_sections()
+    new_names = []
+    for name in sorted(extra_sections.keys()):
+        if name in _sections:
+            # There is already a panel for the section, so just add the new categories to it
+            _sections[name]["categories"].extend(extra_sections[name]["categories"])
+            _add_categories(name, extra_sections[name]["categories"])
+        else:
+            _add_section(name, extra_sections[name])
+            new_names.append(name)
+    if new_names:
+        # Keep the panels sorted on section name. This means panels sorting after the first new one are
+        # registered again after it.
+        later_names = [name for name in sorted(_SECTION_PANELS.keys()) if name >= new_names[0]]
+        ClassManager.add_and_register_classes_in_order([_SECTION_PANELS[name] for name in later_names])
+
+def _load_extra_sections():
+    """Timer callback for ensure_extra_sections_loaded()"""
+    ensure_extra_sections_loaded()
+    return None
+
+def cancel_pending_extra_sections_load():
+    """Unregister the timer which calls ensure_extra_sections_loaded() after startup, if it has not fired yet.
+    This is called when the addon is unregistered, so that the timer does not run against unregistered classes."""
+    if bpy.app.timers.is_registered(_load_extra_sections):
+        bpy.app.timers.unregister(_load_extra_sections)
+
+for _name in sorted(list(_sections.keys())):
+    ClassManager.add_class(_add_section(_name, _sections[_name]))
+
+# Headless sessions have no use for the panels, so there the scan only happens if someone asks for it
+if not bpy.app.background:
+    bpy.app.timers.register(_load_extra_sections, first_interval=0.5)
+else:
+    _LOG.warn("Background mode: scene properties for custom and user targets are only created when calling mpfb.ui.model.ensure_extra_sections_loaded()")
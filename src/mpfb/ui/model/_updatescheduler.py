@@ -0,0 +1,92 @@
+"""Coalescing of the updates which follow changes of modeling sliders.
+
+When dragging a slider, its setter is called many times per second. Rather than doing all work in the
+setter, work is scheduled here under a key. A preview is run at the next timer tick, so several changes
+between two ticks lead to one preview. A settle function is run once no change at all has been scheduled
+for the configured update delay. Scheduling with a key that is already pending replaces the pending work
+and moves it last in line.
+
+Timers do not run in background mode, so there all work is done immediately. Operators which use the mesh
+should call flush_pending_updates() first, so that they do not see it as it was before the latest changes."""
+
+import bpy, time
+from mpfb.services.logservice import LogService
+
+_LOG = LogService.get_logger("model.updatescheduler")
+
+_PREVIEWS = dict()
+_SETTLES = dict()
+_LAST_CHANGE = 0.0
+
+# How often pending previews are run while a slider is being dragged
+_PREVIEW_INTERVAL = 1.0 / 30.0
+
+
+def _get_update_delay():
+    from mpfb.ui.model.modelpanel import MODEL_PROPERTIES
+    return MODEL_PROPERTIES.get_value("update_delay", entity_reference=bpy.context.scene)
+
+
+def _run(function):
+    try:
+        function()
+    except ReferenceError:
+        # The object the update was for has been removed since it was scheduled
+        _LOG.debug("Object was removed before scheduled update", function)
+    except Exception as err: # pylint: disable=W0703
+        _LOG.error("Scheduled update failed", err)
+
+
+def _run_pending():
+    previews = list(_PREVIEWS.values())
+    _PREVIEWS.clear()
+    for preview in previews:
+        _run(preview)
+
+    remaining = _LAST_CHANGE + _get_update_delay() - time.monotonic()
+    if remaining > 0.0:
+        return min(remaining, _PREVIEW_INTERVAL)
+
+    settles = list(_SETTLES.values())
+    _SETTLES.clear()
+    for settle in settles:
+        _run(settle)
+
+    if _PREVIEWS or _SETTLES:
+        # Something was scheduled by the settle functions
+        return _PREVIEW_INTERVAL
+    return None
+
+
+def schedule_update(key, preview=None, settle=None):
+    """Schedule a preview and/or a settle function under a key. With an update delay of zero, or when running
+    in background mode, both are run immediately instead."""
+    global _LAST_CHANGE
+
+    if bpy.app.background or _get_update_delay() <= 0.0:
+        if preview:
+            preview()
+        if settle:
+            settle()
+        return
+
+    if preview:
+        _PREVIEWS.pop(key, None)
+        _PREVIEWS[key] = preview
+    if settle:
+        _SETTLES.pop(key, None)
+        _SETTLES[key] = settle
+
+    _LAST_CHANGE = time.monotonic()
+    if not bpy.app.timers.is_registered(_run_pending):
+        bpy.app.timers.register(_run_pending, first_interval=0.0)
+
+
+def flush_pending_updates():
+    """Run all pending previews and settle functions now, including any they schedule in turn."""
+    global _LAST_CHANGE
+    while _PREVIEWS or _SETTLES:
+        _LAST_CHANGE = 0.0
+        _run_pending()
+    if bpy.app.timers.is_registered(_run_pending):
+        bpy.app.timers.unregister(_run_pending)
@@ -33,6 +33,7 @@ class MPFB_PT_Model_Panel(bpy.types.Panel):
         props = [
             "prune",
             "refit",
+            "update_delay",
             "symmetry",
             "hideimg",
             "filter"
@@ -5,6 +5,7 @@ from mpfb.services.logservice import LogService
 from mpfb.services.humanservice import HumanService
 from mpfb.services.objectservice import ObjectService
 from mpfb import ClassManager
+from .._updatescheduler import flush_pending_updates
 
 _LOG = LogService.get_logger("model.refithuman")
 
@@ -16,8 +17,9 @@ class MPFB_OT_RefitHumanOperator(bpy.types.Operator):
 
     def execute(self, context):
 
+        flush_pending_updates()
         blender_object = context.active_object
-        HumanService.refit(blender_object)
+        HumanService.refit(blender_object, force_full=True)
 
         self.report({'INFO'}, "Assets have been refitted")
         return {'FINISHED'}
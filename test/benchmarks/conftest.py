@@ -0,0 +1,114 @@
+"""Timing support for the benchmarks. Each benchmark test gets a "benchmark" fixture, which runs the code to measure a
+number of times and records the timings together with the PrimitiveProfiler breakdown. When the session finishes, all
+results are written as JSON. If a baseline (an earlier results file) is given, benchmarks which are slower than the
+baseline by more than the tolerance fail.
+
+Settings are read from environment variables:
+
+    MPFB_BENCHMARK_ROUNDS: Number of measured runs per benchmark (default 3)
+    MPFB_BENCHMARK_RESULTS: Where to write results (default benchmark_results.json in the current directory)
+    MPFB_BENCHMARK_BASELINE: Results file to compare against (default none)
+    MPFB_BENCHMARK_TOLERANCE: Allowed slowdown relative to the baseline median (default 0.25, ie 25%)
+"""
+
+import bpy, os, sys, json, time, platform, statistics, pytest
+from mpfb.entities.primitiveprofiler import get_registered_profilers, start_profiling, stop_profiling
+
+_ROUNDS = int(os.environ.get("MPFB_BENCHMARK_ROUNDS", "3"))
+_RESULTS_FILE = os.environ.get("MPFB_BENCHMARK_RESULTS", os.path.abspath("benchmark_results.json"))
+_BASELINE_FILE = os.environ.get("MPFB_BENCHMARK_BASELINE")
+_TOLERANCE = float(os.environ.get("MPFB_BENCHMARK_TOLERANCE", "0.25"))
+
+_RESULTS = dict()
+
+
+def _load_baseline():
+    if not _BASELINE_FILE:
+        return dict()
+    with open(_BASELINE_FILE, "r", encoding="utf-8") as json_file:
+        return json.load(json_file)["benchmarks"]
+
+
+_BASELINE = _load_baseline()
+
+
+def _get_profiler_stats():
+    stats = dict()
+    for name, profiler in get_registered_profilers().items():
+        for location, location_stats in profiler.get_stats().items():
+            stats[name + "." + location] = location_stats
+    return stats
+
+
+class _Benchmark:
+
+    def __init__(self, name):
+        self.name = name
+
+    def __call__(self, function, *, setup=None, teardown=None, rounds=None):
+        """Run function the given number of rounds and record the timings. If given, setup is called before each
+        round and should return a tuple with the arguments for function. Teardown is called after each round
+        with the return value of function. Neither setup nor teardown is included in the timings."""
+        rounds = rounds or _ROUNDS
+        timings = []
+        result = None
+
+        start_profiling()
+        try:
+            for _ in range(rounds):
+                args = setup() if setup else ()
+                started = time.perf_counter()
+                result = function(*args)
+                timings.append(time.perf_counter() - started)
+                if teardown:
+                    teardown(result)
+        finally:
+            stop_profiling()
+
+        median = statistics.median(timings)
+        entry = {
+            "rounds": rounds,
+            "first": timings[0],
+            "min": min(timings),
+            "max": max(timings),
+            "mean": statistics.mean(timings),
+            "median": median,
+            "profile": _get_profiler_stats()
+            }
+        _RESULTS[self.name] = entry
+
+        if self.name in _BASELINE:
+            baseline_median = _BASELINE[self.name]["median"]
+            entry["baseline_median"] = baseline_median
+            entry["relative"] = median / baseline_median if baseline_median > 0.0 else None
+            if median > baseline_median * (1.0 + _TOLERANCE):
+                entry["regression"] = True
+                pytest.fail("{} regressed: median {:.4f}s, baseline {:.4f}s".format(self.name, median, baseline_median))
+
+        return result
+
+
+@pytest.fixture
+def benchmark(request):
+    return _Benchmark(request.node.name)
+
+
+def pytest_sessionfinish(session, exitstatus):
+    if not _RESULTS:
+        return
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "blender": bpy.app.version_string,
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "baseline": _BASELINE_FILE,
+        "tolerance": _TOLERANCE,
+        "benchmarks": _RESULTS
+        }
+    with open(_RESULTS_FILE, "w", encoding="utf-8") as json_file:
+        json.dump(report, json_file, indent=4, sort_keys=True)
+    print("\nBenchmark results were written to " + _RESULTS_FILE)
+    for name, entry in _RESULTS.items():
+        relative = entry.get("relative")
+        comparison = "" if relative is None else "  ({:+.0%} vs baseline)".format(relative - 1.0)
+        print("  " + name.ljust(50) + "median={:.4f}s".format(entry["median"]) + comparison)
@@ -0,0 +1,116 @@
+"""Benchmarks for the most common steps of creating and modifying a human."""
+
+import os, pytest
+from mpfb.services.objectservice import ObjectService
+from mpfb.services.humanservice import HumanService
+from mpfb.services.targetservice import TargetService
+from mpfb.services.locationservice import LocationService
+from mpfb.entities.objectproperties import HumanObjectProperties
+
+
+def _testdata(filename):
+    return os.path.join(LocationService.get_mpfb_test("testdata"), filename)
+
+
+def _delete_human(basemesh):
+    for child in ObjectService.get_list_of_children(basemesh.parent or basemesh):
+        ObjectService.delete_object(child)
+    if basemesh.parent:
+        ObjectService.delete_object(basemesh.parent)
+    else:
+        ObjectService.delete_object(basemesh)
+
+
+def _create_rigged_human():
+    basemesh = HumanService.create_human()
+    HumanService.add_builtin_rig(basemesh, "default")
+    return basemesh
+
+
+@pytest.fixture
+def human():
+    basemesh = HumanService.create_human()
+    yield basemesh
+    _delete_human(basemesh)
+
+
+@pytest.fixture
+def rigged_human_with_clothes():
+    basemesh = _create_rigged_human()
+    HumanService.add_mhclo_asset(_testdata("better_socks_low.mhclo"), basemesh, set_up_rigging=True,
+                                 interpolate_weights=True, import_subrig=False, import_weights=True)
+    yield basemesh
+    _delete_human(basemesh)
+
+
+def test_create_human(benchmark):
+    """HumanService.create_human()"""
+    basemesh = benchmark(HumanService.create_human, teardown=_delete_human)
+    assert basemesh is not None
+
+
+def test_macro_slider_change(benchmark, human):
+    """TargetService.reapply_macro_details() after changing a macro"""
+    basemesh = human
+    values = iter([0.0, 1.0] * 50)
+
+    def change_gender():
+        HumanObjectProperties.set_value("gender", next(values), entity_reference=basemesh)
+        TargetService.reapply_macro_details(basemesh)
+
+    benchmark(change_gender, rounds=10)
+
+
+def test_import_mhm(benchmark):
+    """HumanService.deserialize_from_mhm()"""
+    deser = HumanService.get_default_deserialization_settings()
+    deser["clothes_deep_search"] = False
+    deser["bodypart_deep_search"] = False
+    basemesh = benchmark(HumanService.deserialize_from_mhm, setup=lambda: (_testdata("testchar.mhm"), deser),
+                         teardown=_delete_human)
+    assert basemesh is not None
+
+
+def test_add_rig(benchmark):
+    """HumanService.add_builtin_rig()"""
+    basemeshes = []
+
+    def setup():
+        basemeshes.append(HumanService.create_human())
+        return (basemeshes[-1], "default")
+
+    benchmark(HumanService.add_builtin_rig, setup=setup, teardown=lambda rig: _delete_human(basemeshes[-1]))
+
+
+def test_add_clothes_with_weight_interpolation(benchmark):
+    """HumanService.add_mhclo_asset() with interpolated weights"""
+    basemeshes = []
+
+    def setup():
+        basemeshes.append(_create_rigged_human())
+        return (_testdata("better_socks_low.mhclo"), basemeshes[-1])
+
+    def add_clothes(mhclo_file, basemesh):
+        return HumanService.add_mhclo_asset(mhclo_file, basemesh, set_up_rigging=True, interpolate_weights=True,
+                                            import_subrig=False, import_weights=True)
+
+    benchmark(add_clothes, setup=setup, teardown=lambda clothes: _delete_human(basemeshes[-1]))
+
+
+def test_refit(benchmark, rigged_human_with_clothes):
+    """HumanService.refit() after changing a macro"""
+    basemesh = rigged_human_with_clothes
+    values = iter([0.0, 1.0] * 50)
+
+    def setup():
+        HumanObjectProperties.set_value("gender", next(values), entity_reference=basemesh)
+        TargetService.reapply_macro_details(basemesh)
+        return (basemesh,)
+
+    benchmark(HumanService.refit, setup=setup)
+
+
+def test_serialize(benchmark, rigged_human_with_clothes):
+    """HumanService.serialize_to_json_string()"""
+    json_string = benchmark(HumanService.serialize_to_json_string, setup=lambda: (rigged_human_with_clothes, True))
+    assert json_string
@@ -7,7 +7,11 @@ if "TEST_MODULE" in os.environ:
     tests = os.path.abspath(os.path.join(tests, "..", os.environ['TEST_MODULE']))
     print("TEST_MODULE is set: " + tests)
 
-retcode = pytest.main(["-v", "--capture=tee-sys", "--cov-report", "html:coverage", "--cov", "-x", tests])
+if os.path.basename(tests) == "benchmarks":
+    # Coverage tracing would distort the timings
+    retcode = pytest.main(["-v", "--capture=tee-sys", tests])
+else:
+    retcode = pytest.main(["-v", "--capture=tee-sys", "--cov-report", "html:coverage", "--cov", "-x", tests])
 if retcode:
     print("Unit tests have finished with error code " + str(retcode) + ". See console output for results.")
 else:
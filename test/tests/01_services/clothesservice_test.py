@@ -0,0 +1,26 @@
+import os, numpy
+from mpfb.services.objectservice import ObjectService
+from mpfb.services.humanservice import HumanService
+from mpfb.services.locationservice import LocationService
+from mpfb.services.clothesservice import ClothesService
+from mpfb.entities.clothes.mhclo import Mhclo
+
+def _mhclo_file():
+    testdata = LocationService.get_mpfb_test("testdata")
+    return os.path.join(testdata, "better_socks_low.mhclo")
+
+def test_clothesservice_exists():
+    """ClothesService"""
+    assert ClothesService is not None, "ClothesService can be imported"
+
+def test_mhclo_depends_on_vertices():
+    """ClothesService.mhclo_depends_on_vertices()"""
+    basemesh = HumanService.create_human()
+    assert basemesh is not None
+    mhclo = Mhclo()
+    mhclo.load(_mhclo_file())
+    changed = numpy.zeros(len(basemesh.data.vertices), dtype=bool)
+    assert not ClothesService.mhclo_depends_on_vertices(mhclo, changed)
+    changed[mhclo.vert_indices[0][0]] = True
+    assert ClothesService.mhclo_depends_on_vertices(mhclo, changed)
+    ObjectService.delete_object(basemesh)
@@ -109,6 +109,29 @@ def test_deserialize_from_mhm():
 
     ObjectService.delete_object(basemesh)
 
+def test_create_humans_in_batch():
+    """HumanService.create_humans_in_batch()"""
+    sources = []
+    for i in range(2):
+        human_info = HumanService._create_default_human_info_dict()
+        human_info["name"] = ObjectService.random_name()
+        sources.append(human_info)
+
+    deser = HumanService.get_default_deserialization_settings()
+
+    basemeshes, report = HumanService.create_humans_in_batch(sources, deser)
+    assert len(basemeshes) == 2
+    assert basemeshes[0] != basemeshes[1]
+    assert basemeshes[0].data != basemeshes[1].data
+    for basemesh in basemeshes:
+        assert getattr(basemesh, 'MPFB_GEN_object_type') == "Basemesh"
+    assert len(report["humans"]) == 2
+    assert "create_human" in report["stages"]
+    assert report["total"] > 0.0
+
+    for basemesh in basemeshes:
+        ObjectService.delete_object(basemesh)
+
 def test_serialize_to_json_string():
     """HumanService.serialize_to_json_string()"""
     obj = HumanService.create_human()
@@ -123,3 +146,25 @@ def test_serialize_to_json_string():
 
     ObjectService.delete_object(obj)
 
+
+def test_refit_snapshot_is_dropped():
+    """HumanService.refit() -- the snapshot is dropped when adding assets, and pruned once the basemesh is deleted"""
+    from mpfb.services.humanservice import _REFIT_COORDS
+    testdata = LocationService.get_mpfb_test("testdata")
+    mhclo_file = os.path.join(testdata, "better_socks_low.mhclo")
+    basemesh = HumanService.create_human()
+    HumanService.refit(basemesh)
+    refit_key = (basemesh.as_pointer(), basemesh.name)
+    assert refit_key in _REFIT_COORDS
+    clothes = HumanService.add_mhclo_asset(mhclo_file, basemesh, set_up_rigging=False, interpolate_weights=False, import_subrig=False, import_weights=False)
+    assert refit_key not in _REFIT_COORDS
+    HumanService.refit(basemesh)
+    assert refit_key in _REFIT_COORDS
+    ObjectService.delete_object(clothes)
+    ObjectService.delete_object(basemesh)
+    other_basemesh = HumanService.create_human()
+    HumanService.refit(other_basemesh)
+    other_key = (other_basemesh.as_pointer(), other_basemesh.name)
+    assert other_key in _REFIT_COORDS
+    assert refit_key == other_key or refit_key not in _REFIT_COORDS
+    ObjectService.delete_object(other_basemesh)
@@ -0,0 +1,32 @@
+import numpy
+from mpfb.services.jsoncall import JsonCall, COMPACT_MAGIC
+
+def test_jsoncall_exists():
+    """JsonCall"""
+    assert JsonCall is not None, "JsonCall can be imported"
+
+def test_serialize_roundtrip():
+    """JsonCall.serialize()"""
+    call = JsonCall("someFunction", params={"uuid": "abc", "values": [1, 2.5, 3]}, data={"nested": {"a": 1}})
+    other = JsonCall("")
+    other.populate_from_json(call.serialize())
+    assert other.function == "someFunction"
+    assert other.params == {"uuid": "abc", "values": [1, 2.5, 3]}
+    assert other.data == {"nested": {"a": 1}}
+
+def test_serialize_compact_roundtrip():
+    """JsonCall.serialize_compact()"""
+    coords = numpy.random.rand(500, 3).astype(numpy.float32)
+    indices = list(range(200))
+    call = JsonCall("someFunction", params={"uuid": "abc", "short": [1, 2, 3]}, data={"coords": coords, "indices": indices, "empty": numpy.zeros(0, dtype=numpy.int32)})
+    compact = call.serialize_compact()
+    assert compact.startswith(COMPACT_MAGIC)
+    assert len(compact) < coords.nbytes + len(indices) * 8 + 500
+    other = JsonCall("")
+    other.populate_from_compact(compact)
+    assert other.function == "someFunction"
+    assert other.params == {"uuid": "abc", "short": [1, 2, 3]}
+    assert numpy.array_equal(other.data["coords"], coords)
+    assert other.data["coords"].dtype == numpy.float32
+    assert numpy.array_equal(other.data["indices"], numpy.arange(200))
+    assert len(other.data["empty"]) == 0
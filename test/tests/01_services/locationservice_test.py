@@ -8,3 +8,12 @@ def test_locationservice_exists():
 def test_mpfb_root():
     assert os.path.exists(LocationService.get_mpfb_root()), "MPFB root directory exists"
     assert os.path.exists(LocationService.get_mpfb_root("data")), "MPFB root directory contains a data subdir"
+
+def test_deferred_mh_user_data_discovery():
+    """The discovery function is run once, when the mh user data is first asked for"""
+    calls = []
+    LocationService.defer_mh_user_data_discovery(lambda: calls.append(True))
+    assert not calls
+    LocationService.is_mh_user_data_enabled()
+    LocationService.get_mh_user_data()
+    assert len(calls) == 1
@@ -240,6 +240,14 @@ def test_load_base_mesh():
     # TODO: Tests for scale, vertex groups
     ObjectService.delete_object(basemesh)
 
+def test_get_vertex_indexes_for_vertex_group():
+    basemesh = ObjectService.load_base_mesh()
+    groups = ObjectService.get_base_mesh_vertex_group_definition()
+    indexes = ObjectService.get_vertex_indexes_for_vertex_group(basemesh, "body")
+    assert indexes == sorted(groups["body"])
+    assert ObjectService.get_vertex_indexes_for_vertex_group(basemesh, "no-such-group") == []
+    ObjectService.delete_object(basemesh)
+
 def test_get_selected_objects():
     non_mh_mesh_1 = ObjectService.create_blender_object_with_mesh(ObjectService.random_name())
     mh_mesh_1 = ObjectService.create_blender_object_with_mesh(ObjectService.random_name())
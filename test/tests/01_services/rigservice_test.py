@@ -0,0 +1,36 @@
+import os, json, numpy
+from mpfb.services.locationservice import LocationService
+from mpfb.services.rigservice import RigService, _LOADED_COMPILED_WEIGHTS
+
+def _weights_file():
+    rigs_dir = LocationService.get_mpfb_data("rigs")
+    return os.path.join(rigs_dir, "standard", "weights.game_engine.json")
+
+def test_rigservice_exists():
+    """RigService"""
+    assert RigService is not None, "RigService can be imported"
+
+def test_compile_weights():
+    """RigService.compile_weights()"""
+    compiled = RigService.compile_weights({"weights": {"a": [[1, 0.5], [2, 0.25]], "b": [], "c": [[7, 1.0]]}})
+    assert compiled["groups"] == ["a", "b", "c"]
+    assert list(compiled["offsets"]) == [0, 2, 2, 3]
+    assert list(compiled["indices"]) == [1, 2, 7]
+    assert list(compiled["weights"]) == [0.5, 0.25, 1.0]
+
+def test_compiled_weights_match_source(own_compiled_files):
+    """RigService.load_compiled_weights()"""
+    cache_path = RigService.compiled_weights_path(_weights_file())
+    own_compiled_files(cache_path, loaded=_LOADED_COMPILED_WEIGHTS)
+
+    with open(_weights_file(), "r") as json_file:
+        expected = RigService.compile_weights(json.load(json_file))
+    RigService.load_compiled_weights(_weights_file())
+    assert os.path.exists(cache_path)
+
+    # Forget the in-process copy, so that the next load has to use the compiled file
+    _LOADED_COMPILED_WEIGHTS.pop(cache_path)
+    compiled = RigService.load_compiled_weights(_weights_file())
+    assert compiled["groups"] == expected["groups"]
+    for field in ["offsets", "indices", "weights"]:
+        assert numpy.array_equal(compiled[field], expected[field])
@@ -0,0 +1,165 @@
+import socketserver, threading, struct, numpy, pytest
+from mpfb.services.socketservice import SocketService, _SocketService, _FRAMED_HELLO, _FRAME_HEADER
+from mpfb.services.jsoncall import JsonCall, COMPACT_MAGIC
+
+
+class _StandInHandler(socketserver.BaseRequestHandler):
+    """Answers calls the way the MakeHuman socket plugin would, with canned data."""
+
+    def _respond(self, call, compact):
+        function = call.function
+        uuid = call.get_param("uuid") or ""
+        self.server.calls.append(function)
+        response = JsonCall(function)
+        if function == "getProtocolInfo":
+            if not self.server.framing:
+                response.set_error("Unknown function")
+                return response.serialize().encode()
+            response.set_data({"framing": ["length-prefixed"], "encodings": ["compact"]})
+        elif function.endswith("Binary") or function in ["getProxyWeightsVertList", "getProxyWeights", "getBodyWeightsVertList", "getBodyWeights"]:
+            return (function + ":" + uuid).encode()
+        elif function == "echoParams":
+            response.set_data(call.params)
+        else:
+            response.set_data({"function": function, "uuid": uuid})
+        if compact:
+            return response.serialize_compact()
+        return response.serialize().encode()
+
+    @staticmethod
+    def _parse(message):
+        """Return the call in the message, or None if the message is not complete yet."""
+        call = JsonCall("")
+        try:
+            if message.startswith(COMPACT_MAGIC):
+                call.populate_from_compact(message)
+            else:
+                call.populate_from_json(message.decode())
+        except (ValueError, struct.error):
+            return None
+        return call
+
+    def _receive(self, buffer):
+        data = self.request.recv(65536)
+        if not data:
+            raise EOFError()
+        return buffer + data
+
+    def handle(self):
+        self.server.connections = self.server.connections + 1
+        buffer = b""
+        try:
+            buffer = self._receive(buffer)
+            if not buffer.startswith(_FRAMED_HELLO[:len(buffer)]) or not self.server.framing:
+                call = self._parse(buffer)
+                while call is None:
+                    buffer = self._receive(buffer)
+                    call = self._parse(buffer)
+                self.request.sendall(self._respond(call, buffer.startswith(COMPACT_MAGIC)))
+                return
+            while len(buffer) < len(_FRAMED_HELLO):
+                buffer = self._receive(buffer)
+            buffer = buffer[len(_FRAMED_HELLO):]
+            while True:
+                while len(buffer) < _FRAME_HEADER.size:
+                    buffer = self._receive(buffer)
+                (length,) = _FRAME_HEADER.unpack(buffer[:_FRAME_HEADER.size])
+                while len(buffer) < _FRAME_HEADER.size + length:
+                    buffer = self._receive(buffer)
+                message = buffer[_FRAME_HEADER.size:_FRAME_HEADER.size + length]
+                buffer = buffer[_FRAME_HEADER.size + length:]
+                response = self._respond(self._parse(message), message.startswith(COMPACT_MAGIC))
+                self.request.sendall(_FRAME_HEADER.pack(len(response)) + response)
+        except EOFError:
+            pass
+
+
+class _StandInServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, framing):
+        socketserver.ThreadingTCPServer.__init__(self, ("127.0.0.1", 0), _StandInHandler)
+        self.framing = framing
+        self.connections = 0
+        self.calls = []
+
+
+def _start_stand_in_server(framing):
+    server = _StandInServer(framing)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    service = _SocketService()
+    service.set_port(server.server_address[1])
+    return (server, service)
+
+
+@pytest.fixture
+def framed_server():
+    (server, service) = _start_stand_in_server(True)
+    yield (server, service)
+    service.close()
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def legacy_server():
+    (server, service) = _start_stand_in_server(False)
+    yield (server, service)
+    service.close()
+    server.shutdown()
+    server.server_close()
+
+
+def test_socketservice_exists():
+    """SocketService"""
+    assert SocketService is not None, "SocketService can be imported"
+
+
+def test_legacy_server_gets_one_connection_per_call(legacy_server):
+    """SocketService -- server without framing"""
+    (server, service) = legacy_server
+    assert service.get_body_vertices() == bytearray(b"getBodyVerticesBinary:")
+    assert service.get_proxy_weight_info("abc") == {"function": "getProxyWeightInfo", "uuid": "abc"}
+    assert server.connections == 3  # getProtocolInfo + two calls
+
+
+def test_framed_server_reuses_connection(framed_server):
+    """SocketService -- server with framing"""
+    (server, service) = framed_server
+    assert service.get_body_vertices() == bytearray(b"getBodyVerticesBinary:")
+    assert service.get_proxy_faces("abc") == bytearray(b"getProxyFacesBinary:abc")
+    assert service.get_body_mesh_info() == {"function": "getBodyMeshInfo", "uuid": ""}
+    assert server.connections == 2  # getProtocolInfo + one persistent connection
+
+
+@pytest.mark.parametrize("framing", [True, False])
+def test_get_proxies_mesh_data(framing):
+    """SocketService.get_proxies_mesh_data()"""
+    (server, service) = _start_stand_in_server(framing)
+    try:
+        uuids = ["uuid" + str(i) for i in range(10)]
+        proxies_data = service.get_proxies_mesh_data(uuids, include_weights=True)
+        assert len(proxies_data) == 10
+        for uuid in uuids:
+            assert proxies_data[uuid]["vertices"] == bytearray(("getProxyVerticesBinary:" + uuid).encode())
+            assert proxies_data[uuid]["uv_mapping"] == bytearray(("getProxyFaceUVMappingsBinary:" + uuid).encode())
+            assert proxies_data[uuid]["weights"] == bytearray(("getProxyWeights:" + uuid).encode())
+            assert proxies_data[uuid]["weight_info"]["uuid"] == uuid
+        assert len(server.calls) == 1 + 10 * 7
+    finally:
+        service.close()
+        server.shutdown()
+        server.server_close()
+
+
+def test_compact_encoding_sends_arrays_as_attachments(framed_server):
+    """SocketService -- compact encoding"""
+    (server, service) = framed_server
+    values = numpy.arange(1000, dtype=numpy.float32)
+    call = JsonCall("echoParams", params={"values": values, "faces": [[1, 2, 3, 4]] * 100, "name": "test"})
+    service._run(service._call_for_json(call))
+    assert isinstance(call.data["values"], numpy.ndarray)
+    assert numpy.array_equal(call.data["values"], values)
+    assert call.data["faces"].shape == (100, 4)
+    assert call.data["name"] == "test"
@@ -1,9 +1,10 @@
-import bpy, os
+import bpy, bmesh, os, numpy
 from pytest import approx
 from mpfb.services.objectservice import ObjectService
 from mpfb.services.humanservice import HumanService
 from mpfb.services.locationservice import LocationService
-from mpfb.services.targetservice import TargetService
+from mpfb.services.targetservice import TargetService, _LOADED_COMPILED_TARGETS
+from mpfb.entities.objectproperties import HumanObjectProperties
 
 def test_targetservice_exists():
     """TargetService"""
@@ -34,6 +35,9 @@ def test_prune_shapekeys():
 
     ObjectService.activate_blender_object(obj, deselect_all=True)
 
+    # Macro details are mixed into a single shape key, so load a separate target to prune
+    TargetService.load_target(obj, TargetService.target_full_path("nose-trans-up"), weight=0.5)
+
     shapekey_names = []
 
     for shapekey in obj.data.shape_keys.key_blocks:
@@ -57,3 +61,169 @@ def test_prune_shapekeys():
     TargetService.prune_shapekeys(obj)
 
     assert "yadayada" in obj.data.shape_keys.key_blocks
+
+def test_compiled_target_matches_source(own_compiled_files):
+    """TargetService.load_compiled_target()"""
+    testdata = LocationService.get_mpfb_test("testdata")
+    target_file = os.path.join(testdata, "autotest.target")
+    assert os.path.exists(target_file)
+
+    target_string = TargetService._read_target_file(target_file)
+    info = TargetService._target_string_to_shape_key_info(target_string, "autotest")
+    assert len(info["vertices"]) > 0
+
+    own_compiled_files(TargetService.compiled_target_path(target_file), loaded=_LOADED_COMPILED_TARGETS)
+    assert not os.path.exists(TargetService.compiled_target_path(target_file))
+
+    compiled = TargetService.load_compiled_target(target_file)
+    assert os.path.exists(TargetService.compiled_target_path(target_file))
+    assert len(compiled) == len(info["vertices"])
+
+    for i, (index, x, y, z) in enumerate(info["vertices"]):
+        assert compiled["index"][i] == index
+        assert compiled["offset"][i][0] == approx(x)
+        assert compiled["offset"][i][1] == approx(y)
+        assert compiled["offset"][i][2] == approx(z)
+
+    cached = TargetService.load_compiled_target(target_file)
+    assert len(cached) == len(compiled)
+
+def test_load_target_from_compiled_cache():
+    """TargetService.load_target() -- via compiled cache"""
+    testdata = LocationService.get_mpfb_test("testdata")
+    target_file = os.path.join(testdata, "autotest.target")
+    obj = HumanService.create_human()
+    assert obj is not None
+
+    shape_key = TargetService.load_target(obj, target_file, weight=1.0, name="autotest")
+    assert shape_key is not None
+    assert shape_key.value == approx(1.0)
+
+    info = TargetService._target_string_to_shape_key_info(TargetService._read_target_file(target_file), "autotest")
+    scale_factor = getattr(obj, 'MPFB_GEN_scale_factor')
+    (index, x, y, z) = info["vertices"][0]
+    offset = shape_key.data[index].co - shape_key.relative_key.data[index].co
+    assert offset[0] == approx(x * scale_factor, abs=0.0001)
+    assert offset[1] == approx(y * scale_factor, abs=0.0001)
+    assert offset[2] == approx(z * scale_factor, abs=0.0001)
+    ObjectService.delete_object(obj)
+
+def test_shape_key_as_dict_roundtrip():
+    """TargetService.get_shape_key_as_dict() -- roundtrip via target string"""
+    testdata = LocationService.get_mpfb_test("testdata")
+    target_file = os.path.join(testdata, "autotest.target")
+    obj = HumanService.create_human()
+    assert obj is not None
+
+    target_string = TargetService._read_target_file(target_file)
+    TargetService.target_string_to_shape_key(target_string, "autotest", obj)
+    expected = TargetService._target_string_to_shape_key_info(target_string, "autotest")
+    info = TargetService.get_shape_key_as_dict(obj, "autotest")
+
+    assert len(info["vertices"]) == len(expected["vertices"])
+    for actual_vert, expected_vert in zip(info["vertices"], expected["vertices"]):
+        assert actual_vert[0] == expected_vert[0]
+        assert actual_vert[1] == approx(expected_vert[1], abs=0.0001)
+        assert actual_vert[2] == approx(expected_vert[2], abs=0.0001)
+        assert actual_vert[3] == approx(expected_vert[3], abs=0.0001)
+
+    everything = TargetService.get_shape_key_as_dict(obj, "autotest", only_modified_verts=False)
+    assert len(everything["vertices"]) == len(obj.data.vertices)
+    ObjectService.delete_object(obj)
+
+def test_target_full_path():
+    """TargetService.target_full_path()"""
+    path = TargetService.target_full_path("nose-trans-up")
+    assert path is not None
+    assert os.path.exists(path)
+    assert os.path.basename(path) == "nose-trans-up.target.gz"
+    assert TargetService.target_full_path("nose-trans-up") == path
+    assert TargetService.target_full_path("yadayada-no-such-target") is None
+
+def test_reapply_macro_details_combined():
+    """TargetService.reapply_macro_details()"""
+    obj = HumanService.create_human()
+    assert obj is not None
+
+    macro_keys = TargetService.get_current_macro_targets(obj, decode_names=False)
+    assert macro_keys == ["$md-combined"]
+    assert obj.data.shape_keys.key_blocks["$md-combined"].value == approx(1.0)
+
+    macro_info = TargetService.get_macro_info_dict_from_basemesh(obj)
+    vertex_count = len(obj.data.vertices)
+    expected = TargetService.calculate_macro_offsets(macro_info, vertex_count)
+    info = TargetService.get_shape_key_as_dict(obj, "$md-combined", only_modified_verts=False)
+    for i in [0, 100, 5000, vertex_count - 1]:
+        assert info["vertices"][i][1] == approx(expected[i][0], abs=0.0001)
+        assert info["vertices"][i][2] == approx(expected[i][1], abs=0.0001)
+        assert info["vertices"][i][3] == approx(expected[i][2], abs=0.0001)
+
+    HumanObjectProperties.set_value("gender", 1.0, entity_reference=obj)
+    TargetService.reapply_macro_details(obj)
+    assert TargetService.get_current_macro_targets(obj, decode_names=False) == ["$md-combined"]
+    male_info = TargetService.get_shape_key_as_dict(obj, "$md-combined", only_modified_verts=False)
+    assert male_info["vertices"] != info["vertices"]
+    ObjectService.delete_object(obj)
+
+def _delete_helper_vertices(basemesh):
+    group_indices = set(group.index for group in basemesh.vertex_groups if group.name in ["HelperGeometry", "JointCubes"])
+    assert len(group_indices) > 0
+    bm = bmesh.new()
+    bm.from_mesh(basemesh.data)
+    deform = bm.verts.layers.deform.active
+    helpers = [vertex for vertex in bm.verts if group_indices.intersection(vertex[deform].keys())]
+    bmesh.ops.delete(bm, geom=helpers, context="VERTS")
+    bm.to_mesh(basemesh.data)
+    bm.free()
+    basemesh.data.update()
+
+def test_calculate_macro_offsets_without_helpers():
+    """TargetService.calculate_macro_offsets() for a mesh where the helper vertices have been deleted"""
+    obj = HumanService.create_human()
+    assert obj is not None
+    full_count = len(obj.data.vertices)
+    _delete_helper_vertices(obj)
+    body_count = len(obj.data.vertices)
+    assert 0 < body_count < full_count
+
+    # Offsets for the deleted helper vertices are dropped, the rest are kept
+    indices = numpy.arange(full_count)
+    offsets = numpy.ones((full_count, 3), dtype=numpy.float32)
+    (clipped_indices, clipped_offsets) = TargetService._clip_offsets_to_vertex_count(indices, offsets, body_count)
+    assert list(clipped_indices) == list(range(body_count))
+    assert clipped_offsets.shape == (body_count, 3)
+
+    macro_info = TargetService.get_macro_info_dict_from_basemesh(obj)
+    full = TargetService.calculate_macro_offsets(macro_info, full_count)
+    body = TargetService.calculate_macro_offsets(macro_info, body_count)
+    assert body.shape == (body_count, 3)
+    assert numpy.allclose(body, full[:body_count])
+
+    # Targets still include the helper vertices, which must not make loading fail
+    TargetService.reapply_macro_details(obj)
+    shape_key = TargetService.load_target(obj, TargetService.target_full_path("nose-trans-up"), weight=1.0, name="nose-trans-up")
+    assert len(shape_key.data) == body_count
+    ObjectService.delete_object(obj)
+
+def test_get_target_values_follows_shape_keys():
+    """TargetService.get_target_values()"""
+    obj = HumanService.create_human()
+    assert obj is not None
+    ObjectService.activate_blender_object(obj, deselect_all=True)
+
+    target_values = TargetService.get_target_values(obj)
+    assert "Basis" not in target_values
+    assert TargetService.get_target_values(obj) is target_values
+    assert not TargetService.has_target(obj, "nose-trans-up")
+
+    TargetService.load_target(obj, TargetService.target_full_path("nose-trans-up"), weight=0.5, name="nose-trans-up")
+    assert TargetService.has_target(obj, "nose-trans-up")
+    assert TargetService.get_target_value(obj, "nose-trans-up") == approx(0.5)
+
+    obj.data.shape_keys.key_blocks["nose-trans-up"].value = 0.25
+    assert TargetService.get_target_value(obj, "nose-trans-up") == approx(0.25)
+
+    TargetService.set_target_value(obj, "nose-trans-up", 0.0, delete_target_on_zero=True)
+    assert not TargetService.has_target(obj, "nose-trans-up")
+    assert TargetService.get_target_value(obj, "nose-trans-up") == 0.0
+    ObjectService.delete_object(obj)
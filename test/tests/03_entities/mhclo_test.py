@@ -0,0 +1,46 @@
+import os
+from pytest import approx
+from mpfb.services.locationservice import LocationService
+from mpfb.entities.clothes.mhclo import Mhclo, _LOADED_MHCLOS
+
+def _mhclo_file():
+    testdata = LocationService.get_mpfb_test("testdata")
+    return os.path.join(testdata, "better_socks_low.mhclo")
+
+def _forget_loaded_mhclo():
+    realpath = os.path.realpath(_mhclo_file())
+    stat = os.stat(realpath)
+    _LOADED_MHCLOS.pop((realpath, stat.st_mtime_ns, stat.st_size), None)
+
+def test_mhclo_load():
+    """Mhclo.load()"""
+    mhclo = Mhclo()
+    mhclo.load(_mhclo_file())
+    assert mhclo.uuid == "448e51b5-aa13-4b7f-bfff-dd4f183efc4b"
+    assert mhclo.obj_file
+    assert len(mhclo.vert_indices) > 0
+    assert mhclo.vert_indices.shape == mhclo.vert_weights.shape == mhclo.vert_offsets.shape
+    assert mhclo.vert_indices.shape[1] == 3
+
+def test_mhclo_compiled_matches_source(own_compiled_files):
+    """Mhclo.load() -- compiled cache"""
+    compiled_path = Mhclo.compiled_mhclo_path(_mhclo_file())
+    own_compiled_files(compiled_path + ".json", compiled_path + ".npy")
+    _forget_loaded_mhclo()
+
+    parsed = Mhclo()
+    parsed.load(_mhclo_file())
+    assert os.path.exists(compiled_path + ".json")
+    assert os.path.exists(compiled_path + ".npy")
+
+    # Forget the in-process copy, so that the next load has to use the compiled files
+    _forget_loaded_mhclo()
+
+    compiled = Mhclo()
+    compiled.load(_mhclo_file())
+    assert compiled.uuid == parsed.uuid
+    assert compiled.x_scale == parsed.x_scale
+    assert (compiled.vert_indices == parsed.vert_indices).all()
+    assert compiled.vert_weights.tolist() == approx(parsed.vert_weights.tolist())
+    assert list(compiled.delverts) == list(parsed.delverts)
+    assert compiled.verts[0]["verts"] == parsed.verts[0]["verts"]
@@ -0,0 +1,64 @@
+import os, json
+from mpfb.services.locationservice import LocationService
+from mpfb.entities.primitiveprofiler import PrimitiveProfiler, start_profiling, stop_profiling, get_trace_events, export_chrome_trace, export_speedscope
+
+def _recurse(profiler, depth):
+    with profiler.section("recurse"):
+        if depth > 0:
+            _recurse(profiler, depth - 1)
+
+def test_profiler_disabled_records_nothing():
+    """PrimitiveProfiler -- disabled"""
+    start_profiling()
+    stop_profiling()
+    profiler = PrimitiveProfiler("test")
+    profiler.enter("outer")
+    profiler.leave("outer")
+    assert profiler.get_stats() == {}
+    assert get_trace_events() == []
+
+def test_profiler_nesting_and_recursion():
+    """PrimitiveProfiler -- nested sections"""
+    profiler = PrimitiveProfiler("test")
+
+    @profiler.profile()
+    def decorated():
+        _recurse(profiler, 3)
+
+    start_profiling()
+    decorated()
+    profiler.enter("never_left")
+    stop_profiling()
+
+    stats = profiler.get_stats()
+    assert stats["decorated"]["count"] == 1
+    assert stats["recurse"]["count"] == 4
+    assert stats["never_left"]["count"] == 1
+    assert stats["recurse"]["max"] <= stats["decorated"]["total"]
+    phases = [event[0] for event in get_trace_events()]
+    assert phases == ["B"] * 5 + ["E"] * 5 + ["B", "E"]
+
+def test_profiler_export():
+    """PrimitiveProfiler -- export"""
+    profiler = PrimitiveProfiler("test")
+    start_profiling()
+    _recurse(profiler, 2)
+    stop_profiling()
+
+    cache = LocationService.get_user_cache()
+    chrome_file = os.path.join(cache, "test_profile.trace.json")
+    export_chrome_trace(chrome_file)
+    with open(chrome_file, "r") as json_file:
+        trace = json.load(json_file)
+    assert len(trace["traceEvents"]) == 6
+    assert trace["traceEvents"][0]["name"] == "recurse"
+
+    speedscope_file = os.path.join(cache, "test_profile.speedscope.json")
+    export_speedscope(speedscope_file)
+    with open(speedscope_file, "r") as json_file:
+        speedscope = json.load(json_file)
+    assert speedscope["shared"]["frames"] == [{"name": "test.recurse"}]
+    assert [event["type"] for event in speedscope["profiles"][0]["events"]] == ["O", "O", "O", "C", "C", "C"]
+
+    os.remove(chrome_file)
+    os.remove(speedscope_file)
@@ -0,0 +1,33 @@
+import os, pytest
+from mpfb.services.locationservice import LocationService
+from mpfb.services.humanservice import HumanService
+from mpfb.services.objectservice import ObjectService
+from mpfb.entities.rig import Rig, CUR_VERSION
+
+def _rig_file():
+    rigs_dir = LocationService.get_mpfb_data("rigs")
+    return os.path.join(rigs_dir, "standard", "rig.default.json")
+
+def test_load_rig_definition():
+    """Rig.load_rig_definition()"""
+    rig_header = Rig.load_rig_definition(_rig_file())
+    assert rig_header["version"] == CUR_VERSION
+    assert "root" in rig_header["bones"]
+
+def test_load_rig_definition_is_cached_and_read_only():
+    """Rig.load_rig_definition() -- cache"""
+    rig_header = Rig.load_rig_definition(_rig_file())
+    assert Rig.load_rig_definition(_rig_file()) is rig_header
+    with pytest.raises(TypeError):
+        rig_header["bones"]["root"]["parent"] = "spine01"
+
+def test_get_joint_vertex_groups_is_cached():
+    """Rig.get_joint_vertex_groups() -- cache"""
+    basemesh = HumanService.create_human()
+    joint_groups = Rig.get_joint_vertex_groups(basemesh)
+    assert len(joint_groups) > 0
+    assert all("joint" in name for name in joint_groups)
+    assert Rig.get_joint_vertex_groups(basemesh) is joint_groups
+    basemesh.vertex_groups.new(name="joint-test")
+    assert Rig.get_joint_vertex_groups(basemesh) is not joint_groups
+    ObjectService.delete_object(basemesh)
@@ -0,0 +1,29 @@
+"""Shared fixtures for the unit tests."""
+
+import os, pytest
+
+
+def _remove_if_exists(path):
+    if os.path.exists(path):
+        os.remove(path)
+
+
+@pytest.fixture
+def own_compiled_files():
+    """Tests of the compiled caches use this instead of clearing the whole cache, which would throw away the
+    user's compiled files. Call it with the cache paths the test is about to produce, and optionally the dict
+    with the in-process copies keyed on these paths. The files and copies are removed right away, so that the
+    test starts from source, and the files are removed again when the test is done."""
+    paths = []
+
+    def remove(*cache_paths, loaded=None):
+        for path in cache_paths:
+            paths.append(path)
+            _remove_if_exists(path)
+            if loaded is not None:
+                loaded.pop(path, None)
+
+    yield remove
+
+    for path in paths:
+        _remove_if_exists(path)